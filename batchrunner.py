@@ -2,28 +2,41 @@
 # =============================================================================
 # When running this file the batchrunner will be used for the model. 
 # No visulaization will happen.
+#
+# The runs are spread over all cores (see formation_flying/batch.py). Every run
+# has its own seed, derived from batch_seed, so the batch can be repeated.
+# The results of every run are written to results_folder as soon as it is
+# finished (see formation_flying/results.py), read them with load_results.
 # =============================================================================
 '''
-from mesa.batchrunner import BatchRunner
+from formation_flying.batch import ParallelBatchRunner
+from formation_flying.results import ResultSink, export_excel
 from formation_flying.model import FormationFlying
 from formation_flying.parameters import model_params, max_steps, n_iterations, model_reporter_parameters, agent_reporter_parameters, variable_params
 
+batch_seed = 0
+results_folder = f"results/{n_iterations}_CNP_airport2"
+# Also export the results to Excel (slow for many iterations)
+excel_export = False
 
-batch_run = BatchRunner(FormationFlying,
-                        fixed_parameters=model_params,
-                        variable_parameters=variable_params,
-                        iterations=n_iterations,
-                        max_steps=max_steps,
-                        model_reporters=model_reporter_parameters,
-                        agent_reporters=agent_reporter_parameters
-                        )
+# The guard is needed for the process pool on platforms that spawn new processes (Windows, macOS)
+if __name__ == "__main__":
+    batch_run = ParallelBatchRunner(FormationFlying,
+                                    fixed_parameters=model_params,
+                                    variable_parameters=variable_params,
+                                    iterations=n_iterations,
+                                    max_steps=max_steps,
+                                    model_reporters=model_reporter_parameters,
+                                    agent_reporters=agent_reporter_parameters,
+                                    seed=batch_seed
+                                    )
+    sink = ResultSink(results_folder)
 
-batch_run.run_all()
-
-run_data = batch_run.get_model_vars_dataframe()
-agent_data = batch_run.get_agent_vars_dataframe()
-agent_data.to_excel(f"agent_output_{n_iterations}_CNP_airport2.xlsx")
-run_data.to_excel(f"model_output_{n_iterations}_CNP_airport2.xlsx")
-# agent_data.to_excel(f"agent_output.xlsx")
-# run_data.to_excel(f"model_output.xlsx")
+    for model_key, model_vars, agent_vars in batch_run.iter_results():
+        sink.write_run(batch_run, model_key, model_vars, agent_vars)
+    for run, error in batch_run.failed_runs.items():
+        print(f"Run {run} failed:\n{error}")
 
+    if excel_export:
+        export_excel(results_folder, f"agent_output_{n_iterations}_CNP_airport2.xlsx", table="agent")
+        export_excel(results_folder, f"model_output_{n_iterations}_CNP_airport2.xlsx", table="model")
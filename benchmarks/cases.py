@@ -0,0 +1,177 @@
+'''
+# =============================================================================
+# In this file the benchmarks of the FormationFlying model are defined.
+#
+# Model benchmarks (with the parameters of parameters.py, unless varied):
+#   construction: FormationFlying(...) for n_flights from 50 to 10k.
+#   step: one model.step(), after the warm-up steps in which all flights
+#         departed, per n_flights, communication_range and negotiation_method.
+#   full_run: a whole run, until all flights arrived (or max_steps).
+#
+# Micro benchmarks, on a model that ran the warm-up steps (without the
+# economics cache, so the computations themselves are timed):
+#   calc_joining_point, calc_leaving_point, calculate_potential_fuelsavings:
+#         per flight pair.
+#   get_neighbors: the neighbours of every flight in a step (the spatial index
+#         is rebuilt once per step), per flight.
+#   collect: datacollector.collect of one step, for both collectors.
+#
+# quick=True is a smaller selection, for a check before pushing.
+# =============================================================================
+'''
+
+import numpy as np
+
+from formation_flying.model import FormationFlying
+from formation_flying.parameters import model_params
+
+from .harness import Case, case_name
+
+
+SEED = 0
+WARMUP_STEPS = 5  # With departure_window=3 every flight departed by then
+MAX_STEPS = 5000
+N_PAIRS = 100
+
+SIZES = [50, 200, 1000, 10000]
+RANGES = [50, 200, 1000]
+METHODS = [0, 1, 2, 3, 4]
+
+
+def make_model(n_flights=50, communication_range=200, negotiation_method=0, seed=SEED, **kwargs):
+    params = dict(model_params)
+    params.update(n_flights=n_flights, communication_range=communication_range,
+                  negotiation_method=negotiation_method, **kwargs)
+    return FormationFlying(seed=seed, **params)
+
+
+def warmed_up_model(**kwargs):
+    model = make_model(**kwargs)
+    for _ in range(WARMUP_STEPS):
+        model.step()
+    return model
+
+
+def flight_pairs(model, n_pairs=N_PAIRS):
+    rng = np.random.default_rng(SEED)
+    flights = model.fleet.flights
+    pairs = []
+    while len(pairs) < n_pairs:
+        first, second = rng.choice(len(flights), 2, replace=False)
+        pairs.append((flights[first], flights[second]))
+    return pairs
+
+
+# =============================================================================
+#   Model benchmarks.
+# =============================================================================
+def construction_case(n_flights):
+    return Case(case_name("construction", n_flights=n_flights), "construction", setup=lambda: None,
+                run=lambda state: make_model(n_flights=n_flights), params={"n_flights": n_flights})
+
+
+def step(model):
+    if not model.running:
+        raise Exception("The model stopped running during the benchmark")
+    model.step()
+
+
+def step_case(n_flights, communication_range, negotiation_method):
+    params = {"n_flights": n_flights, "communication_range": communication_range,
+              "negotiation_method": negotiation_method}
+    # A step of 10k flights can take minutes with the auctions
+    return Case(case_name("step", **params), "step", setup=lambda: warmed_up_model(**params), run=step,
+                params=params, min_rounds=1 if n_flights >= 10000 else 3, max_rounds=20)
+
+
+def full_run(params):
+    model = make_model(**params)
+    while model.running and model.schedule.steps < MAX_STEPS:
+        model.step()
+    model.close()
+
+
+def full_run_case(n_flights, communication_range, negotiation_method):
+    params = {"n_flights": n_flights, "communication_range": communication_range,
+              "negotiation_method": negotiation_method}
+    return Case(case_name("full_run", **params), "full_run", setup=lambda: params, run=full_run, params=params,
+                min_rounds=1, max_rounds=3, min_time=0)
+
+
+# =============================================================================
+#   Micro benchmarks.
+# =============================================================================
+def pair_case(function, n_flights, evaluate):
+    def setup():
+        return flight_pairs(warmed_up_model(n_flights=n_flights, negotiation_method=1, economics_cache=False))
+
+    def run(pairs):
+        for flight, target in pairs:
+            evaluate(flight, target)
+
+    return Case(case_name(function, n_flights=n_flights), "micro", setup=setup, run=run,
+                params={"n_flights": n_flights}, items=N_PAIRS, min_rounds=5)
+
+
+def neighbors_case(n_flights):
+    def setup():
+        return warmed_up_model(n_flights=n_flights, negotiation_method=1)
+
+    def run(model):
+        model.flight_index.invalidate()
+        for flight in model.fleet.flights:
+            flight.get_neighbors()
+
+    return Case(case_name("get_neighbors", n_flights=n_flights), "micro", setup=setup, run=run,
+                params={"n_flights": n_flights}, items=n_flights, min_rounds=5)
+
+
+def collect_case(n_flights, collector):
+    def setup():
+        return warmed_up_model(n_flights=n_flights, negotiation_method=1, collector=collector)
+
+    def run(model):
+        if collector == "array":
+            # The array collector collects a step only once
+            model.datacollector.collected_steps.discard(model.schedule.steps)
+        model.datacollector.collect(model)
+
+    return Case(case_name("collect", n_flights=n_flights, collector=collector), "micro", setup=setup, run=run,
+                params={"n_flights": n_flights, "collector": collector}, min_rounds=5)
+
+
+def micro_cases(sizes):
+    cases = []
+    for n_flights in sizes:
+        cases.append(pair_case("calc_joining_point", n_flights,
+                               lambda flight, target: flight.calc_joining_point(target)))
+        cases.append(pair_case("calc_leaving_point", n_flights,
+                               lambda flight, target: flight.calc_leaving_point(target.pos, target.destination)))
+        cases.append(pair_case("calculate_potential_fuelsavings", n_flights,
+                               lambda flight, target: flight.calculate_potential_fuelsavings(target)))
+        cases.append(neighbors_case(n_flights))
+        for collector in ("array", "mesa"):
+            cases.append(collect_case(n_flights, collector))
+    return cases
+
+
+# =============================================================================
+#   All benchmarks, or the quick selection.
+# =============================================================================
+def all_cases(quick=False):
+    if quick:
+        sizes, ranges, methods, micro_sizes = [50, 200], [200], [0, 1], [200]
+    else:
+        sizes, ranges, methods, micro_sizes = SIZES, RANGES, METHODS, [200, 1000]
+
+    cases = [construction_case(n_flights) for n_flights in sizes]
+    for negotiation_method in methods:
+        for n_flights in sizes:
+            cases.append(step_case(n_flights, 200, negotiation_method))
+        for communication_range in ranges:
+            if communication_range != 200:
+                cases.append(step_case(1000, communication_range, negotiation_method))
+    for negotiation_method in methods:
+        for communication_range in ranges:
+            cases.append(full_run_case(50, communication_range, negotiation_method))
+    return cases + micro_cases(micro_sizes)
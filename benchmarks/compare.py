@@ -0,0 +1,51 @@
+'''
+# =============================================================================
+# Compares two result files of benchmarks.run, and flags the regressions.
+#
+#   python -m benchmarks.compare baseline.json new.json
+#   python -m benchmarks.compare baseline.json new.json --threshold 0.2 --statistic min
+#
+# Exits with status 1 when a benchmark got slower by more than the threshold,
+# or fails (also when it failed in the baseline), so it can be used as a check.
+# =============================================================================
+'''
+
+import argparse
+import sys
+
+from .harness import compare_results, load_results, format_time
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline", help="results to compare against")
+    parser.add_argument("new", help="new results")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slow-down that counts as a regression (default: 0.1)")
+    parser.add_argument("--statistic", default="median", choices=["median", "min", "mean"])
+    parser.add_argument("--all", action="store_true", help="also show the benchmarks that didn't change")
+    arguments = parser.parse_args(arguments)
+
+    baseline = load_results(arguments.baseline)
+    new = load_results(arguments.new)
+    rows = compare_results(baseline, new, arguments.threshold, arguments.statistic)
+
+    print("Baseline: {} ({})".format(baseline["metadata"].get("commit"), baseline["metadata"].get("time")))
+    print("New:      {} ({})".format(new["metadata"].get("commit"), new["metadata"].get("time")))
+    width = max([len(row[0]) for row in rows] + [9])
+    print("{:<{width}}  {:>12}  {:>12}  {:>7}  {}".format("benchmark", "baseline", "new", "ratio", "status",
+                                                         width=width))
+    for name, status, old, time, ratio in rows:
+        if status == "same" and not arguments.all:
+            continue
+        print("{:<{width}}  {:>12}  {:>12}  {:>7}  {}".format(
+            name, format_time(old) if old is not None else "-", format_time(time) if time is not None else "-",
+            "{:.2f}".format(ratio) if ratio is not None else "-", status, width=width))
+
+    regressions = [row for row in rows if row[1] in ("regression", "failed", "failing")]
+    print("{} regression(s) out of {} benchmarks".format(len(regressions), len(rows)))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
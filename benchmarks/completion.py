@@ -0,0 +1,96 @@
+'''
+# =============================================================================
+# Checks that whole runs finish: with the parameters of parameters.py, every
+# run of every seed has to end with all flights arrived, before max_steps. By
+# default every negotiation method (0 to 5) is checked.
+# A run that gets stuck (e.g. a formation that never closes at its joining
+# point) or raises is reported.
+#
+#   python -m benchmarks.completion
+#   python -m benchmarks.completion --seeds 1-20 --method 0 --method 4 --range 50
+#
+# Exits with status 1 when a run didn't finish, so it can be used as a check.
+# =============================================================================
+'''
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+import traceback
+
+from formation_flying.model import FormationFlying
+from formation_flying.parameters import model_params
+
+
+SEEDS = range(1, 11)
+METHODS = [0, 1, 2, 3, 4, 5]
+RANGES = [50, 200]
+MAX_STEPS = 8000
+
+
+def parse_seeds(text):
+    seeds = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            seeds.extend(range(int(first), int(last) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+# =============================================================================
+#   Runs one model until all flights arrived or max_steps. Returns the number
+#   of steps, and None if it finished or why it didn't.
+# =============================================================================
+def run(negotiation_method, communication_range, seed, max_steps=MAX_STEPS):
+    params = dict(model_params, negotiation_method=negotiation_method, communication_range=communication_range,
+                  seed=seed)
+    model = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = FormationFlying(**params)
+            while model.running and model.schedule.steps < max_steps:
+                model.step()
+    except Exception:
+        return (model.schedule.steps if model is not None else 0), traceback.format_exc().strip().splitlines()[-1]
+    finally:
+        if model is not None:
+            model.close()
+    if model.running:
+        return model.schedule.steps, "still running at max_steps"
+    return model.schedule.steps, None
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Check that whole runs of the FormationFlying model finish.")
+    parser.add_argument("--seeds", type=parse_seeds, default=list(SEEDS), help="e.g. 1-10 or 1,4,7 (default: 1-10)")
+    parser.add_argument("--method", type=int, action="append", default=None,
+                        help="negotiation_method (can be repeated, default: {})".format(METHODS))
+    parser.add_argument("--range", type=int, action="append", default=None, dest="ranges",
+                        help="communication_range (can be repeated, default: {})".format(RANGES))
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS)
+    arguments = parser.parse_args(arguments)
+
+    failures = 0
+    for negotiation_method in arguments.method or METHODS:
+        for communication_range in arguments.ranges or RANGES:
+            for seed in arguments.seeds:
+                start = time.time()
+                steps, problem = run(negotiation_method, communication_range, seed, arguments.max_steps)
+                print("method {} range {:>4} seed {:>3}: {:>5} steps, {:6.1f} s  {}".format(
+                    negotiation_method, communication_range, seed, steps, time.time() - start,
+                    "ok" if problem is None else "FAILED: " + problem), flush=True)
+                failures += problem is not None
+
+    if failures:
+        print("{} runs didn't finish".format(failures))
+        return 1
+    print("All runs finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+'''
+# =============================================================================
+# In this file the timing harness of the benchmarks is defined.
+#
+# A benchmark is a Case: a setup that builds what is needed (a model that ran a
+# few steps, a list of flight pairs, ...) and a function that is timed. The
+# function is called `number` times per round, and rounds are repeated until
+# min_time seconds were spent (at least min_rounds, at most max_rounds). The
+# times are reported per operation: per call, or per item when one call does
+# `items` operations (e.g. one joining point per flight pair).
+#
+# A case that raises is recorded with its error, the other cases still run.
+#
+# The results are saved as JSON, together with the versions of Python, NumPy
+# and mesa, the machine and the git commit, and compared with compare_results
+# (see compare.py).
+# =============================================================================
+'''
+
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+import traceback
+
+import mesa
+import numpy as np
+
+
+class Case:
+    def __init__(self, name, group, setup, run, params=None, number=1, items=1, min_rounds=3, max_rounds=50,
+                 min_time=1.0):
+        self.name = name
+        self.group = group
+        self.setup = setup  # () -> state
+        self.run = run  # (state) -> None
+        self.params = params or {}
+        self.number = number
+        self.items = items
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.min_time = min_time
+
+
+def case_name(function, **params):
+    return "{}[{}]".format(function, ",".join("{}={}".format(name, value) for name, value in params.items()))
+
+
+# =============================================================================
+#   Time one case, returns its result (the times are in seconds).
+# =============================================================================
+def time_case(case):
+    result = {"group": case.group, "params": case.params, "number": case.number, "items": case.items}
+    try:
+        start = time.perf_counter()
+        state = case.setup()
+        result["setup_time"] = time.perf_counter() - start
+
+        times = []
+        spent = 0
+        while len(times) < case.min_rounds or (spent < case.min_time and len(times) < case.max_rounds):
+            start = time.perf_counter()
+            for _ in range(case.number):
+                case.run(state)
+            elapsed = time.perf_counter() - start
+            spent += elapsed
+            times.append(elapsed / (case.number * case.items))
+    except Exception:
+        result["error"] = traceback.format_exc()
+        return result
+
+    result.update({"rounds": len(times),
+                   "min": min(times),
+                   "median": statistics.median(times),
+                   "mean": statistics.mean(times),
+                   "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+                   "error": None})
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "mesa": mesa.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "platform": platform.platform()}
+
+
+def run_cases(cases, verbose=True):
+    results = {}
+    for i, case in enumerate(cases):
+        results[case.name] = time_case(case)
+        if verbose:
+            print("[{}/{}] {}".format(i + 1, len(cases), format_result(case.name, results[case.name])), flush=True)
+    return {"metadata": metadata(), "results": results}
+
+
+def save_results(results, path):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=1)
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.3f} {}".format(seconds / scale, unit)
+    return "{:.1f} ns".format(seconds / 1e-9)
+
+
+def format_result(name, result):
+    if result.get("error"):
+        return "{}: failed ({})".format(name, result["error"].strip().splitlines()[-1])
+    return "{}: {} (median of {} rounds, min {})".format(name, format_time(result["median"]), result["rounds"],
+                                                        format_time(result["min"]))
+
+
+# =============================================================================
+#   Compare two sets of results. A benchmark regressed when its statistic
+#   (the median by default) is more than threshold slower than in the
+#   baseline, or when it fails. A benchmark that failed in both runs is
+#   "failing": it wasn't measured, so it can't be reported as unchanged.
+#   Returns a list of (name, status, baseline time, new time, ratio), with
+#   status one of "regression", "improvement", "same", "failed", "failing",
+#   "fixed", "new" and "missing".
+# =============================================================================
+def compare_results(baseline, new, threshold=0.1, statistic="median"):
+    old_results = baseline["results"]
+    new_results = new["results"]
+    rows = []
+    for name in list(old_results) + [name for name in new_results if name not in old_results]:
+        old = old_results.get(name)
+        result = new_results.get(name)
+        if result is None:
+            rows.append((name, "missing", None, None, None))
+            continue
+        if old is None:
+            rows.append((name, "failed" if result.get("error") else "new", None, result.get(statistic), None))
+            continue
+        if result.get("error") or old.get("error"):
+            if result.get("error") and not old.get("error"):
+                status = "failed"
+            elif old.get("error") and not result.get("error"):
+                status = "fixed"
+            else:
+                status = "failing"
+            rows.append((name, status, old.get(statistic), result.get(statistic), None))
+            continue
+
+        ratio = result[statistic] / old[statistic] if old[statistic] > 0 else math.inf
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "same"
+        rows.append((name, status, old[statistic], result[statistic], ratio))
+    return rows
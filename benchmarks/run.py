@@ -0,0 +1,53 @@
+'''
+# =============================================================================
+# Runs the benchmarks (see cases.py) and saves the results as JSON.
+#
+#   python -m benchmarks.run                      # all benchmarks
+#   python -m benchmarks.run --quick              # a small selection
+#   python -m benchmarks.run --match step --match collect -o new.json
+#
+# Compare two result files with benchmarks.compare.
+# =============================================================================
+'''
+
+import argparse
+import os
+
+from .cases import all_cases
+from .harness import run_cases, save_results, git_commit
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the FormationFlying model.")
+    parser.add_argument("-o", "--output", default=None,
+                        help="JSON file for the results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--quick", action="store_true", help="only run a small selection of the benchmarks")
+    parser.add_argument("--match", action="append", default=None,
+                        help="only run the benchmarks whose name contains this text (can be repeated)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks without running them")
+    arguments = parser.parse_args(arguments)
+
+    cases = all_cases(quick=arguments.quick)
+    if arguments.match:
+        cases = [case for case in cases if any(text in case.name for text in arguments.match)]
+    if arguments.list:
+        for case in cases:
+            print(case.name)
+        return None
+
+    results = run_cases(cases)
+    output = arguments.output
+    if output is None:
+        output = os.path.join(os.path.dirname(__file__), "results", "{}.json".format(git_commit() or "results"))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    save_results(results, output)
+    print("Saved to {}".format(output))
+    failed = [name for name, result in results["results"].items() if result.get("error")]
+    if failed:
+        print("{} benchmark(s) failed: {}".format(len(failed), ", ".join(failed)))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,34 @@
 '''
 # =============================================================================
-# This file contains the drawing of the canvas for the visualization. It uses 
-# 'simple_continuous_canvas.js' which is a standard java script for continuous 
+# This file contains the drawing of the canvas for the visualization. It uses
+# 'simple_continuous_canvas.js' which is a standard java script for continuous
 # canvasses.
+#
+# By default (delta=True) the canvas doesn't send the portrayal of every agent
+# in every frame, but only what changed since the previous frame:
+#   - positions are rounded to pixels of the canvas, so a flight is only sent
+#     when it moved to another pixel or its portrayal changed (airports are
+#     sent once, unless they close),
+#   - the portrayals without the position (shape, size, color) are sent once
+#     as a style, and agents refer to their style by number.
+# The first frame of a model (and the first after a reset) is a full frame.
+#
+# An agent is only portrayed again when one of the attributes in
+# portrayal_attributes changed, otherwise its style is looked up. With the
+# fleet store of the model, the flights that moved to another pixel or changed
+# state are found with array operations, and only those are walked. Airports
+# are only portrayed again when their airport_type changes.
+#
+# With max_fps, frames that are requested faster than that are dropped: the
+# model still steps, but the canvas isn't redrawn, and the changes are sent
+# with the next frame that is drawn. This keeps the browser from falling
+# behind when the model runs faster than it can draw.
 # =============================================================================
 '''
 
+import time
+
+import numpy as np
 from mesa.visualization.ModularVisualization import VisualizationElement
 import random
 
@@ -15,20 +38,50 @@ class SimpleCanvas(VisualizationElement):
     portrayal_method = None
     canvas_height = 500
     canvas_width = 500
+    # The attributes the portrayal of an agent depends on (besides its type)
+    portrayal_attributes = ("airport_type", "state", "formation_state", "manager", "auctioneer")
 
-    def __init__(self, portrayal_method, canvas_height=500, canvas_width=500):
+    def __init__(self, portrayal_method, canvas_height=500, canvas_width=500, delta=True, max_fps=None):
         """
         Instantiate a new SimpleCanvas
         """
         self.portrayal_method = portrayal_method
         self.canvas_height = canvas_height
         self.canvas_width = canvas_width
+        self.delta = delta
+        self.max_fps = max_fps
         new_element = "new Simple_Continuous_Module({}, {})".format(
             self.canvas_width, self.canvas_height
         )
         self.js_code = "elements.push(" + new_element + ");"
+        self.reset_frames(None)
+
+    def reset_frames(self, model):
+        self.model = model
+        self.frame = 0
+        self.sent = {}  # unique_id: (x, y, style) as last sent
+        self.styles = {}  # portrayal without position: style number
+        self.portrayed = {}  # portrayal key: style number (None if the agent isn't drawn)
+        self.n_agents = 0  # agents in the schedule in the previous frame
+        self.airports = []  # (airport, airport_type as last portrayed)
+        self.flight_rows = None  # rows of the fleet store that are in the schedule
+        self.flight_keys = None  # (x, y, state, formation_state, manager, auctioneer) of those rows
+        self.last_frame_time = None
 
     def render(self, model):
+        if not self.delta:
+            return self.render_full(model)
+        if model is not self.model:
+            self.reset_frames(model)
+
+        now = time.perf_counter()
+        if self.max_fps and self.last_frame_time is not None and self.frame > 0 and \
+                now - self.last_frame_time < 1 / self.max_fps:
+            return {"skip": True}
+        self.last_frame_time = now
+        return self.render_delta(model)
+
+    def render_full(self, model):
         space_state = []
         for obj in model.schedule.agents:
             #import the types of agents here and do
@@ -45,3 +98,116 @@ class SimpleCanvas(VisualizationElement):
             portrayal["y"] = y
             space_state.append(portrayal)
         return space_state
+
+    # =========================================================================
+    #   The agents that changed since the previous frame, as
+    #   [unique_id, x, y, style] with x and y in pixels, the new styles, and
+    #   the agents that left the schedule.
+    #
+    #   The first frame, a frame after agents were added or removed, and models
+    #   without a fleet store walk all agents; the others only the airports and
+    #   the flights that changed.
+    # =========================================================================
+    def render_delta(self, model):
+        space = model.space
+        x_scale = self.canvas_width / (space.x_max - space.x_min)
+        y_scale = self.canvas_height / (space.y_max - space.y_min)
+
+        full = self.frame == 0
+        changed = []
+        new_styles = {}
+        removed = []
+        fleet = getattr(model, "fleet", None)
+        n_agents = model.schedule.get_agent_count()
+        if full or fleet is None or n_agents != self.n_agents or self.flight_rows is None:
+            removed = self.render_agents(model, fleet, x_scale, y_scale, changed, new_styles)
+        else:
+            # In the order of the schedule: the airports were added first
+            for i, (airport, airport_type) in enumerate(self.airports):
+                if airport.airport_type != airport_type:
+                    self.airports[i] = (airport, airport.airport_type)
+                    self.render_agent(airport, x_scale, y_scale, changed, new_styles, removed)
+            keys = self.fleet_keys(fleet, x_scale, y_scale)
+            moved = np.flatnonzero(np.any(keys != self.flight_keys, axis=1))
+            self.flight_keys = keys
+            flights = fleet.flights
+            for row in self.flight_rows[moved]:
+                self.render_agent(flights[row], x_scale, y_scale, changed, new_styles, removed)
+        self.n_agents = n_agents
+
+        self.frame += 1
+        return {"full": full, "frame": self.frame, "styles": new_styles, "changed": changed, "removed": removed}
+
+    def render_agents(self, model, fleet, x_scale, y_scale, changed, new_styles):
+        present = set()
+        self.airports = []
+        flight_rows = []
+        for obj in model.schedule.agents:
+            if fleet is not None and getattr(obj, "fleet", None) is fleet:
+                flight_rows.append(obj.fleet_index)
+            elif hasattr(obj, "airport_type"):
+                self.airports.append((obj, obj.airport_type))
+            if self.render_agent(obj, x_scale, y_scale, changed, new_styles):
+                present.add(obj.unique_id)
+
+        if fleet is not None:
+            self.flight_rows = np.array(flight_rows, dtype=int)
+            self.flight_keys = self.fleet_keys(fleet, x_scale, y_scale)
+        removed = [unique_id for unique_id in self.sent if unique_id not in present]
+        for unique_id in removed:
+            del self.sent[unique_id]
+        return removed
+
+    # =========================================================================
+    #   Sends an agent if it changed. Returns whether it is drawn; if it isn't
+    #   (any more), it is added to removed.
+    # =========================================================================
+    def render_agent(self, obj, x_scale, y_scale, changed, new_styles, removed=None):
+        key = (type(obj),) + tuple(getattr(obj, name, None) for name in self.portrayal_attributes)
+        try:
+            style = self.portrayed[key]
+        except KeyError:
+            style = self.portrayed[key] = self.portray(obj, new_styles)
+        if style is None:
+            if removed is not None and self.sent.pop(obj.unique_id, None) is not None:
+                removed.append(obj.unique_id)
+            return False
+
+        space = self.model.space
+        x, y = obj.pos
+        entry = (int(round((x - space.x_min) * x_scale)), int(round((y - space.y_min) * y_scale)), style)
+        if self.sent.get(obj.unique_id) != entry:
+            self.sent[obj.unique_id] = entry
+            changed.append([obj.unique_id, entry[0], entry[1], style])
+        return True
+
+    def portray(self, obj, new_styles):
+        portrayal = self.portrayal_method(obj)
+        if portrayal is None:
+            return None
+        style_key = tuple(sorted(portrayal.items()))
+        style = self.styles.get(style_key)
+        if style is None:
+            style = self.styles[style_key] = len(self.styles)
+            new_styles[style] = portrayal
+        return style
+
+    # =========================================================================
+    #   Per flight in the schedule: its position in pixels, and what its
+    #   portrayal depends on. manager and auctioneer aren't in the fleet store,
+    #   so they are read from the flights (but they are only portrayed again
+    #   when something changed).
+    # =========================================================================
+    def fleet_keys(self, fleet, x_scale, y_scale):
+        space = self.model.space
+        rows = self.flight_rows
+        flights = fleet.flights
+        pos = fleet.pos[rows]
+        keys = np.empty((len(rows), 6))
+        keys[:, 0] = np.rint((pos[:, 0] - space.x_min) * x_scale)
+        keys[:, 1] = np.rint((pos[:, 1] - space.y_min) * y_scale)
+        keys[:, 2] = fleet.state[rows]
+        keys[:, 3] = fleet.formation_state[rows]
+        keys[:, 4] = [flights[row].manager for row in rows]
+        keys[:, 5] = [flights[row].auctioneer for row in rows]
+        return keys
@@ -52,10 +52,10 @@ class Airport(Agent):
 
     def step(self):
         if self.closure_time != 0:
-            if self.model.schedule.steps >= self.closure_time:
+            if self.model.schedule.steps >= self.closure_time and self.airport_type != "Closed":
                 self.airport_type = "Closed"
                 # self.model.space.move_agent(self, [0,0])
-                print("check")
+                self.model.events.emit("airport_closed", airport=self)
 
     # =========================================================================
     #   As we are using a bi-step activation (first a step and then advance), 
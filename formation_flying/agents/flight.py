@@ -14,18 +14,20 @@
 '''
 
 import numpy as np
-from random import choices
 from matplotlib import pyplot as plt
 
 from mesa import Agent
 from .airports import Airport
+from ..fleet import Fleet, STATES, STATE_CODES, FORMATION_STATES, FORMATION_STATE_CODES
+from ..fleet import point_attribute, scalar_attribute, state_attribute
 from ..negotiations.greedy import do_greedy
 from ..negotiations.CNP import CNP
 from ..negotiations.english import English
 from ..negotiations.vickrey import Vickrey
 from ..miscellaneous import calc_distance, utility_function, calc_angle, calc_middle_point, calc_vector
 from ..negotiations.japanese import Japanese
-from ..miscellaneous import calc_distance, utility_function, calc_middle_point
+from ..negotiations.records import Bid, BidBook
+from ..miscellaneous import calc_joining_points, calc_leaving_points, joining_point_problem, sample_joining_points, fermat_weber_cost
 
 import math
 
@@ -64,8 +66,23 @@ class Flight(Agent):
             behavior_wights = [1, 0, 0, 0]
     ):
 
+        # Bumped whenever something changes that the formation economics depend on
+        # (position, destination, formation and joining/leaving points), see cached_economics.
+        self.formation_version = 0
+        self.economics_cache = {}
+        self.economics_cache_step = None
+
+        # The row of this flight in the fleet store of the model, or in a store of its own
+        if model.fleet is not None:
+            self.fleet = model.fleet
+        else:
+            self.fleet = Fleet()
+        self.fleet_index = self.fleet.add(self)
+
         super().__init__(unique_id, model)
         self.agent_type = "Flight"
+        # The random decisions of this flight (its behavior, its role, ...) come from a stream of its own
+        self.rng = model.agent_random(unique_id)
         self.pos = np.array(pos)
         self.destination = np.array(destination_pos)
         self.destination_agent = destination_agent
@@ -76,7 +93,7 @@ class Flight(Agent):
         self.communication_range = communication_range
         self.speed_to_joining = None
 
-        self.behavior = choices(["budget", "green", "express", "balanced"], weights=behavior_wights, k=1)[0]
+        self.behavior = self.rng.choices(["budget", "green", "express", "balanced"], weights=behavior_wights, k=1)[0]
 
         # =====================================================================
         #   Initialize parameters, the values will not be used later on.
@@ -119,10 +136,10 @@ class Flight(Agent):
         #   !!! TODO Exc. 1.3: implement when a manager can become an auctioneer and vice versa.!!!
         # =============================================================================
         self.accepting_bids = 0
-        self.received_bids = []
+        self.received_bids = BidBook()
 
         if self.model.negotiation_method == 0:
-            self.manager = self.model.random.choice([0, 1])
+            self.manager = self.rng.choice([0, 1])
         elif self.model.negotiation_method == 1:
             self.manager = 0
         elif self.model.negotiation_method == 4:
@@ -131,6 +148,9 @@ class Flight(Agent):
             self.manager = 0
         elif self.model.negotiation_method == 3:
             self.manager = 0
+        elif self.model.negotiation_method == 5:
+            # The formations are made by the matching of the model, see matching.py
+            self.manager = 0
         else:
             raise NotImplementedError
         self.update_role()
@@ -144,6 +164,72 @@ class Flight(Agent):
         if self.model.negotiation_method == 4:
             self.japanese = Japanese(self)
 
+    # =============================================================================
+    #   The state of the flight is kept in its row of the fleet store (see fleet.py).
+    #
+    #   Setting one of the attributes the fuel savings, delay and joining/leaving
+    #   points depend on (versioned) bumps formation_version, which invalidates
+    #   the cached economics of this flight and the pairs it is part of.
+    #   Appending to agents_in_my_formation doesn't go through a setter, so
+    #   formation_changed() has to be called after doing so.
+    # =============================================================================
+    pos = point_attribute("pos", versioned=True, optional=False)
+    destination = point_attribute("destination", versioned=True, optional=False)
+    heading = point_attribute("heading", optional=False)
+    joining_point = point_attribute("joining_point", versioned=True)
+    leaving_point = point_attribute("leaving_point", versioned=True)
+    speed = scalar_attribute("speed")
+    speed_to_joining = scalar_attribute("speed_to_joining", versioned=True, optional=True)
+    departure_time = scalar_attribute("departure_time")
+    planned_fuel = scalar_attribute("planned_fuel")
+    fuel_consumption = scalar_attribute("fuel_consumption")
+    deal_value = scalar_attribute("deal_value")
+    distance_in_formation = scalar_attribute("distance_in_formation")
+    real_flight_time = scalar_attribute("real_flight_time")
+    estimated_fuel_saved = scalar_attribute("estimated_fuel_saved")
+    real_fuel_saved = scalar_attribute("real_fuel_saved", optional=True)
+    estimated_delay = scalar_attribute("estimated_delay")
+    delay = scalar_attribute("delay", optional=True)
+    estimated_utility_score = scalar_attribute("estimated_utility_score")
+    real_utility_score = scalar_attribute("real_utility_score")
+    state = state_attribute("state", STATES, STATE_CODES)
+    formation_state = state_attribute("formation_state", FORMATION_STATES, FORMATION_STATE_CODES, versioned=True)
+
+    @property
+    def agents_in_my_formation(self):
+        return self._agents_in_my_formation
+
+    @agents_in_my_formation.setter
+    def agents_in_my_formation(self, value):
+        self._agents_in_my_formation = value
+        self.formation_version += 1
+
+    def formation_changed(self):
+        self.formation_version += 1
+
+    # =============================================================================
+    #   Per-step memoization of the formation economics of a pair of flights.
+    #   The same pair is evaluated many times in a step (bidding, acceptance,
+    #   and again when the formation is made), so results are kept until the
+    #   step ends or one of the two flights changes (see formation_version).
+    # =============================================================================
+    def cached_economics(self, kind, target_agent, compute, *args):
+        model = self.model
+        if not model.economics_cache:
+            return compute(*args)
+        if self.economics_cache_step != model.schedule.steps:
+            self.economics_cache = {}
+            self.economics_cache_step = model.schedule.steps
+        key = (kind, target_agent.unique_id, target_agent.formation_version, self.formation_version)
+        try:
+            value = self.economics_cache[key]
+        except KeyError:
+            model.economics_cache_misses += 1
+            value = self.economics_cache[key] = compute(*args)
+        else:
+            model.economics_cache_hits += 1
+        return value
+
     # =============================================================================
     #   __hash__, __eq__, __ne__ are required so Flight objects can be used as
     #   dictionary keys.
@@ -157,6 +243,19 @@ class Flight(Agent):
     def __ne__(self, other):
         return not(self == other)
 
+    # =============================================================================
+    #   When a model is unpickled (see checkpoint.py), the dictionaries that hold
+    #   a flight can be rebuilt before the state of the flight is restored, so
+    #   the unique_id (its hash) is set when the flight is created.
+    # =============================================================================
+    def __new__(cls, unique_id=None, *args, **kwargs):
+        flight = super().__new__(cls)
+        flight.unique_id = unique_id
+        return flight
+
+    def __getnewargs__(self):
+        return (self.unique_id,)
+
     def update_role(self):
         if self.manager:
             if self.formation_state not in ("committed", "adding_to_formation"):
@@ -204,13 +303,16 @@ class Flight(Agent):
 
             # Steps for the different negotiation methods
             if self.model.negotiation_method == 0:
-                do_greedy(self)
+                if self.model.greedy is not None:
+                    self.model.greedy.do_greedy(self)
+                else:
+                    do_greedy(self)
             if self.model.negotiation_method == 1:
                 self.cnp.do_cnp()
             if self.model.negotiation_method == 2:
                 self.english.do_english()
             if self.model.negotiation_method == 3:
-                self.vickrey.do_Vickrey()
+                self.vickrey.do_vickrey()
             if self.model.negotiation_method == 4:
                 self.japanese.do_japanese()
 
@@ -227,6 +329,12 @@ class Flight(Agent):
     # If individual is True, function calculates the individual fuel saving of self, instead of the savings of the full formation.
 
     def calculate_potential_fuelsavings(self, target_agent, individual=False):
+        if self.model.profiler:
+            self.model.profiler.count("fuel_savings")
+        return self.cached_economics("individual_fuel" if individual else "fuel", target_agent,
+                                     self.compute_potential_fuelsavings, target_agent, individual)
+
+    def compute_potential_fuelsavings(self, target_agent, individual=False):
         if len(self.agents_in_my_formation) == 0 and len(target_agent.agents_in_my_formation) == 0:
             joining_point = self.calc_joining_point(target_agent)
             leaving_point = self.calc_leaving_point(target_agent.pos, target_agent.destination)
@@ -330,6 +438,9 @@ class Flight(Agent):
     #   !!! TODO Exc. 1.3: improve calculation joining/leaving point.!!!
     # =============================================================================
     def calculate_potential_delay(self, target_agent):
+        return self.cached_economics("delay", target_agent, self.compute_potential_delay, target_agent)
+
+    def compute_potential_delay(self, target_agent):
         if len(self.agents_in_my_formation) == 0 and len(target_agent.agents_in_my_formation) == 0:
             joining_point = self.calc_joining_point(target_agent)
             leaving_point = self.calc_leaving_point(target_agent.pos, target_agent.destination)
@@ -403,7 +514,7 @@ class Flight(Agent):
 
         if discard_received_bids:
             # Discard all bids that have been received
-            self.received_bids = []
+            self.received_bids.clear()
 
         involved_agents = [self]
         for agent in self.agents_in_my_formation:
@@ -411,11 +522,16 @@ class Flight(Agent):
 
         for agent in involved_agents:
             agent.agents_in_my_formation.append(target_agent)
+            agent.formation_changed()
             agent.formation_state = "adding_to_formation"
 
         if target_agent in involved_agents:
             raise Exception("This is not correct")
 
+        # One of the two can be a flight that already arrived (see EventActivation.activate)
+        self.model.schedule.activate(self)
+        self.model.schedule.activate(target_agent)
+
         self.joining_point = self.calc_joining_point(target_agent)
         self.speed_to_joining = self.calc_speed_to_joining_point(target_agent)
         target_speed_to_joining = target_agent.calc_speed_to_joining_point(self)
@@ -426,6 +542,8 @@ class Flight(Agent):
         for agent in self.agents_in_my_formation:
             agent.deal_value += bid_receivers
         target_agent.deal_value -= bid_value
+        # Running total of the deal values of all flights (should stay 0)
+        self.model.deal_value_balance += bid_receivers * (len(self.agents_in_my_formation) + 1) - bid_value
 
         target_agent.formation_state = "committed"
 
@@ -484,6 +602,7 @@ class Flight(Agent):
         self.model.fuel_savings_closed_deals += self.calculate_potential_fuelsavings(target_agent)
         self.deal_value += bid_value
         target_agent.deal_value -= bid_value
+        # (the running total of the model doesn't change, the bid only moves from one flight to the other)
 
         self.accepting_bids = False
         self.formation_role = "manager"
@@ -496,7 +615,11 @@ class Flight(Agent):
             raise Exception("Something is going wrong")
 
         if discard_received_bids:
-            self.received_bids = []
+            self.received_bids.clear()
+
+        # One of the two can be a flight that already arrived (see EventActivation.activate)
+        self.model.schedule.activate(self)
+        self.model.schedule.activate(target_agent)
 
         if self.distance_to_destination(target_agent.pos) < 0.002:
             # Edge case where agents are at the same spot.
@@ -533,6 +656,8 @@ class Flight(Agent):
         self.leaving_point = self.calc_leaving_point(target_agent.pos, target_agent.destination)
         self.agents_in_my_formation.append(target_agent)
         target_agent.agents_in_my_formation.append(self)
+        self.formation_changed()
+        target_agent.formation_changed()
         target_agent.leaving_point = self.leaving_point
 
         # self.estimated_flight_time = self.real_flight_time + (
@@ -554,7 +679,7 @@ class Flight(Agent):
     # =============================================================================
 
     def find_greedy_candidate(self):
-        neighbors = self.model.space.get_neighbors(pos=self.pos, radius=self.communication_range, include_center=True)
+        neighbors = self.get_neighbors()
         candidates = []
         for agent in neighbors:
             if type(agent) is Flight:
@@ -563,12 +688,20 @@ class Flight(Agent):
                         candidates.append(agent)
         return candidates
 
+    # =========================================================================
+    #   The flights within communication range (including itself), from the
+    #   spatial index of the model.
+    # =========================================================================
+    def get_neighbors(self):
+        if self.model.profiler:
+            self.model.profiler.count("get_neighbors")
+        return self.model.flight_index.get_neighbors(self, self.communication_range)
+
     # =========================================================================
     #   Making the bid.
     # =========================================================================
     def make_bid(self, bidding_target, bid_value, validity, bid_expiration_date):
-        bid = {"bidding_agent": self, "value": bid_value, "validity": validity, "exp_date": bid_expiration_date}
-        bidding_target.received_bids.append(bid)
+        bidding_target.received_bids.add(Bid(self, bid_value, validity, bid_expiration_date))
 
     # =========================================================================
     #   This function randomly chooses a new destination airport. 
@@ -583,7 +716,7 @@ class Flight(Agent):
                 if agent.airport_type == "Destination":
                     open_destinations.append(agent)
 
-        self.destination_agent = self.model.random.choice(open_destinations)
+        self.destination_agent = self.rng.choice(open_destinations)
         self.destination = self.destination_agent.pos
 
         # You could add code here to decommit from the current bid.
@@ -608,21 +741,21 @@ class Flight(Agent):
     #   scenarios in the if's and elif's, which are explained step-by-step.
     # =========================================================================
     def do_move(self):
+        f_c = self.move()
+        if f_c is not None:
+            self.model.total_fuel_consumption += f_c
+
+    # =========================================================================
+    #   Moves the agent and returns the fuel it consumed in this step (None if
+    #   it isn't flying). The fuel is added to the total of the model by the
+    #   caller, so the fleet movement (see movement.py) can add it in order.
+    # =========================================================================
+    def move(self):
 
         if self.distance_to_destination(self.destination) <= self.speed / 2:
             # If the agent is within reach of its destination, the state is changed to "arrived"
             if self.state == "flying":
-                self.real_fuel_saved = self.planned_fuel - self.fuel_consumption
-                self.real_arrival = self.departure_time + self.real_flight_time
-                self.delay = self.real_arrival - self.scheduled_arrival
-                # Only consider the utility of flights that entered a formation.
-                # Flights that did not enter any formations will be assumed to have 0 utility
-                if self.deal_value != 0:
-                    self.real_utility_score = utility_function(self.real_fuel_saved + self.deal_value,
-                                                               self.real_fuel_saved, self.delay, behavior=self.behavior)
-                # print(
-                #     f"Flight {self.unique_id} arrived at {self.real_arrival} with a delay of {self.delay}, saving {self.real_fuel_saved} fuel.")
-                self.state = "arrived"
+                self.arrive()
 
         elif self.model.schedule.steps >= self.departure_time:
             # The agent only starts flying if it is at or past its departure time.
@@ -646,10 +779,14 @@ class Flight(Agent):
                 # change status to "in formation" and start accepting new bids again.
                 # If an agent from an already existing formation reaches the joining point, assume all agents that are
                 # already in formation have reached the joining point
+                # A mate that already arrived at its destination doesn't move any more, so it is not waited for
+                # (its destination can be right next to the joining point). It flies again when the formation
+                # is disbanded, and arrives once more.
                 all_arrived = True
                 for agent in self.agents_in_my_formation:
-                    if not (agent.distance_to_destination(agent.joining_point) <= agent.speed_to_joining / 2 or \
-                            agent.distance_to_destination(agent.joining_point) <= 0.002):
+                    if agent.state != "arrived" and \
+                            not (agent.distance_to_destination(agent.joining_point) <= agent.speed_to_joining / 2 or
+                                 agent.distance_to_destination(agent.joining_point) <= 0.002):
                         all_arrived = False
 
                 if all_arrived:
@@ -670,9 +807,14 @@ class Flight(Agent):
             if self.formation_state == "in_formation":
                 # If in formation, fuel consumption is 75% of normal fuel consumption.
                 f_c = self.model.fuel_reduction * self.speed
-                self.heading = [self.leaving_point[0] - self.pos[0], self.leaving_point[1] - self.pos[1]]
-                self.heading /= np.linalg.norm(self.heading)
-                new_pos = self.pos + self.heading * self.speed
+                if self.distance_to_destination(self.leaving_point) == 0.0:
+                    # The formation closed on its leaving point (it can be the joining point), stay put,
+                    # it is disbanded in the next step
+                    new_pos = self.pos
+                else:
+                    self.heading = [self.leaving_point[0] - self.pos[0], self.leaving_point[1] - self.pos[1]]
+                    self.heading /= np.linalg.norm(self.heading)
+                    new_pos = self.pos + self.heading * self.speed
 
             elif self.formation_state == "committed" or self.formation_state == "adding_to_formation":
                 # While on its way to join a new formation
@@ -682,18 +824,29 @@ class Flight(Agent):
                     f_c = self.speed_to_joining
 
                 # If somehow arrived to the joining point sooner than other agents in formation, stay put
-                if self.distance_to_destination(self.joining_point) == 0.0:
+                distance_to_joining = self.distance_to_destination(self.joining_point)
+                if distance_to_joining == 0.0:
                     new_pos = self.pos
                 else:
                     self.heading = [self.joining_point[0] - self.pos[0], self.joining_point[1] - self.pos[1]]
                     self.heading /= np.linalg.norm(self.heading)
                     new_pos = self.pos + self.heading * self.speed_to_joining
+                    if distance_to_joining <= self.speed_to_joining:
+                        # Stop at the joining point instead of overshooting it. A flight that overshoots
+                        # swings around the point (at speed_to_joining - distance on the other side, and
+                        # back), and when a mate already sits on the point (the joining point is its
+                        # position) the mates can swing out of step forever, so the formation never closes.
+                        new_pos = np.array(self.joining_point, dtype=float)
 
             else:
                 self.heading = [self.destination[0] - self.pos[0], self.destination[1] - self.pos[1]]
                 f_c = self.speed
                 self.heading /= np.linalg.norm(self.heading)
                 new_pos = self.pos + self.heading * self.speed
+                if self.distance_to_destination(self.destination) <= self.speed:
+                    # Stop at the destination instead of overshooting it (it arrives in the next step
+                    # either way), an airport close to the edge would be overshot out of the space
+                    new_pos = np.array(self.destination, dtype=float)
 
             if f_c < 0:
                 raise Exception("Fuel cost lower than 0")
@@ -701,11 +854,24 @@ class Flight(Agent):
             #     print(self.unique_id, self.formation_state, self.manager, self.distance_to_destination(self.joining_point), f_c, self.speed_to_joining)
             #     print([(mate.unique_id, mate.formation_state, mate.manager) for mate in self.agents_in_my_formation])
 
-            self.model.total_fuel_consumption += f_c
             self.fuel_consumption += f_c
 
             # print(f"Flight {self.unique_id} moves to {new_pos}.")
             self.model.space.move_agent(self, new_pos)
+            return f_c
+
+    def arrive(self):
+        self.real_fuel_saved = self.planned_fuel - self.fuel_consumption
+        self.real_arrival = self.departure_time + self.real_flight_time
+        self.delay = self.real_arrival - self.scheduled_arrival
+        # Only consider the utility of flights that entered a formation.
+        # Flights that did not enter any formations will be assumed to have 0 utility
+        if self.deal_value != 0:
+            self.real_utility_score = utility_function(self.real_fuel_saved + self.deal_value,
+                                                       self.real_fuel_saved, self.delay, behavior=self.behavior)
+        # print(
+        #     f"Flight {self.unique_id} arrived at {self.real_arrival} with a delay of {self.delay}, saving {self.real_fuel_saved} fuel.")
+        self.state = "arrived"
 
 
 
@@ -782,149 +948,98 @@ class Flight(Agent):
         #         raise err
 
     def calc_joining_point(self, target_agent):
+        return self.cached_economics("joining", target_agent, self.compute_joining_point, target_agent)
+
+    def compute_joining_point(self, target_agent):
         target_agent_pos = target_agent.pos
-        target_agent_des = target_agent.destination
         margin = 1
         if abs(self.pos[0] - target_agent_pos[0]) < margin and abs(self.pos[1] - target_agent_pos[1]) < margin:
             opt_joining_point = self.pos
             return opt_joining_point
         else:
-            if len(self.agents_in_my_formation) > 0:
-                self_joining_fuel_fraction = self.model.fuel_reduction
-                target_joining_fuel_fraction = 1
-            elif len(target_agent.agents_in_my_formation) > 0:
-                target_joining_fuel_fraction = self.model.fuel_reduction
-                self_joining_fuel_fraction = 1
-            else:
-                target_joining_fuel_fraction = 1
-                self_joining_fuel_fraction = 1
             assert not (len(self.agents_in_my_formation) > 0 and len(target_agent.agents_in_my_formation) > 0), \
                 "Not possible for two formations to merge"
+            return self.calc_joining_points(np.array([target_agent_pos]), np.array([target_agent.destination]),
+                                            len(target_agent.agents_in_my_formation) > 0)[0]
 
-            # middle point between self and target location
-            mid_point1 = calc_middle_point(self.pos, target_agent_pos)
-            # middle point between self and target destination
-            mid_point2 = calc_middle_point(self.destination, target_agent_des)
-            # original distance from current position to middle point
-            # vector a is middle point to current position
-            # a_vec = calc_vector(mid_point1, self.pos)
-            # print('a vector', a_vec)
-            # # vector b is from middle point to destination middle point (same for both self and target, because middle point)
-            # b_vec = calc_vector(mid_point1, mid_point2)
-            # print('b vector', b_vec)
-            # alfa is angle between self and vector from mid point to mid point
-            #alfa = calc_angle(a_vec, b_vec)
-            # alfa = np.arctan((mid_point2[0] - mid_point1[0]) / (mid_point2[1]-mid_point1[1])) +\
-            #        np.arctan((mid_point1[0] - self.pos[0]) / (mid_point1[1] - self.pos[1]))
-            # print('alfa', alfa)
-            #use y = ax+b
-            #determine a
-            a = (mid_point1[1] - mid_point2[1]) / (mid_point1[0] - mid_point2[0])
-            b = mid_point1[1]- a * mid_point1[0]
-            y = np.linspace(mid_point1[1], mid_point2[1], num=200)
-            x=np.zeros(len(y))
-            for i in range(len(y)):
-                x[i]=(y[i] - b) / a
-
-            potential_b = np.column_stack((x,y))
-            route_fuel_self = np.zeros(len(y))
-            route_fuel_target = np.zeros(len(y))
-            total_route_fuel = np.zeros(len(y))
-
-            for i in range(len(y)):
-                route_fuel_self[i] = self_joining_fuel_fraction * calc_distance(self.pos, potential_b[i])\
-                                  + self.model.fuel_reduction * calc_distance(potential_b[i], mid_point2)
-                route_fuel_target[i] = target_joining_fuel_fraction * calc_distance(target_agent_pos, potential_b[i])\
-                                         + self.model.fuel_reduction * calc_distance(potential_b[i], mid_point2)
-                total_route_fuel[i] = route_fuel_self[i] + route_fuel_target[i]
-            the_index = np.argmin(total_route_fuel)
-            opt_joining_point = potential_b[the_index]
-            # print(the_index)
-            #print(opt_joining_point)
-
-            # shortest_route = 10000
-            # opt_joining_point = (0, 0)
-            # for i in range(len(potential_b)):
-            #     if total_route_length[i] < shortest_route:
-            #         shortest_route = total_route_length[i]
-            #         opt_joining_point = potential_b[i]
-            #     # else:
-            #     #     break
-            return opt_joining_point
+    # =========================================================================
+    #   Joining points with N partners in one go, so a manager can score its
+    #   whole neighbourhood at once.
+    #
+    #   partner_pos, partner_des: (N, 2) arrays.
+    #   partner_in_formation: bool or (N,) bools, whether the partner is leading
+    #   a formation (and thus flies to the joining point with fuel_reduction).
+    #
+    #   With model.verify_joining_point set, the result is checked against the
+    #   original sampling of 200 points between the middle points.
+    # =========================================================================
+    def calc_joining_points(self, partner_pos, partner_des, partner_in_formation=False):
+        partner_pos = np.atleast_2d(np.asarray(partner_pos, dtype=float))
+        partner_in_formation = np.broadcast_to(partner_in_formation, (len(partner_pos),))
+        if self.model.profiler:
+            self.model.profiler.count("joining_points", len(partner_pos))
+        if len(self.agents_in_my_formation) > 0:
+            self_joining_fuel_fraction = self.model.fuel_reduction
+            target_joining_fuel_fraction = 1
+        else:
+            self_joining_fuel_fraction = 1
+            target_joining_fuel_fraction = np.where(partner_in_formation, self.model.fuel_reduction, 1)
+
+        opt_joining_points = calc_joining_points(self.pos, self.destination, partner_pos, partner_des,
+                                                 self_joining_fuel_fraction, target_joining_fuel_fraction,
+                                                 self.model.fuel_reduction)
+        if self.model.verify_joining_point:
+            anchors, weights = joining_point_problem(self.pos, self.destination, partner_pos, partner_des,
+                                                     self_joining_fuel_fraction, target_joining_fuel_fraction,
+                                                     self.model.fuel_reduction)
+            sampled_points = sample_joining_points(self.pos, self.destination, partner_pos, partner_des,
+                                                   self_joining_fuel_fraction, target_joining_fuel_fraction,
+                                                   self.model.fuel_reduction)
+            sampled = np.isfinite(sampled_points[:, 0])
+            solver_cost = fermat_weber_cost(anchors[sampled], weights[sampled], opt_joining_points[sampled])
+            sampled_cost = fermat_weber_cost(anchors[sampled], weights[sampled], sampled_points[sampled])
+            if np.any(solver_cost > sampled_cost + 1e-6):
+                raise Exception(f"Joining point solver of flight {self.unique_id} is worse than sampling: "
+                                f"{solver_cost} > {sampled_cost}")
+
+        # Partners within the margin are joined on the spot.
+        margin = 1
+        close = (np.abs(self.pos[0] - partner_pos[:, 0]) < margin) & (np.abs(self.pos[1] - partner_pos[:, 1]) < margin)
+        opt_joining_points[close] = self.pos
+        return opt_joining_points
 
     def calc_leaving_point(self, target_agent_pos, target_agent_des):
-        margin = 1
-        if abs(self.destination[0] - target_agent_des[0]) < margin and abs(self.destination[1] - target_agent_des[1]) < margin:
-            opt_leaving_point = self.pos
-            return opt_leaving_point
+        model = self.model
+        if not model.economics_cache:
+            return self.calc_leaving_points(np.array([target_agent_pos]), np.array([target_agent_des]))[0]
+        if self.economics_cache_step != model.schedule.steps:
+            self.economics_cache = {}
+            self.economics_cache_step = model.schedule.steps
+        # Leaving points only depend on positions and destinations, so those are the key
+        key = ("leaving", self.formation_version, target_agent_pos[0], target_agent_pos[1], target_agent_des[0],
+               target_agent_des[1])
+        try:
+            value = self.economics_cache[key]
+        except KeyError:
+            model.economics_cache_misses += 1
+            value = self.economics_cache[key] = self.calc_leaving_points(np.array([target_agent_pos]),
+                                                                         np.array([target_agent_des]))[0]
         else:
-            # middle point between self and target location
-            mid_point1 = calc_middle_point(self.pos, target_agent_pos)
-            # middle point between self and target destination
-            mid_point2 = calc_middle_point(self.destination, target_agent_des)
-            # original distance from current position to middle point
-            # b_magn = calc_distance(self.pos, mid_point1)
-            # vector a is middle point (at end) to destination
-            a_vec = calc_vector(mid_point2, self.destination)
-            # vector b is from middle point to destination middle point (same for both self and target, because middle point)
-            b_vec = calc_vector(mid_point2, mid_point1)
-            # alfa is angle between self and vector from mid point to mid point
-            #alfa = calc_angle(a_vec, b_vec)
-            a = (mid_point1[1] - mid_point2[1]) / (mid_point1[0] - mid_point2[0])
-            b = mid_point1[1] - a * mid_point1[0]
-            y = np.linspace(mid_point1[1], mid_point2[1], num=200)
-            x = np.zeros(len(y))
-            for i in range(len(y)):
-                x[i] = (y[i] - b) / a
-
-            potential_b = np.column_stack((x, y))
-            route_length = np.zeros(len(y))
-            total_route_length = np.zeros(len(y))
-            route_length_target = np.zeros(len(y))
-
-            for i in range(len(y)):
-                route_length[i] = calc_distance(self.destination, potential_b[i]) + 0.75 * calc_distance(potential_b[i],
-                                                                                                 mid_point1)
-                route_length_target[i] = calc_distance(target_agent_des, potential_b[i]) + 0.75 * calc_distance(
-                    potential_b[i],
-                    mid_point1)
-                total_route_length[i] = route_length[i] + route_length_target[i]
-            the_index = np.argmin(total_route_length)
-            opt_leaving_point = potential_b[the_index]
-            # print(the_index)
-            #print(opt_leaving_point)
-            return opt_leaving_point
-
-
-
-            # alfa = np.arctan((mid_point2[0] - mid_point1[0]) / (mid_point2[1] - mid_point1[1])) + \
-            #        np.arctan((mid_point1[0] - self.pos[0]) / (mid_point1[1] - self.pos[1]))
-            # # try 40000: vary potential point B (is new meeting point)
-            # unity_vector = np.array([np.sin(alfa), np.cos(alfa)])
-            # # point b was meeting point in my original drawings
-            # potential_b = np.zeros((100, 2))
-            # route_length = np.zeros(100)
-            # total_route_length = np.zeros(100)
-            # route_length_target = np.zeros(100)
-            #
-            # for i in range(100):
-            #     potential_b[i] = unity_vector * i
-            #     route_length[i] = calc_distance(self.destination, potential_b[i]) + 0.75 * calc_distance(potential_b[i], mid_point1)
-            #     route_length_target[i] = calc_distance(target_agent_des, potential_b[i]) + 0.75 * calc_distance(
-            #         potential_b[i],
-            #         mid_point1)
-            #     total_route_length[i] = route_length[i] + route_length_target[i]
-            #
-            # combined_list = np.column_stack((potential_b, total_route_length))
-            #
-            # shortest_route = 10000
-            # opt_leaving_point = (0, 0)
-            # for i in range(len(combined_list)):
-            #     if total_route_length[i] < shortest_route:
-            #         shortest_route = total_route_length[i]
-            #         opt_leaving_point = potential_b[i]
-            #     # else:
-            #     #     break
-
-            # #print(opt_leaving_point)
-            # return opt_leaving_point
+            model.economics_cache_hits += 1
+        return value
+
+    # =========================================================================
+    #   Leaving points with N partners in one go.
+    #
+    #   partner_pos, partner_des: (N, 2) arrays. If the destinations are within
+    #   the margin of each other, the leaving point is the current position.
+    # =========================================================================
+    def calc_leaving_points(self, partner_pos, partner_des):
+        partner_des = np.atleast_2d(np.asarray(partner_des, dtype=float))
+        opt_leaving_points = calc_leaving_points(self.pos, self.destination, partner_pos, partner_des,
+                                                 self.model.fuel_reduction)
+        margin = 1
+        close = (np.abs(self.destination[0] - partner_des[:, 0]) < margin) & \
+                (np.abs(self.destination[1] - partner_des[:, 1]) < margin)
+        opt_leaving_points[close] = self.pos
+        return opt_leaving_points
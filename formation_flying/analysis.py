@@ -0,0 +1,134 @@
+'''
+# =============================================================================
+# In this file the statistics of the results of a batch are computed.
+#
+# The flights are selected with a mask on the agent table (airports are left
+# out), and the mean, standard deviation and median of every reporter are
+# computed with one groupby over the parameter values of the batch. The
+# histograms are drawn from the same table.
+#
+# Run it from the command line, for example:
+#   python -m formation_flying.analysis --folder cnp_data --batch 4_CNP_airport3
+#   python -m formation_flying.analysis --batch 4_CNP_airport3 --columns "Delay time" "Utility"
+# =============================================================================
+'''
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from scipy.stats import norm
+
+from .results import load_results
+
+# The reporters that are plotted by default
+default_columns = ["Planned fuel", "Distance in formation", "Delay time", "Estimated delay", "Estimated fuel saved",
+                   "Estimated utility", "Real fuel saved", "Utility"]
+
+
+# =============================================================================
+#   The results written by batchrunner.py, or the Excel file of an older batch.
+# =============================================================================
+def load_batch(folder, batch, table="agent"):
+    if os.path.isdir(f'{folder}/{batch}'):
+        return load_results(f'{folder}/{batch}', table=table)
+    return load_results(f'{folder}/{table}_output_{batch}.xlsx')
+
+
+def flight_mask(agent_data):
+    return (agent_data["Behavior"] != "Airport") & (agent_data["Planned fuel"] > 0.)
+
+
+# =============================================================================
+#   The parameter columns of a batch are the ones in front of "Run".
+# =============================================================================
+def parameter_columns(agent_data):
+    columns = list(agent_data.columns)
+    if "Run" not in columns:
+        return []
+    return columns[:columns.index("Run")]
+
+
+# =============================================================================
+#   Mean, standard deviation (of the population, like np.std) and median of
+#   the columns over all flights, per combination of parameter values.
+# =============================================================================
+def summary(agent_data, columns=None, by=None):
+    flights = agent_data[flight_mask(agent_data)]
+    if columns is None:
+        columns = [column for column in default_columns if column in flights.columns]
+    if by is None:
+        by = parameter_columns(flights)
+    values = flights[list(by) + list(columns)].copy()
+    values[columns] = values[columns].apply(pd.to_numeric, errors="coerce")
+
+    if len(by) == 0:
+        # All flights in one group
+        grouped = values[columns].groupby(np.zeros(len(values), dtype=int))
+    else:
+        grouped = values.groupby(list(by))[columns]
+    statistics = pd.concat({"mean": grouped.mean(), "std": grouped.std(ddof=0), "median": grouped.median(),
+                            "N": grouped.count()}, axis=1)
+    return statistics.swaplevel(axis=1)[columns]
+
+
+def histogram(data, name, path, mu, sigma, median):
+    print("Plotting", name)
+    num_bins = 50
+    # the histogram of the data
+    plt.hist(data, num_bins, density=True, stacked=True, facecolor='blue', alpha=0.5)
+
+    # add a 'best fit' line
+    x = np.linspace(np.min(data) - mu*0.1, np.max(data) + mu*0.1, 100)
+    plt.plot(x, norm.pdf(x, mu, sigma), 'r--', label=f"Normal PDF with\nmean={np.round(mu, decimals=2)}\nstd={np.round(sigma, decimals=2)}")
+    plt.axvline(median, ymin=0, ymax=mu, c='g', label=f"Median = {np.round(median, decimals=2)}")
+
+    plt.xlabel(f'{name}')
+    plt.ylabel('Probability')
+    plt.title(f'N = {data.size}, mu={np.round(mu, decimals=2)}, sigma={np.round(sigma, decimals=2)}')
+    plt.legend()
+    plt.savefig(path)
+    plt.close()
+
+
+# =============================================================================
+#   One histogram per column of all flights in the batch, with the statistics
+#   of summary. Missing values (e.g. the delay of flights that never arrived)
+#   are left out.
+# =============================================================================
+def plot_histograms(agent_data, folder, batch, columns=None):
+    statistics = summary(agent_data, columns, by=[])
+    flights = agent_data[flight_mask(agent_data)]
+    for column in statistics.columns.get_level_values(0).unique():
+        data = pd.to_numeric(flights[column], errors="coerce").dropna().to_numpy()
+        if data.size == 0:
+            continue
+        row = statistics[column].iloc[0]
+        histogram(data, column, f'{folder}/{column}_{batch}.png', row["mean"], row["std"], row["median"])
+    return statistics
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Statistics and histograms of the results of a batch.")
+    parser.add_argument("--folder", default="cnp_data", help="folder with the results, the plots are saved here too")
+    parser.add_argument("--batch", default="4_CNP_airport3", help="tag of the batch")
+    parser.add_argument("--columns", nargs="+", default=None, help="agent reporters to analyse")
+    parser.add_argument("--summary", default=None, help="save the statistics per parameter value to this csv file")
+    parser.add_argument("--no-plots", action="store_true", help="only compute the statistics")
+    arguments = parser.parse_args(arguments)
+
+    agent_data = load_batch(arguments.folder, arguments.batch)
+    statistics = summary(agent_data, arguments.columns)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(statistics)
+    if arguments.summary is not None:
+        statistics.to_csv(arguments.summary)
+    if not arguments.no_plots:
+        plot_histograms(agent_data, arguments.folder, arguments.batch, arguments.columns)
+    return statistics
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+'''
+# =============================================================================
+# In this file the background server is defined: a ModularServer in which the
+# model doesn't step once per frame of the browser, but runs at full speed in
+# a background thread.
+#
+# The browser still asks for frames at its own rate (the fps slider), but a
+# frame is only rendered (the canvas, the chart, ...) when a snapshot is due:
+# every snapshot_steps steps and/or every snapshot_interval seconds. In the
+# meantime the model keeps stepping, so the chart gets a point per snapshot
+# instead of per step. The model starts running with the first frame that is
+# asked for (Start or Step), and then runs until all flights arrived, even
+# when the browser is stopped.
+#
+# The SimulationControl element adds buttons to skip ahead, without rendering
+# anything, to the next formation (or addition to a formation) or to a given
+# step. The model is paused there, until the next frame is asked for.
+#
+# The model is only touched by the thread that steps it; the rendering of the
+# elements happens in that thread too (or while it waits), so the frames are
+# always of the state between two steps.
+# =============================================================================
+'''
+
+import random
+import threading
+import time
+import traceback
+
+import tornado.escape
+import tornado.ioloop
+import tornado.websocket
+from tornado.concurrent import Future
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler, VisualizationElement
+
+
+class SimulationWorker(threading.Thread):
+    def __init__(self, server, snapshot_steps=None, snapshot_interval=0.25):
+        super().__init__(daemon=True)
+        self.server = server
+        self.model = server.model
+        self.snapshot_steps = snapshot_steps
+        self.snapshot_interval = snapshot_interval
+        self.loop = None  # The IOLoop of the requests, to resolve them from this thread
+
+        self.model_lock = threading.Lock()  # Held while stepping or rendering the model
+        self.condition = threading.Condition()  # For the state below
+        self.paused = True
+        self.stopped = False
+        self.finished = False
+        self.target = None  # Skipping to: ("step", step) or ("formation", formations so far)
+        self.waiter = None  # Future of the frame the browser is waiting for
+        self.held = None  # Frame rendered while nobody was waiting (at a skip target or the end)
+        self.full_frame = False  # A frame was never sent, so the next one can't be a delta
+
+        self.last_snapshot_step = self.model.schedule.steps
+        self.last_snapshot_time = time.perf_counter()
+
+    # =========================================================================
+    #   Requests of the browser (from the IOLoop thread).
+    # =========================================================================
+    def next_frame(self):
+        future = Future()
+        self.loop = tornado.ioloop.IOLoop.current()
+        with self.condition:
+            if self.held is not None:
+                future.set_result(self.held)
+                self.held = None
+            elif self.finished:
+                future.set_result({"type": "end"})
+            else:
+                if self.waiter is not None:
+                    self.resolve(self.waiter, None)
+                self.waiter = future
+                self.paused = False
+                self.condition.notify_all()
+        return future
+
+    def skip(self, step=None):
+        with self.condition:
+            if step is None:
+                self.target = ("formation", formations(self.model))
+            else:
+                self.target = ("step", int(step))
+            self.discard_held()
+            self.paused = False
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            if self.waiter is not None:
+                self.resolve(self.waiter, None)
+                self.waiter = None
+            self.condition.notify_all()
+
+    # =========================================================================
+    #   The thread that steps the model.
+    # =========================================================================
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while self.paused and not self.stopped:
+                        self.condition.wait()
+                    if self.stopped:
+                        return
+                    target = self.target
+
+                with self.model_lock:
+                    if not self.model.running or self.target_reached(target):
+                        self.hold(finished=not self.model.running)
+                        continue
+                    self.model.step()
+                    if target is None and self.waiter is not None and self.snapshot_due():
+                        self.deliver(self.render())
+        except Exception:
+            traceback.print_exc()
+            with self.condition:
+                self.finished = True
+                self.paused = True
+                if self.waiter is not None:
+                    self.resolve(self.waiter, {"type": "end"})
+                    self.waiter = None
+
+    def target_reached(self, target):
+        if target is None:
+            return False
+        kind, value = target
+        if kind == "step":
+            return self.model.schedule.steps >= value
+        return formations(self.model) > value
+
+    def snapshot_due(self):
+        if self.snapshot_steps and self.model.schedule.steps - self.last_snapshot_step >= self.snapshot_steps:
+            return True
+        if self.snapshot_interval is not None and \
+                time.perf_counter() - self.last_snapshot_time >= self.snapshot_interval:
+            return True
+        return False
+
+    def render(self):
+        if self.full_frame:
+            for element in self.server.visualization_elements:
+                if hasattr(element, "reset_frames"):
+                    element.reset_frames(None)
+            self.full_frame = False
+        self.last_snapshot_step = self.model.schedule.steps
+        self.last_snapshot_time = time.perf_counter()
+        return {"type": "viz_state", "data": self.server.render_elements()}
+
+    # =========================================================================
+    #   Send a frame to the browser if it is waiting for one, or keep it for
+    #   the next request (and pause) at a skip target and at the end.
+    # =========================================================================
+    def deliver(self, frame):
+        with self.condition:
+            if self.waiter is None:
+                self.full_frame = True
+                return
+            self.resolve(self.waiter, frame)
+            self.waiter = None
+
+    def hold(self, finished=False):
+        with self.condition:
+            self.discard_held()
+        frame = self.render()
+        with self.condition:
+            self.target = None
+            self.paused = True
+            self.finished = finished
+            if self.waiter is not None:
+                self.resolve(self.waiter, frame)
+                self.waiter = None
+            else:
+                self.held = frame
+
+    def discard_held(self):
+        if self.held is not None:
+            self.held = None
+            self.full_frame = True
+
+    def resolve(self, future, frame):
+        self.loop.add_callback(future.set_result, frame)
+
+
+def formations(model):
+    return model.new_formation_counter + model.add_to_formation_counter
+
+
+class BackgroundSocketHandler(SocketHandler):
+    async def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        worker = self.application.worker
+
+        if msg["type"] == "get_step":
+            frame = await worker.next_frame()
+            if frame is not None:
+                try:
+                    self.write_message(frame)
+                except tornado.websocket.WebSocketClosedError:
+                    pass
+
+        elif msg["type"] == "skip":
+            worker.skip(msg.get("step"))
+
+        else:
+            super().on_message(message)
+
+
+class BackgroundServer(ModularServer):
+    socket_handler = (r"/ws", BackgroundSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler, ModularServer.static_handler,
+                ModularServer.local_handler]
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model", model_params={},
+                 snapshot_steps=None, snapshot_interval=0.25):
+        self.snapshot_steps = snapshot_steps
+        self.snapshot_interval = snapshot_interval
+        self.worker = None
+        super().__init__(model_cls, visualization_elements, name, model_params)
+
+    def reset_model(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker.join()
+            # The model that is replaced may not have finished
+            if hasattr(self.model, "close"):
+                self.model.close()
+        super().reset_model()
+        self.worker = SimulationWorker(self, self.snapshot_steps, self.snapshot_interval)
+        self.worker.start()
+
+    def render_elements(self):
+        return super().render_model()
+
+    def render_model(self):
+        with self.worker.model_lock:
+            return self.render_elements()
+
+
+# =============================================================================
+#   The model step and the formations so far, with the buttons to skip ahead.
+# =============================================================================
+class SimulationControl(VisualizationElement):
+    local_includes = ["formation_flying/simulation_control.js?" + str(random.randint(100,999))]
+    js_code = "elements.push(new SimulationControl());"
+
+    def render(self, model):
+        return {"step": model.schedule.steps,
+                "new_formations": model.new_formation_counter,
+                "added_to_formations": model.add_to_formation_counter,
+                "running": model.running}
@@ -0,0 +1,289 @@
+'''
+# =============================================================================
+# In this file the parallel batch runner is defined.
+#
+# ParallelBatchRunner takes the same arguments as mesa's BatchRunner, but runs
+# the models in a pool of processes. Every run gets its own seed, derived from
+# the seed of the batch and the number of the run, so a run gives the same
+# result no matter which process runs it or in which order the runs finish.
+#
+# The reporters are collected in the process that ran the model, and sent back
+# as soon as the run is finished (see iter_results). They are stored in the same
+# way as BatchRunner stores them, so get_model_vars_dataframe and
+# get_agent_vars_dataframe give the same tables.
+#
+# A run stops when the model stops running, at max_steps, or when it takes
+# longer than time_limit seconds. The time limit is checked between the steps;
+# a run that is stuck in a step for HANG_GRACE seconds after its limit is
+# stopped by stopping its process (and is lost, like a failed run). A run that
+# raises an exception is recorded in failed_runs, without stopping the other
+# runs. When a process of the pool dies, the pool is restarted and the runs
+# that were lost are run again: the run that killed the process up to retries
+# times, the runs that happened to be running next to it as often as needed.
+# =============================================================================
+'''
+
+import os
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from mesa.batchrunner import BatchRunner
+from tqdm import tqdm
+
+
+# Why a run stopped
+FINISHED = "finished"
+MAX_STEPS = "max_steps"
+TIME_LIMIT = "time_limit"
+FAILED = "failed"
+
+
+# Seconds after its time limit at which a run is taken to be stuck in a step
+HANG_GRACE = 10
+
+
+def run_seed(batch_seed, run):
+    return int(np.random.SeedSequence(batch_seed, spawn_key=(run,)).generate_state(1)[0])
+
+
+# =============================================================================
+#   Runs one model in a process of the pool. Returns the reporters of the run.
+# =============================================================================
+def run_model(model_cls, kwargs, seed, max_steps, time_limit, model_reporters, agent_reporters,
+              collect_datacollector):
+    model = None
+    try:
+        model = model_cls(seed=seed, **kwargs)
+
+        start = time.time()
+        status = FINISHED
+        while model.running:
+            if model.schedule.steps >= max_steps:
+                status = MAX_STEPS
+                break
+            if time_limit is not None and time.time() - start > time_limit:
+                status = TIME_LIMIT
+                break
+            model.step()
+
+        model_vars = None
+        if model_reporters:
+            model_vars = OrderedDict((var, reporter(model)) for var, reporter in model_reporters.items())
+        agent_vars = None
+        if agent_reporters:
+            agent_vars = OrderedDict()
+            for agent in model.schedule._agents.values():
+                agent_vars[agent.unique_id] = OrderedDict((var, getattr(agent, reporter))
+                                                          for var, reporter in agent_reporters.items())
+
+        collector_model = collector_agents = None
+        datacollector = getattr(model, "datacollector", None)
+        if hasattr(datacollector, "finalize"):
+            datacollector.finalize(model)
+        if collect_datacollector and datacollector is not None:
+            if datacollector.model_reporters is not None:
+                collector_model = datacollector.get_model_vars_dataframe()
+            if datacollector.agent_reporters is not None:
+                collector_agents = datacollector.get_agent_vars_dataframe()
+
+        return status, model_vars, agent_vars, collector_model, collector_agents
+    except Exception:
+        return FAILED, traceback.format_exc(), None, None, None
+    finally:
+        # A run that stopped at max_steps or the time limit still has its event log open
+        if hasattr(model, "close"):
+            model.close()
+
+
+# =============================================================================
+#   Stop the processes of a pool, including the ones that are running a model.
+#   ProcessPoolExecutor can't cancel a task that is running.
+# =============================================================================
+def terminate(executor):
+    for process in list(executor._processes.values()):
+        process.terminate()
+
+
+class ParallelBatchRunner(BatchRunner):
+    def __init__(
+        self,
+        model_cls,
+        variable_parameters=None,
+        fixed_parameters=None,
+        iterations=1,
+        max_steps=1000,
+        model_reporters=None,
+        agent_reporters=None,
+        display_progress=True,
+        processes=None,
+        seed=0,
+        time_limit=None,
+        retries=1,
+        collect_datacollector=True
+    ):
+        super().__init__(model_cls, variable_parameters, fixed_parameters, iterations, max_steps,
+                         model_reporters, agent_reporters, display_progress)
+        self.processes = processes or os.cpu_count()
+        self.seed = seed
+        self.time_limit = time_limit
+        self.retries = retries
+        self.collect_datacollector = collect_datacollector
+
+        self.run_parameters = OrderedDict()  # model_key: all parameters of the run
+        self.run_iterations = OrderedDict()  # model_key: iteration of the run within its parameter set
+        self.run_seeds = OrderedDict()  # model_key: seed of the run
+        self.run_status = OrderedDict()  # model_key: why the run stopped
+        self.failed_runs = OrderedDict()  # model_key: traceback
+
+    # =========================================================================
+    #   All runs, in the same order and with the same keys as BatchRunner.
+    # =========================================================================
+    def make_runs(self):
+        runs = []
+        run = 0
+        total_iterations, all_kwargs, all_param_values = self._make_model_args()
+        for kwargs, param_values in zip(all_kwargs, all_param_values):
+            for iteration in range(self.iterations):
+                if self.parameters_list:
+                    model_key = tuple(param_values) + (run,)
+                else:
+                    model_key = (run,)
+                self.run_parameters[model_key] = kwargs
+                self.run_iterations[model_key] = iteration
+                runs.append((model_key, kwargs, run_seed(self.seed, run)))
+                run += 1
+        return runs
+
+    def run_all(self):
+        for _ in self.iter_results():
+            pass
+
+    # =========================================================================
+    #   Runs all models, and yields (model_key, model_vars, agent_vars) of every
+    #   run as soon as it is finished. Failed runs are not yielded.
+    #
+    #   At most one run per process is handed to the pool, so the runs that
+    #   were lost when a process died are the ones that were running. Only a
+    #   run that was running on its own is charged an attempt for it; when
+    #   more runs were lost, they are run again one at a time (without being
+    #   charged), to find out which one it was.
+    # =========================================================================
+    def iter_results(self):
+        queue = deque(self.make_runs())
+        suspects = deque()  # Runs that were running when a process died
+        attempts = {model_key: 0 for model_key, kwargs, seed in queue}
+
+        with tqdm(total=len(queue), disable=not self.display_progress) as pbar:
+            while queue or suspects:
+                source = suspects if suspects else queue
+                workers = 1 if suspects else self.processes
+                running = OrderedDict()  # future: (model_key, kwargs, seed, start time)
+                executor = ProcessPoolExecutor(max_workers=workers)
+                try:
+                    while source or running:
+                        while source and len(running) < workers:
+                            model_key, kwargs, seed = source.popleft()
+                            future = executor.submit(run_model, self.model_cls, kwargs, seed, self.max_steps,
+                                                     self.time_limit, self.model_reporters, self.agent_reporters,
+                                                     self.collect_datacollector)
+                            running[future] = (model_key, kwargs, seed, time.time())
+
+                        done, _ = wait(running, timeout=self.wait_timeout(running), return_when=FIRST_COMPLETED)
+                        for future in done:
+                            result = future.result()
+                            model_key = running.pop(future)[0]
+                            pbar.update()
+                            if self.store_result(model_key, result):
+                                yield model_key, result[1], result[2]
+
+                        hung = self.hung_runs(running)
+                        if hung:
+                            # A step that doesn't return can only be stopped by stopping its process, the
+                            # other runs of the pool are run again
+                            for future in hung:
+                                model_key = running.pop(future)[0]
+                                pbar.update()
+                                self.give_up(model_key, TIME_LIMIT, "A step didn't return within the time limit "
+                                                                    "({} s), the process was stopped"
+                                             .format(self.time_limit))
+                            source.extendleft(reversed([run[:3] for run in running.values()]))
+                            running.clear()
+                            terminate(executor)
+                            break
+
+                except BrokenProcessPool:
+                    lost = []
+                    for future, (model_key, kwargs, seed, start) in running.items():
+                        if future.done() and not future.cancelled() and future.exception() is None:
+                            # Finished before the pool broke
+                            result = future.result()
+                            pbar.update()
+                            if self.store_result(model_key, result):
+                                yield model_key, result[1], result[2]
+                        else:
+                            lost.append((model_key, kwargs, seed))
+                    if len(lost) == 1:
+                        model_key = lost[0][0]
+                        attempts[model_key] += 1
+                        if attempts[model_key] > self.retries:
+                            pbar.update()
+                            self.give_up(model_key, FAILED, "The process running this run died")
+                            continue
+                    suspects.extend(lost)
+                finally:
+                    executor.shutdown(wait=True)
+
+    # =========================================================================
+    #   The limit on the run time is checked by run_model between the steps. A
+    #   run that is still running HANG_GRACE seconds after its time limit is
+    #   stuck in a step, and is stopped from here.
+    # =========================================================================
+    def wait_timeout(self, running):
+        if self.time_limit is None:
+            return None
+        deadline = min(start for model_key, kwargs, seed, start in running.values()) + self.time_limit + HANG_GRACE
+        return max(0., deadline - time.time())
+
+    def hung_runs(self, running):
+        if self.time_limit is None:
+            return []
+        now = time.time()
+        return [future for future, (model_key, kwargs, seed, start) in running.items()
+                if now - start > self.time_limit + HANG_GRACE]
+
+    def give_up(self, model_key, status, message):
+        self.run_status[model_key] = status
+        self.run_seeds[model_key] = run_seed(self.seed, model_key[-1])
+        self.failed_runs[model_key] = message
+
+    def store_result(self, model_key, result):
+        status, model_vars, agent_vars, collector_model, collector_agents = result
+        self.run_status[model_key] = status
+        self.run_seeds[model_key] = run_seed(self.seed, model_key[-1])
+        if status == FAILED:
+            self.failed_runs[model_key] = model_vars
+            return False
+
+        if self.model_reporters:
+            self.model_vars[model_key] = model_vars
+        if self.agent_reporters:
+            for agent_id, reports in agent_vars.items():
+                self.agent_vars[model_key + (agent_id,)] = reports
+        if collector_model is not None:
+            self.datacollector_model_reporters[model_key] = collector_model
+        if collector_agents is not None:
+            self.datacollector_agent_reporters[model_key] = collector_agents
+        return True
+
+    # =========================================================================
+    #   The results are stored in the order in which the runs finished, sort
+    #   them by run like BatchRunner.
+    # =========================================================================
+    def _prepare_report_table(self, vars_dict, extra_cols=None):
+        run_column = len(self.parameters_list[0]) if self.parameters_list else 0
+        ordered = OrderedDict(sorted(vars_dict.items(), key=lambda item: item[0][run_column]))
+        return super()._prepare_report_table(ordered, extra_cols)
@@ -0,0 +1,155 @@
+'''
+# =============================================================================
+# In this file the checkpoints of the model are defined.
+#
+# A checkpoint holds the whole state of a run between two steps: the flights
+# and their rows of the fleet store, the formations, the state of the
+# negotiations (the pending bids and managers calling of CNP, the auctions, ...),
+# the random streams of the model and of every agent, the data collected so far
+# and how far the event log was written. A restored model continues exactly
+# like the original would have:
+#
+#   data = model.checkpoint()            # or model.checkpoint("run.ckpt")
+#   model = FormationFlying.restore(data)
+#
+# fork copies a model into branches, that can continue with other parameters
+# from the step of the fork on (see BRANCH_PARAMETERS). A sweep over those only
+# has to make the airports and flights, and run the steps before the fork, once:
+#
+#   branches = model.fork([{"communication_range": 100}, {"fuel_reduction": 0.6}])
+#   branches = model.fork(4)  # 4 copies with the same parameters
+#
+# The checkpoint is a compressed pickle, so it can only be restored with the
+# same versions of the code and of the packages. It's for resuming and forking
+# runs, not for keeping them: that's what the replay files are for (see
+# replay.py).
+# =============================================================================
+'''
+
+import pickle
+import platform
+import zlib
+
+import numpy as np
+
+FORMAT = 1
+
+# The parameters that can be changed in a branch:
+#   communication_range, fuel_reduction: like the parameters of the model,
+#   negotiation: attributes of the negotiations of every flight, e.g.
+#       {"negotiation_window": 20} for CNP, {"auction_joining_timeframe": 3}
+#       for the Japanese auctions,
+#   airport_closures: {unique_id of an airport: step at which it closes},
+#   event_log: where the events of the branch go (see events.py).
+BRANCH_PARAMETERS = ("communication_range", "fuel_reduction", "negotiation", "airport_closures", "event_log")
+NEGOTIATIONS = ("cnp", "english", "vickrey", "japanese")
+
+
+# =============================================================================
+#   The caches of the last step are only used within that step, so they are
+#   dropped instead of saved (they are rebuilt in the next step).
+# =============================================================================
+def drop_step_caches(model):
+    model.flight_index.invalidate()
+    model.flight_index.positions = model.flight_index.indptr = model.flight_index.indices = None
+    model.flight_index.neighbor_lists = {}
+    if model.greedy is not None:
+        model.greedy.invalidate()
+    for agent in model.schedule.agents:
+        if getattr(agent, "agent_type", None) == "Flight":
+            agent.economics_cache = {}
+            agent.economics_cache_step = None
+
+
+def checkpoint(model, path=None):
+    drop_step_caches(model)
+    header = {"format": FORMAT,
+              "steps": model.schedule.steps,
+              "params": model.params,
+              "python": platform.python_version(),
+              "numpy": np.__version__}
+    data = zlib.compress(pickle.dumps({"header": header, "model": model}, protocol=pickle.HIGHEST_PROTOCOL))
+    if path is not None:
+        with open(path, "wb") as file:
+            file.write(data)
+    return data
+
+
+def load(path_or_data):
+    if isinstance(path_or_data, (bytes, bytearray)):
+        data = path_or_data
+    else:
+        with open(path_or_data, "rb") as file:
+            data = file.read()
+    state = pickle.loads(zlib.decompress(data))
+    if state["header"]["format"] != FORMAT:
+        raise Exception("Checkpoint format {} is not supported (expected {})".format(state["header"]["format"],
+                                                                                   FORMAT))
+    return state["model"]
+
+
+def restore(path_or_data):
+    model = load(path_or_data)
+    model.events.reopen()
+    return model
+
+
+# =============================================================================
+#   Copies of the model, one per dictionary of branch parameters (or n copies
+#   with the same parameters). The model is pickled once, and every branch is
+#   unpickled from it.
+# =============================================================================
+def fork(model, branches):
+    if isinstance(branches, int):
+        branches = [{} for _ in range(branches)]
+    for parameters in branches:
+        unknown = set(parameters) - set(BRANCH_PARAMETERS)
+        if unknown:
+            raise Exception("Can't change {} in a branch, only {}".format(sorted(unknown), BRANCH_PARAMETERS))
+        if model.events.file is not None and "event_log" not in parameters:
+            raise Exception("The model logs events to {}, give every branch an event_log of its own"
+                            .format(model.events.destination))
+
+    data = checkpoint(model)
+    forks = []
+    for parameters in branches:
+        branch = load(data)
+        set_branch_parameters(branch, parameters)
+        forks.append(branch)
+    return forks
+
+
+def set_branch_parameters(model, parameters):
+    from .events import EventLog
+
+    flights = [agent for agent in model.schedule.agents if getattr(agent, "agent_type", None) == "Flight"]
+    if "communication_range" in parameters:
+        model.vision = parameters["communication_range"]
+        model.flight_index.radius = parameters["communication_range"]
+        model.flight_index.invalidate()
+        for flight in flights:
+            flight.communication_range = parameters["communication_range"]
+
+    if "fuel_reduction" in parameters:
+        model.fuel_reduction = parameters["fuel_reduction"]
+
+    for name, value in parameters.get("negotiation", {}).items():
+        negotiations = [getattr(flight, kind) for flight in flights for kind in NEGOTIATIONS if hasattr(flight, kind)]
+        if not negotiations or not all(hasattr(negotiation, name) for negotiation in negotiations):
+            raise Exception("The negotiations of this model have no parameter {}".format(name))
+        for negotiation in negotiations:
+            setattr(negotiation, name, value)
+
+    airports = {agent.unique_id: agent for agent in model.schedule.agents
+                if getattr(agent, "agent_type", None) == "Airport"}
+    for unique_id, step in parameters.get("airport_closures", {}).items():
+        airport = airports.get(int(unique_id))
+        if airport is None:
+            raise Exception("There is no airport {}".format(unique_id))
+        airport.closure_time = step
+        model.schedule.activate(airport)
+
+    if "event_log" in parameters:
+        model.events = EventLog(parameters["event_log"], model=model)
+
+    model.params = dict(model.params, branch=dict(parameters, step=model.schedule.steps))
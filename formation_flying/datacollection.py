@@ -0,0 +1,260 @@
+'''
+# =============================================================================
+# In this file the array based data collector is defined.
+#
+# It is used like mesa's DataCollector (same reporters, same collect and the
+# same dataframes), but the values are written into NumPy columns that grow in
+# chunks, instead of lists of tuples. The agent reporters that are columns of
+# the fleet store (see fleet.py) are copied from the store in one go.
+#
+# What is collected can be limited with:
+#   interval: collect every interval steps (and at the last step).
+#   mode: "all" collects the model and all agents at every collection,
+#         "arrival" collects the model at every collection, but every flight
+#                   only once: at the step it arrived (the other agents, and
+#                   the flights that didn't arrive, at the last step),
+#         "final" collects the model and all agents only at the last step.
+# The last step is the one at which the model stops running. If a run is
+# stopped from outside (e.g. at max_steps), call finalize(model).
+# =============================================================================
+'''
+
+import types
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from .fleet import ARRIVED
+
+
+MODES = ("all", "arrival", "final")
+
+
+class Columns:
+    # A set of columns with the same number of rows, that grows in chunks.
+    def __init__(self, names, chunk):
+        self.names = list(names)
+        self.chunk = chunk
+        self.rows = 0
+        self.capacity = 0
+        self.columns = {name: np.empty(0) for name in self.names}
+
+    def reserve(self, rows):
+        if rows <= self.capacity:
+            return
+        capacity = max(rows, self.capacity + max(self.chunk, self.capacity // 2))
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            if column.dtype == object:
+                grown[:] = None
+            grown[:self.rows] = column[:self.rows]
+            self.columns[name] = grown
+        self.capacity = capacity
+
+    # Values that can't be stored as floats (strings, ...) turn the column into an object column
+    def set(self, name, start, values):
+        column = self.columns[name]
+        if column.dtype != object:
+            try:
+                values = np.asarray(values, dtype=float)
+            except (TypeError, ValueError):
+                column = self.columns[name] = column.astype(object)
+        column[start:start + len(values)] = values
+
+    def append(self, values):
+        start = self.rows
+        n = len(next(iter(values.values())))
+        self.reserve(start + n)
+        for name, value in values.items():
+            self.set(name, start, value)
+        self.rows += n
+
+    def __getitem__(self, name):
+        return self.columns[name][:self.rows]
+
+    # Only the rows in use are kept in a checkpoint (see checkpoint.py), not the capacity ahead
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["columns"] = {name: column[:self.rows].copy() for name, column in self.columns.items()}
+        state["capacity"] = self.rows
+        return state
+
+
+class ArrayDataCollector:
+    def __init__(self, model_reporters=None, agent_reporters=None, interval=1, mode="all", chunk=1024):
+        if mode not in MODES:
+            raise Exception("Unknown collection mode {}".format(mode))
+        self.interval = interval
+        self.mode = mode
+        self.model_reporters = {}
+        self.agent_reporters = {}
+        for name, reporter in (model_reporters or {}).items():
+            self.model_reporters[name] = reporter
+        for name, reporter in (agent_reporters or {}).items():
+            self.agent_reporters[name] = reporter
+
+        self.model_columns = Columns(["Step"] + list(self.model_reporters), chunk)
+        self.agent_columns = Columns(["Step", "AgentID"] + list(self.agent_reporters), chunk)
+        self.collected_steps = set()
+        self.collected_agents = None  # unique_id of the agents collected so far, in "arrival" mode
+        self.finished = False
+        self.rows_cache = None
+        self.collected_rows = None  # Per row of the fleet store, in "arrival" mode
+
+    # =========================================================================
+    #   Like DataCollector.model_vars: name -> values, the latest one last.
+    # =========================================================================
+    @property
+    def model_vars(self):
+        return {name: self.model_columns[name] for name in self.model_reporters}
+
+    def model_value(self, model, reporter):
+        if type(reporter) is str:
+            return getattr(model, reporter, None)
+        if isinstance(reporter, list):
+            return reporter[0](*reporter[1])
+        if isinstance(reporter, (types.LambdaType, partial)):
+            return reporter(model)
+        return reporter()
+
+    # =========================================================================
+    #   The values of an agent reporter for a list of agents. Attributes that
+    #   are columns of the fleet store are taken from the store directly.
+    # =========================================================================
+    def agent_values(self, model, agents, rows, reporter):
+        if type(reporter) is not str:
+            return [reporter(agent) for agent in agents]
+        fleet = model.fleet
+        if fleet is None or reporter not in fleet.columns or getattr(fleet, reporter).ndim != 1 or \
+                fleet.columns[reporter][1] is not float:
+            return [getattr(agent, reporter, None) for agent in agents]
+        values = getattr(fleet, reporter)[np.maximum(rows, 0)]
+        for i in np.flatnonzero(rows < 0):
+            value = getattr(agents[i], reporter, None)
+            if value is None:
+                value = np.nan
+            elif not isinstance(value, (int, float)) and values.dtype != object:
+                values = values.astype(object)
+            values[i] = value
+        return values
+
+    def record_agents(self, model, agents):
+        if len(agents) == 0 or not self.agent_reporters:
+            return
+        rows, ids = self.agent_rows(model, agents)
+        values = {"Step": np.full(len(agents), model.schedule.steps), "AgentID": ids}
+        for name, reporter in self.agent_reporters.items():
+            values[name] = self.agent_values(model, agents, rows, reporter)
+        self.agent_columns.append(values)
+
+    # =========================================================================
+    #   Rows of the agents in the fleet store of the model (-1 for the other
+    #   agents) and their ids. Kept as long as the agents are the same.
+    # =========================================================================
+    def agent_rows(self, model, agents):
+        key = tuple(map(id, agents))
+        if self.rows_cache is None or self.rows_cache[0] != key:
+            fleet = model.fleet
+            rows = np.array([agent.fleet_index if fleet is not None and getattr(agent, "fleet", None) is fleet
+                             else -1 for agent in agents], dtype=int)
+            ids = np.array([agent.unique_id for agent in agents])
+            self.rows_cache = (key, rows, ids)
+        return self.rows_cache[1], self.rows_cache[2]
+
+    def collect(self, model):
+        final = not model.running
+        step = model.schedule.steps
+        if step in self.collected_steps or self.finished:
+            return
+        if not final and (self.mode == "final" or step % self.interval != 0):
+            return
+        self.collected_steps.add(step)
+
+        if self.model_reporters:
+            values = {"Step": [step]}
+            for name, reporter in self.model_reporters.items():
+                values[name] = [self.model_value(model, reporter)]
+            self.model_columns.append(values)
+
+        agents = model.schedule.agents
+        if self.mode == "arrival" and not final:
+            self.record_arrivals(model, agents)
+        elif self.mode == "arrival":
+            # Everyone that wasn't collected at its arrival
+            self.record_arrivals(model, agents)
+            self.record_remaining(model, agents)
+        else:
+            self.record_agents(model, agents)
+        self.finished = final
+
+    # =========================================================================
+    #   The steps from first to last at which collect would collect, as long
+    #   as the model keeps running (see cruise in fastforward.py).
+    # =========================================================================
+    def due_steps(self, first, last):
+        if self.finished or self.mode == "final":
+            return []
+        first = -(-first // self.interval) * self.interval
+        return [step for step in range(first, last + 1, self.interval) if step not in self.collected_steps]
+
+    def record_arrivals(self, model, agents):
+        if self.collected_agents is None:
+            self.collected_agents = set()
+        fleet = model.fleet
+        if fleet is not None:
+            state = fleet.column("state")
+            if self.collected_rows is None or len(self.collected_rows) != len(state):
+                self.collected_rows = np.array([flight.unique_id in self.collected_agents
+                                                for flight in fleet.flights], dtype=bool)
+            rows = np.flatnonzero((state == ARRIVED) & ~self.collected_rows)
+            self.collected_rows[rows] = True
+            new = [fleet.flights[row] for row in rows]
+        else:
+            new = [agent for agent in agents if getattr(agent, "state", None) == "arrived" and
+                   agent.unique_id not in self.collected_agents]
+        self.collected_agents.update(flight.unique_id for flight in new)
+        self.record_agents(model, new)
+
+    def record_remaining(self, model, agents):
+        remaining = [agent for agent in agents if agent.unique_id not in self.collected_agents]
+        self.collected_agents.update(agent.unique_id for agent in remaining)
+        self.record_agents(model, remaining)
+
+    # =========================================================================
+    #   Collect the last step of a run that was stopped from outside.
+    # =========================================================================
+    def finalize(self, model):
+        if self.finished:
+            return
+        if model.schedule.steps not in self.collected_steps:
+            running = model.running
+            model.running = False
+            self.collect(model)
+            model.running = running
+            return
+        if self.mode == "arrival":
+            self.record_arrivals(model, model.schedule.agents)
+            self.record_remaining(model, model.schedule.agents)
+        self.finished = True
+
+    # =========================================================================
+    #   The same dataframes as mesa's DataCollector. The model dataframe is
+    #   indexed like mesa's (0, 1, ...) when every step was collected, and by
+    #   step otherwise.
+    # =========================================================================
+    def get_model_vars_dataframe(self):
+        data = pd.DataFrame({name: self.model_columns[name] for name in self.model_reporters})
+        if self.mode != "all" or self.interval != 1:
+            data.index = pd.Index(self.model_columns["Step"].astype(int), name="Step")
+        return data
+
+    def get_agent_vars_dataframe(self):
+        data = pd.DataFrame({"Step": self.agent_columns["Step"].astype(int),
+                             "AgentID": self.agent_columns["AgentID"].astype(int)})
+        for name in self.agent_reporters:
+            column = self.agent_columns[name]
+            if column.dtype == object:
+                column = column.copy()
+            data[name] = column
+        return data.set_index(["Step", "AgentID"])
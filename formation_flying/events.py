@@ -0,0 +1,159 @@
+'''
+# =============================================================================
+# In this file the event log of the negotiations is defined.
+#
+# The negotiations report what they do (calls for contract, bids, accepted and
+# refused bids, auctions, ...) as events: the step, the kind of event, the
+# manager and contractor involved (their unique_id), the price and the utility,
+# plus whatever else is useful for that kind of event.
+#
+# The log is off by default, and then emit returns at once. When the arguments
+# of an event take work to compute (a list, a loop over the bids), check the
+# log first:
+#
+#   if self.flight.model.events:
+#       self.flight.model.events.emit("auction_round", manager=self.flight,
+#                                     bidders=[c.unique_id for c in bidders])
+#
+# Where the events go is set with the event_log parameter of the model:
+#   None: nowhere (disabled),
+#   "memory": kept in EventLog.events,
+#   a path ending in .jsonl: one JSON object per line,
+#   any other path: a binary file of pickled events.
+# The files are written through a buffer. They are closed when all flights
+# arrived, or by model.close() when a run ends before that. An EventLog of
+# its own can be used as a context manager. read_events reads the files back
+# into a DataFrame.
+# =============================================================================
+'''
+
+import json
+import os
+import pickle
+
+import pandas as pd
+
+
+class Event:
+    __slots__ = ("step", "kind", "manager", "contractor", "price", "utility", "data")
+
+    def __init__(self, step, kind, manager=None, contractor=None, price=None, utility=None, data=None):
+        self.step = step
+        self.kind = kind
+        self.manager = manager
+        self.contractor = contractor
+        self.price = price
+        self.utility = utility
+        self.data = data
+
+    def as_dict(self):
+        record = {"step": self.step, "kind": self.kind, "manager": self.manager, "contractor": self.contractor,
+                  "price": self.price, "utility": self.utility}
+        if self.data:
+            record.update(self.data)
+        return record
+
+    def __repr__(self):
+        return "Event({})".format(", ".join("{}={}".format(k, v) for k, v in self.as_dict().items()
+                                            if v is not None))
+
+
+def agent_id(agent):
+    return getattr(agent, "unique_id", agent)
+
+
+def plain(value):
+    # NumPy scalars can't be written to JSON
+    return value.item() if hasattr(value, "item") else value
+
+
+class EventLog:
+    def __init__(self, destination=None, model=None, buffering=1 << 16):
+        self.destination = destination
+        self.model = model
+        self.events = []
+        self.file = None
+        self.buffering = buffering
+        self.enabled = destination is not None
+        if destination is None or destination == "memory":
+            self.format = "memory"
+        elif str(destination).endswith(".jsonl"):
+            self.format = "jsonl"
+            self.file = open(destination, "w", buffering=buffering)
+        else:
+            self.format = "pickle"
+            self.file = open(destination, "wb", buffering=buffering)
+
+    def __bool__(self):
+        return self.enabled
+
+    def emit(self, kind, manager=None, contractor=None, price=None, utility=None, **data):
+        if not self.enabled:
+            return
+        step = self.model.schedule.steps if self.model is not None else None
+        event = Event(step, kind, agent_id(manager), agent_id(contractor), plain(price), plain(utility),
+                      {name: plain(agent_id(value)) for name, value in data.items()})
+        if self.format == "memory":
+            self.events.append(event)
+        elif self.format == "jsonl":
+            self.file.write(json.dumps(event.as_dict()) + "\n")
+        else:
+            pickle.dump(event.as_dict(), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def dataframe(self):
+        return pd.DataFrame([event.as_dict() for event in self.events])
+
+    # =========================================================================
+    #   A checkpoint of the model (see checkpoint.py) keeps how far the file
+    #   was written. When the model is restored, reopen cuts off what was
+    #   written after the checkpoint and continues from there.
+    # =========================================================================
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.file is not None:
+            self.file.flush()
+            state["position"] = self.file.tell()
+        state["file"] = None
+        return state
+
+    def reopen(self):
+        position = self.__dict__.pop("position", None)
+        if position is None:
+            return
+        if not os.path.exists(self.destination) or os.path.getsize(self.destination) < position:
+            raise Exception("The event log {} is shorter than at the checkpoint".format(self.destination))
+        os.truncate(self.destination, position)
+        self.file = open(self.destination, "a" if self.format == "jsonl" else "ab", buffering=self.buffering)
+
+
+# =============================================================================
+#   Read an event log file (.jsonl or pickled) into a DataFrame, with one row
+#   per event.
+# =============================================================================
+def read_events(path):
+    if str(path).endswith(".jsonl"):
+        return pd.read_json(path, lines=True)
+    records = []
+    with open(path, "rb") as file:
+        while True:
+            try:
+                records.append(pickle.load(file))
+            except EOFError:
+                break
+    return pd.DataFrame(records)
@@ -0,0 +1,166 @@
+'''
+# =============================================================================
+# In this file the fast-forward of the cruise phases is defined
+# (fast_forward=True, greedy algorithm only).
+#
+# In most steps nothing happens except that the flights move: every flight in
+# the air cruises straight to its destination (or to its leaving point in
+# formation), and no flight that looks for a formation has a manager within
+# communication range. steps_to_next_event finds how many steps it takes, at
+# the least, until something can happen again:
+#   - a flight departs, arrives, or reaches the leaving point of its formation,
+#   - a flight looking for a formation and a manager accepting bids get within
+#     communication range of each other (bounded by how fast they can close
+#     the distance),
+#   - an airport closes.
+# As long as a flight is on its way to a joining point, nothing is skipped.
+#
+# cruise then runs these steps without activating the agents. In them every
+# flight flies straight on, so its position, its fuel and the bookkeeping of
+# Flight.step after k steps follow in closed form from where it started:
+# k steps of its speed along its heading, k times the fuel of a step, ... The
+# fleet store is only filled in for the steps the data collector collects
+# (see ArrayDataCollector.due_steps; mesa's DataCollector collects every
+# step), and for the last one. A skip of a single step uses the same floating
+# point operations as move_fleet, so it gives the same result up to the last
+# bit; longer skips are the same up to rounding (which can still tip a later
+# negotiation the other way).
+# =============================================================================
+'''
+
+import numpy as np
+
+from .datacollection import ArrayDataCollector
+from .fleet import SCHEDULED, FLYING, NO_FORMATION, IN_FORMATION
+from .movement import distances, lengths, space_arrays, space_rows
+from .spatial_index import cKDTree
+
+
+# Steps in which something may happen that are not skipped, on top of the bounds,
+# to stay clear of rounding in the distances.
+SAFETY_STEPS = 1
+
+
+def steps_until(distance, speed, threshold):
+    # Steps a flight can make towards a point before it gets within threshold of it
+    return np.floor((distance - threshold) / speed).astype(int) - SAFETY_STEPS
+
+
+def nearest_distance(points, others):
+    if cKDTree is not None:
+        return cKDTree(others).query(points)[0].min()
+    return min(distances(others, point).min() for point in points)
+
+
+# =============================================================================
+#   The number of steps from the current one that can be run without
+#   activating the agents (0 if something may happen in this step).
+# =============================================================================
+def steps_to_next_event(model):
+    fleet = model.fleet
+    steps = model.schedule.steps
+    state = fleet.column("state")
+    formation_state = fleet.column("formation_state")
+    if np.any((formation_state != NO_FORMATION) & (formation_state != IN_FORMATION)):
+        # On the way to a joining point
+        return 0
+
+    bound = np.inf
+    scheduled = np.flatnonzero(state == SCHEDULED)
+    if len(scheduled) > 0:
+        bound = np.ceil(fleet.departure_time[scheduled].min()) - steps - SAFETY_STEPS
+
+    for agent in model.schedule.agents:
+        if getattr(agent, "closure_time", 0) != 0 and agent.airport_type != "Closed":
+            bound = min(bound, np.ceil(agent.closure_time) - steps - SAFETY_STEPS)
+
+    flying = np.flatnonzero(state == FLYING)
+    if len(flying) > 0:
+        pos = fleet.pos[flying]
+        speed = fleet.speed[flying]
+        to_destination = distances(fleet.destination[flying], pos)
+        bound = min(bound, steps_until(to_destination, speed, speed / 2).min())
+        in_formation = formation_state[flying] == IN_FORMATION
+        if np.any(in_formation):
+            to_leaving = distances(fleet.leaving_point[flying[in_formation]], pos[in_formation])
+            bound = min(bound, steps_until(to_leaving, speed[in_formation], speed[in_formation] / 2).min())
+    if bound <= 0:
+        return 0
+
+    # The flights looking for a formation (see do_greedy), and the managers they would bid to
+    # (see find_greedy_candidate), which can be any flight in the flight index. The managers
+    # that aren't flying stay where they are, so the distance to them closes half as fast.
+    flights = fleet.flights
+    bidders = [row for row in flying if formation_state[row] == NO_FORMATION and flights[row].manager == 0]
+    if bidders:
+        candidates = np.array([row for row in range(fleet.size)
+                               if flights[row].manager == 1 and flights[row].accepting_bids == 1], dtype=int)
+        max_speed = fleet.column("speed").max()
+        moving = state[candidates] == FLYING
+        for managers, closing_speed in ((candidates[moving], 2 * max_speed), (candidates[~moving], max_speed)):
+            if len(managers) > 0:
+                gap = nearest_distance(fleet.pos[bidders], fleet.pos[managers]) - model.flight_index.radius
+                bound = min(bound, np.floor(gap / closing_speed) - SAFETY_STEPS)
+
+    if bound == np.inf:
+        return 0
+    return max(int(bound), 0)
+
+
+# =============================================================================
+#   Run n_steps steps in which only the flights in the air move (see
+#   steps_to_next_event), with the same bookkeeping as Flight.step.
+# =============================================================================
+def cruise(model, n_steps):
+    fleet = model.fleet
+    schedule = model.schedule
+    rows = np.flatnonzero(fleet.column("state") == FLYING)
+    flights = [fleet.flights[row] for row in rows]
+    for flight in flights:
+        if flight.manager == 1:
+            flight.formation_size = 1 + len(flight.agents_in_my_formation)
+        else:
+            flight.formation_size = 0
+    in_formation = np.array([len(flight.agents_in_my_formation) > 0 for flight in flights], dtype=bool)
+
+    # Where the flights start, and what changes in a step (see Flight.move)
+    pos = fleet.pos[rows]
+    speed = fleet.speed[rows]
+    formation = fleet.formation_state[rows] == IN_FORMATION
+    targets = fleet.destination[rows]
+    targets[formation] = fleet.leaving_point[rows[formation]]
+    headings = targets - pos
+    headings /= lengths(headings)[:, None]
+    f_c = np.where(formation, model.fuel_reduction * speed, speed)
+    fuel = fleet.fuel_consumption[rows]
+    real_flight_time = fleet.real_flight_time[rows]
+    distance_in_formation = fleet.distance_in_formation[rows[in_formation]]
+    total_fuel_consumption = model.total_fuel_consumption
+    total_flight_time = model.total_flight_time
+    steps, time = schedule.steps, schedule.time
+
+    collector = model.datacollector
+    if isinstance(collector, ArrayDataCollector):
+        due = collector.due_steps(steps + 1, steps + n_steps)
+    else:
+        due = range(steps + 1, steps + n_steps + 1)
+    for k in [step - steps for step in due if step < steps + n_steps] + [n_steps]:
+        fleet.pos[rows] = pos + headings * (speed * k)[:, None]
+        fleet.heading[rows] = headings
+        fleet.fuel_consumption[rows] = fuel + f_c * k
+        fleet.real_flight_time[rows] = real_flight_time + k
+        fleet.distance_in_formation[rows[in_formation]] = distance_in_formation + speed[in_formation] * k
+        # The fuel of the flights is added to the total in schedule order
+        model.total_fuel_consumption = float(np.add.accumulate(
+            np.concatenate(([total_fuel_consumption], f_c * k)))[-1])
+        model.total_flight_time = total_flight_time + k * len(rows)
+        schedule.steps = steps + k
+        schedule.time = time + k
+        collector.collect(model)
+
+    if model.movement_engine == "fleet":
+        points, index = space_arrays(model.space)
+        points[space_rows(model, index)[rows]] = fleet.pos[rows]
+    else:
+        for flight in flights:
+            model.space.move_agent(flight, flight.pos)
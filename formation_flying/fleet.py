@@ -0,0 +1,147 @@
+'''
+# =============================================================================
+# In this file the fleet store is defined.
+#
+# The state of all flights is kept in contiguous NumPy arrays (structure of
+# arrays), with one row per flight. A Flight agent is a thin view on its row:
+# its attributes like pos, state or fuel_consumption read from and write to
+# the store. This way the whole fleet can be moved, its fuel accounted and its
+# arrivals checked with a single array operation per step.
+#
+# The model owns one store for all flights (fleet_store=True). Without it,
+# every flight keeps a store of its own with a single row.
+#
+# Points that are not set (None) are stored as nan. The states are stored as
+# integer codes, see STATES and FORMATION_STATES.
+# =============================================================================
+'''
+
+import numpy as np
+
+
+STATES = ("scheduled", "flying", "arrived")
+FORMATION_STATES = ("no_formation", "committed", "in_formation", "unavailable", "adding_to_formation")
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+FORMATION_STATE_CODES = {state: code for code, state in enumerate(FORMATION_STATES)}
+
+SCHEDULED, FLYING, ARRIVED = range(len(STATES))
+NO_FORMATION, COMMITTED, IN_FORMATION, UNAVAILABLE, ADDING_TO_FORMATION = range(len(FORMATION_STATES))
+
+
+class Fleet:
+    # name: (shape of one row, dtype, initial value)
+    columns = {"pos": ((2,), float, np.nan),
+               "destination": ((2,), float, np.nan),
+               "heading": ((2,), float, np.nan),
+               "joining_point": ((2,), float, np.nan),
+               "leaving_point": ((2,), float, np.nan),
+               "speed": ((), float, 0.),
+               "speed_to_joining": ((), float, np.nan),
+               "departure_time": ((), float, 0.),
+               "planned_fuel": ((), float, 0.),
+               "fuel_consumption": ((), float, 0.),
+               "deal_value": ((), float, 0.),
+               "distance_in_formation": ((), float, 0.),
+               "real_flight_time": ((), np.int64, 0),
+               # Performance indicators, collected by the agent reporters
+               "estimated_fuel_saved": ((), float, 0.),
+               "real_fuel_saved": ((), float, np.nan),
+               "estimated_delay": ((), float, 0.),
+               "delay": ((), float, np.nan),
+               "estimated_utility_score": ((), float, 0.),
+               "real_utility_score": ((), float, 0.),
+               "state": ((), np.int8, SCHEDULED),
+               "formation_state": ((), np.int8, NO_FORMATION)}
+
+    def __init__(self, capacity=1):
+        self.size = 0
+        self.capacity = 0
+        self.flights = []
+        for name, (shape, dtype, initial) in self.columns.items():
+            setattr(self, name, np.full((0,) + shape, initial, dtype=dtype))
+        self.reserve(capacity)
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        for name, (shape, dtype, initial) in self.columns.items():
+            column = np.full((capacity,) + shape, initial, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def add(self, flight):
+        if self.size == self.capacity:
+            self.reserve(max(1, 2 * self.capacity))
+        index = self.size
+        self.size += 1
+        self.flights.append(flight)
+        return index
+
+    # =========================================================================
+    #   Views on the rows that are in use.
+    # =========================================================================
+    def column(self, name):
+        return getattr(self, name)[:self.size]
+
+    def distances_to(self, points):
+        deltas = np.asarray(points)[:self.size] - self.pos[:self.size]
+        return (deltas[:, 0] ** 2 + deltas[:, 1] ** 2) ** 0.5
+
+    def in_state(self, state):
+        return self.state[:self.size] == STATE_CODES[state]
+
+    def in_formation_state(self, formation_state):
+        return self.formation_state[:self.size] == FORMATION_STATE_CODES[formation_state]
+
+
+# =============================================================================
+#   Properties with which a Flight reads and writes its row of the store.
+#   Points are returned as copies, so a point that is kept (like a joining point
+#   taken from the current position) doesn't change when the store does.
+#   versioned: setting the attribute bumps formation_version of the flight.
+#   optional: the attribute can be None (stored as nan).
+# =============================================================================
+def point_attribute(name, versioned=False, optional=True):
+    def getter(flight):
+        column = getattr(flight.fleet, name)
+        if optional and column.item(flight.fleet_index, 0) != column.item(flight.fleet_index, 0):
+            return None
+        return column[flight.fleet_index].copy()
+
+    def setter(flight, value):
+        if value is None:
+            getattr(flight.fleet, name)[flight.fleet_index] = np.nan
+        else:
+            getattr(flight.fleet, name)[flight.fleet_index] = value
+        if versioned:
+            flight.formation_version += 1
+
+    return property(getter, setter)
+
+
+def scalar_attribute(name, versioned=False, optional=False):
+    def getter(flight):
+        value = getattr(flight.fleet, name).item(flight.fleet_index)
+        if optional and value != value:
+            return None
+        return value
+
+    def setter(flight, value):
+        getattr(flight.fleet, name)[flight.fleet_index] = np.nan if value is None else value
+        if versioned:
+            flight.formation_version += 1
+
+    return property(getter, setter)
+
+
+def state_attribute(name, states, codes, versioned=False):
+    def getter(flight):
+        return states[getattr(flight.fleet, name).item(flight.fleet_index)]
+
+    def setter(flight, value):
+        getattr(flight.fleet, name)[flight.fleet_index] = codes[value]
+        if versioned:
+            flight.formation_version += 1
+
+    return property(getter, setter)
@@ -18,6 +18,9 @@ def real_fuel_saved(model):
     return model.total_planned_fuel - model.total_fuel_consumption
 
 def total_deal_value(model):
+    # Airports have no deal value, so the flights in the fleet store are all that count
+    if model.fleet is not None:
+        return float(model.fleet.column("deal_value").sum())
     deal_values = [agent.deal_value for agent in model.schedule.agents]
     return sum(deal_values)
 
@@ -31,4 +34,10 @@ def new_formation_counter(model):
     return model.new_formation_counter
 
 def add_to_formation_counter(model):
-    return model.add_to_formation_counter
\ No newline at end of file
+    return model.add_to_formation_counter
+
+def economics_cache_hits(model):
+    return model.economics_cache_hits
+
+def economics_cache_misses(model):
+    return model.economics_cache_misses
\ No newline at end of file
@@ -1,3 +1,5 @@
+import random
+
 import numpy as np
 
 
@@ -29,34 +31,460 @@ def calc_middle_point(a, b):
     return [0.5 * (a[0] + b[0]), 0.5 * (a[1] + b[1])]
 
 
+# =============================================================================
+#   Random streams. new_seed draws a seed from the operating system, for runs
+#   without one. spawn_random gives an independent stream for a key (like the
+#   unique_id of an agent), derived from the seed, so what an agent draws
+#   doesn't depend on what the other agents drew before it.
+# =============================================================================
+def new_seed():
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+def spawn_random(seed, *key):
+    return random.Random(int.from_bytes(np.random.SeedSequence(seed, spawn_key=key).generate_state(4).tobytes(),
+                                        "little"))
+
+
+# =============================================================================
+#   The behaviors of the flights: the weights of profit, fuel saved, delay and
+#   flying with an ally in their utility. behavior_options holds them by name,
+#   behavior_weights holds the same weights as a matrix (one row per behavior,
+#   in the order of behavior_names), so the utility of many bids, or of flights
+#   with different behaviors, is computed in one go. Other behaviors can be
+#   added with register_behavior.
+# =============================================================================
+weight_names = ("profit_weight", "fuel_saved_weight", "delay_weight", "with_ally_weight")
+behavior_options = {}
+behavior_names = []
+behavior_weights = np.empty((0, len(weight_names)))
+
+
+def register_behavior(name, profit_weight, fuel_saved_weight, delay_weight, with_ally_weight=0):
+    global behavior_weights
+    weights = (profit_weight, fuel_saved_weight, delay_weight, with_ally_weight)
+    behavior_options[name] = dict(zip(weight_names, weights))
+    if name in behavior_names:
+        behavior_weights[behavior_names.index(name)] = weights
+    else:
+        behavior_names.append(name)
+        behavior_weights = np.vstack((behavior_weights, weights))
+    return behavior_names.index(name)
+
+
+register_behavior("budget", 4, 1, -1, 0)
+register_behavior("green", 1, 4, -1, 0)
+register_behavior("express", 1, 1, -4, 0)
+register_behavior("balanced", 2, 2, -2, 0)
+
+
+def behavior_index(behavior):
+    if isinstance(behavior, str):
+        return behavior_names.index(behavior)
+    return np.array([behavior_names.index(name) for name in behavior])
+
+
+# =============================================================================
+#   behavior is the name of a behavior, or (an array of) indices of behaviors in
+#   behavior_weights. With a name the weights are used as they are, so the
+#   scores of scalars stay plain floats. All arguments can be arrays.
+# =============================================================================
 def utility_function(profit, fuel_saved, delay, with_ally=0, behavior="balanced"):
-    behavior_options = {"budget": {"profit_weight": 4,
-                                   "fuel_saved_weight": 1,
-                                   "delay_weight": -1,
-                                   "with_ally_weight": 0},
-                        "green": {"profit_weight": 1,
-                                  "fuel_saved_weight": 4,
-                                  "delay_weight": -1,
-                                  "with_ally_weight": 0},
-                        "express": {"profit_weight": 1,
-                                    "fuel_saved_weight": 1,
-                                    "delay_weight": -4,
-                                    "with_ally_weight": 0},
-                        "balanced": {"profit_weight": 2,
-                                     "fuel_saved_weight": 2,
-                                     "delay_weight": -2,
-                                     "with_ally_weight": 0}}
-    # print(behavior)
-    # print(behavior_options[behavior])
-    # print(behavior_options[behavior].values())
-    # print(type(behavior_options[behavior].values()))
-    # print(type(*behavior_options[behavior].values()))
-    # print(*behavior_options[behavior].values())
-    score = utility_score(profit, fuel_saved, delay, with_ally, *behavior_options[behavior].values())
-    return score
+    if isinstance(behavior, str):
+        weights = behavior_options[behavior]
+        return utility_score(profit, fuel_saved, delay, with_ally, weights["profit_weight"],
+                             weights["fuel_saved_weight"], weights["delay_weight"], weights["with_ally_weight"])
+    weights = behavior_weights[behavior]
+    return utility_score(profit, fuel_saved, delay, with_ally, weights[..., 0], weights[..., 1], weights[..., 2],
+                         weights[..., 3])
 
 
 def utility_score(profit, fuel_saved, delay, with_ally, profit_weight, fuel_saved_weight, delay_weight, with_ally_weight):
     # print(f"Utility score: \nprofit: {profit*profit_weight}\nfuel: {fuel_saved*fuel_saved_weight}\ndelay: {delay*delay_weight}\nally: {with_ally*with_ally_weight}")
     score = profit*profit_weight + fuel_saved*fuel_saved_weight + delay*delay_weight + with_ally*with_ally_weight
     return score
+
+
+# =============================================================================
+#   Inversion of the utility function: the bid at which a flight reaches a
+#   given utility. The utility is linear in the profit, which is
+#       fuel_saved - bid               for the flight paying the bid, or
+#       fuel_saved + bid / receive_share   for the flight(s) receiving it.
+#   Works on scalars and on NumPy arrays (of utilities, savings and delays).
+# =============================================================================
+def bid_profit(bid, fuel_saved, receive_share=None):
+    if receive_share is None:
+        return fuel_saved - bid
+    return fuel_saved + bid / receive_share
+
+
+def bid_for_utility(utility, fuel_saved, delay, with_ally=0, behavior="balanced", receive_share=None):
+    if isinstance(behavior, str):
+        weights = behavior_weights[behavior_names.index(behavior)]
+    else:
+        weights = behavior_weights[behavior]
+    if np.any(weights[..., 0] <= 0):
+        raise Exception("The utility of behavior {} doesn't depend on the bid".format(behavior))
+    # The profit at which the utility is reached
+    profit = (utility - fuel_saved * weights[..., 1] - delay * weights[..., 2]
+              - with_ally * weights[..., 3]) / weights[..., 0]
+    if receive_share is None:
+        return fuel_saved - profit
+    return (profit - fuel_saved) * receive_share
+
+
+# =============================================================================
+#   The first of the bids start, start + step, start + 2 * step, ... at which
+#   the utility reaches the given utility: drops to it or below when paying the
+#   bid, rises to it or above when receiving it. This is the bid the stepping
+#   loops (bid += step while the utility hasn't been reached) end on, but found
+#   directly. It is checked with utility_function itself, so rounding gives the
+#   same bid as the loops.
+# =============================================================================
+def stepped_bid(utility, fuel_saved, delay, with_ally=0, behavior="balanced", receive_share=None, step=1, start=0):
+    def reached(bid):
+        score = utility_function(bid_profit(bid, fuel_saved, receive_share), fuel_saved, delay, with_ally,
+                                 behavior)
+        if receive_share is None:
+            return score <= utility
+        return score >= utility
+
+    exact = bid_for_utility(utility, fuel_saved, delay, with_ally, behavior, receive_share)
+    bid = start + np.maximum(np.ceil((exact - start) / step), 0) * step
+    # Correct for rounding, the bid can be one step off
+    for _ in range(2):
+        bid = np.where(reached(bid), bid, bid + step)
+        bid = np.where((bid - step >= start) & reached(bid - step), bid - step, bid)
+    if np.ndim(bid) == 0:
+        bid = bid.item()
+        if isinstance(step, int) and isinstance(start, int):
+            bid = int(bid)
+    return bid
+
+
+# =============================================================================
+#   Weighted Fermat-Weber point of K anchor points, for N problems at once.
+#
+#   Minimises sum_k weights[k] * |anchors[k] - p| over p with Weiszfeld
+#   iterations. When one of the anchors is optimal (its weight outweighs the pull
+#   of the others) it is returned directly, as Weiszfeld does not converge onto
+#   it. Every row is iterated until its own step drops below tol, so the answer
+#   of a row does not depend on the other rows in the batch.
+#   The three anchor problems of the joining- and leaving-points are solved in
+#   closed form by FermatPointSolver, this is the general fallback.
+#
+#   anchors: (N, K, 2), weights: (N, K) or (K,). Returns an (N, 2) array.
+# =============================================================================
+def weighted_fermat_weber(anchors, weights, tol=1e-9, max_iter=1000):
+    anchors = np.asarray(anchors, dtype=float)
+    n, k = anchors.shape[0], anchors.shape[1]
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), (n, k))
+    solution = np.empty((n, 2))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deltas = anchors[:, np.newaxis, :, :] - anchors[:, :, np.newaxis, :]  # (N, K, K, 2)
+        dists = np.sqrt(deltas[..., 0] ** 2 + deltas[..., 1] ** 2)
+        coincident = dists < 1e-9
+        units = np.where(coincident[..., np.newaxis], 0.0, deltas / dists[..., np.newaxis])
+        pull = (weights[:, np.newaxis, :, np.newaxis] * units).sum(axis=2)
+        pull = np.sqrt(pull[..., 0] ** 2 + pull[..., 1] ** 2)
+        anchor_weight = (weights[:, np.newaxis, :] * coincident).sum(axis=2)
+        anchor_optimal = pull <= anchor_weight
+
+    at_anchor = anchor_optimal.any(axis=1)
+    first_anchor = np.argmax(anchor_optimal, axis=1)
+    solution[at_anchor] = anchors[at_anchor, first_anchor[at_anchor]]
+
+    # Start in the weighted centroid
+    active = np.flatnonzero(~at_anchor)
+    if len(active) > 0:
+        solution[active] = (anchors[active] * weights[active, :, np.newaxis]).sum(axis=1) / \
+            weights[active].sum(axis=1)[:, np.newaxis]
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        x = solution[active]
+        diff = anchors[active] - x[:, np.newaxis, :]
+        dist = np.maximum(np.sqrt(diff[..., 0] ** 2 + diff[..., 1] ** 2), 1e-12)
+        inv = weights[active] / dist
+        new_x = (anchors[active] * inv[..., np.newaxis]).sum(axis=1) / inv.sum(axis=1)[:, np.newaxis]
+        solution[active] = new_x
+        step = np.sqrt(((new_x - x) ** 2).sum(axis=1))
+        active = active[step > tol]
+    return solution
+
+
+def fermat_weber_cost(anchors, weights, points):
+    anchors = np.asarray(anchors, dtype=float)
+    diff = anchors - np.asarray(points, dtype=float)[:, np.newaxis, :]
+    return (np.asarray(weights, dtype=float) * np.sqrt(diff[..., 0] ** 2 + diff[..., 1] ** 2)).sum(axis=1)
+
+
+# =============================================================================
+#   Closed form weighted Fermat point of three anchors, for N problems at once.
+#
+#   At the optimum the weighted unit vectors towards the anchors add up to zero,
+#   so they form a triangle with the weights as sides. That fixes the angle under
+#   which the optimum sees each side of the anchor triangle, which gives its
+#   barycentric coordinates 1 / (cot(A_i) + cot(gamma_i)), with A_i the angle of
+#   the anchor triangle and gamma_i the angle of the weight triangle at anchor i.
+#   If an anchor is optimal itself, that anchor is returned.
+#
+#   The solver keeps its work arrays between calls and only grows them when a
+#   larger batch comes in, so scoring a neighbourhood every step doesn't
+#   allocate a new set of arrays for every pair.
+# =============================================================================
+class FermatPointSolver:
+    # Anchor i sees anchor i + 1 along edge i, and anchor i - 1 along edge i - 1 (reversed)
+    previous = np.array([2, 0, 1])
+    following = np.array([1, 2, 0])
+
+    def __init__(self, capacity=64):
+        self.capacity = 0
+        self.reserve(capacity)
+
+    def reserve(self, n):
+        if n <= self.capacity:
+            return
+        capacity = max(n, 2 * self.capacity)
+        self.anchors = np.empty((capacity, 3, 2))
+        self.weights = np.empty((capacity, 3))
+        self.edges = np.empty((capacity, 3, 2))
+        self.lengths = np.empty((capacity, 3))
+        self.pull = np.empty((capacity, 3, 2))
+        self.scratch = np.empty((capacity, 3, 6))
+        self.solution = np.empty((capacity, 2))
+        self.capacity = capacity
+
+    # =========================================================================
+    #   Joining point of (pos, destination) with (partner_pos, partner_des):
+    #   both fly to it with their own fuel fraction, and then fly together to
+    #   the middle point of their destinations with fuel_reduction.
+    # =========================================================================
+    def joining_points(self, pos, destination, partner_pos, partner_des, self_fraction=1., partner_fraction=1.,
+                       fuel_reduction=0.75, out=None):
+        n = len(partner_pos)
+        self.reserve(n)
+        anchors = self.anchors[:n]
+        anchors[:, 0] = pos
+        anchors[:, 1] = partner_pos
+        np.add(destination, partner_des, out=anchors[:, 2])
+        anchors[:, 2] *= 0.5
+        weights = self.weights[:n]
+        weights[:, 0] = self_fraction
+        weights[:, 1] = partner_fraction
+        weights[:, 2] = 2 * fuel_reduction
+        return self.solve(n, out)
+
+    # =========================================================================
+    #   Leaving point of (pos, destination) with (partner_pos, partner_des):
+    #   both fly from the middle point of their positions to it in formation
+    #   with fuel_reduction, and then on to their own destinations.
+    # =========================================================================
+    def leaving_points(self, pos, destination, partner_pos, partner_des, fuel_reduction=0.75, out=None):
+        n = len(partner_des)
+        self.reserve(n)
+        anchors = self.anchors[:n]
+        anchors[:, 0] = destination
+        anchors[:, 1] = partner_des
+        np.add(pos, partner_pos, out=anchors[:, 2])
+        anchors[:, 2] *= 0.5
+        weights = self.weights[:n]
+        weights[:, 0] = 1
+        weights[:, 1] = 1
+        weights[:, 2] = 2 * fuel_reduction
+        return self.solve(n, out)
+
+    # =========================================================================
+    #   Solve the first n problems in self.anchors / self.weights.
+    # =========================================================================
+    def solve(self, n, out=None):
+        anchors = self.anchors[:n]
+        weights = self.weights[:n]
+        edges = self.edges[:n]
+        lengths = self.lengths[:n]
+        pull = self.pull[:n]
+        scratch = self.scratch[:n]
+        solution = self.solution[:n] if out is None else out
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Unit vectors along the edges of the anchor triangle, 0 for coincident anchors
+            np.subtract(anchors[:, self.following], anchors, out=edges)
+            np.hypot(edges[..., 0], edges[..., 1], out=lengths)
+            coincident = lengths < 1e-9
+            np.divide(edges, lengths[..., np.newaxis], out=edges)
+            edges[coincident] = 0.0
+
+            # An anchor is optimal if the pull of the other two doesn't exceed its own weight
+            w_next = weights[:, self.following]
+            w_prev = weights[:, self.previous]
+            u_next = edges
+            u_prev = edges[:, self.previous]
+            np.multiply(u_next, w_next[..., np.newaxis], out=pull)
+            pull -= u_prev * w_prev[..., np.newaxis]
+            pull_size = np.hypot(pull[..., 0], pull[..., 1], out=scratch[..., 0])
+            anchor_weight = weights + w_next * coincident + w_prev * coincident[:, self.previous]
+            anchor_optimal = pull_size <= anchor_weight
+
+            # cot of the anchor triangle angles
+            cos_a = np.multiply(u_next[..., 0], u_prev[..., 0], out=scratch[..., 1])
+            cos_a += u_next[..., 1] * u_prev[..., 1]
+            np.negative(cos_a, out=cos_a)
+            sin_a = np.multiply(u_next[..., 0], u_prev[..., 1], out=scratch[..., 2])
+            sin_a -= u_next[..., 1] * u_prev[..., 0]
+            np.abs(sin_a, out=sin_a)
+
+            # cot of the weight triangle angles
+            cos_g = np.multiply(w_next, w_next, out=scratch[..., 3])
+            cos_g += w_prev * w_prev
+            cos_g -= weights * weights
+            cos_g /= 2 * w_next * w_prev
+            sin_g = np.multiply(cos_g, cos_g, out=scratch[..., 4])
+            np.subtract(1, sin_g, out=sin_g)
+            np.sqrt(sin_g, out=sin_g)
+
+            barycentric = np.divide(cos_a, sin_a, out=scratch[..., 5])
+            barycentric += cos_g / sin_g
+            np.divide(1, barycentric, out=barycentric)
+            barycentric /= barycentric.sum(axis=1)[:, np.newaxis]
+            np.einsum("nk,nkd->nd", barycentric, anchors, out=solution)
+
+        at_anchor = anchor_optimal.any(axis=1)
+        if at_anchor.any():
+            rows = np.flatnonzero(at_anchor)
+            solution[rows] = anchors[rows, np.argmax(anchor_optimal[rows], axis=1)]
+        # Nearly collinear anchors can break the closed form, those rows are iterated instead
+        failed = np.flatnonzero(~np.isfinite(solution).all(axis=1))
+        if len(failed) > 0:
+            solution[failed] = weighted_fermat_weber(anchors[failed], weights[failed])
+        if out is None:
+            return solution.copy()
+        return solution
+
+
+solver = FermatPointSolver()
+
+
+# =============================================================================
+#   Joining- and leaving-points of N pairs of flights.
+#
+#   pos, destination: (2,) or (N, 2), partner_pos, partner_des: (N, 2).
+#   self_fraction, partner_fraction: scalar or (N,), the fuel fraction with which
+#   each flight flies to the joining point (fuel_reduction if it leads a formation).
+#   Returns an (N, 2) array.
+# =============================================================================
+def calc_joining_points(pos, destination, partner_pos, partner_des, self_fraction=1., partner_fraction=1.,
+                        fuel_reduction=0.75, out=None):
+    return solver.joining_points(pos, destination, np.atleast_2d(partner_pos), np.atleast_2d(partner_des),
+                                 self_fraction, partner_fraction, fuel_reduction, out)
+
+
+def calc_leaving_points(pos, destination, partner_pos, partner_des, fuel_reduction=0.75, out=None):
+    return solver.leaving_points(pos, destination, np.atleast_2d(partner_pos), np.atleast_2d(partner_des),
+                                 fuel_reduction, out)
+
+
+def joining_point_problem(pos, destination, partner_pos, partner_des, self_fraction=1., partner_fraction=1.,
+                          fuel_reduction=0.75):
+    partner_pos = np.atleast_2d(np.asarray(partner_pos, dtype=float))
+    n = partner_pos.shape[0]
+    pos = np.broadcast_to(np.asarray(pos, dtype=float), (n, 2))
+    destination = np.broadcast_to(np.asarray(destination, dtype=float), (n, 2))
+    partner_des = np.broadcast_to(np.asarray(partner_des, dtype=float), (n, 2))
+    mid_point2 = 0.5 * (destination + partner_des)
+    anchors = np.stack((pos, partner_pos, mid_point2), axis=1)
+    weights = np.empty((n, 3))
+    weights[:, 0] = self_fraction
+    weights[:, 1] = partner_fraction
+    weights[:, 2] = 2 * fuel_reduction
+    return anchors, weights
+
+
+# =============================================================================
+#   The original joining point search: 200 samples on the line between the middle
+#   point of the positions and the middle point of the destinations. Only kept to
+#   check the solver against ("verify" mode of Flight.calc_joining_point).
+# =============================================================================
+def sample_joining_points(pos, destination, partner_pos, partner_des, self_fraction=1., partner_fraction=1.,
+                          fuel_reduction=0.75, num=200):
+    anchors, weights = joining_point_problem(pos, destination, partner_pos, partner_des, self_fraction,
+                                             partner_fraction, fuel_reduction)
+    mid_point1 = 0.5 * (anchors[:, 0] + anchors[:, 1])
+    mid_point2 = anchors[:, 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = (mid_point1[:, 1] - mid_point2[:, 1]) / (mid_point1[:, 0] - mid_point2[:, 0])
+        b = mid_point1[:, 1] - a * mid_point1[:, 0]
+        y = np.linspace(mid_point1[:, 1], mid_point2[:, 1], num=num, axis=1)
+        x = (y - b[:, np.newaxis]) / a[:, np.newaxis]
+    candidates = np.stack((x, y), axis=2)  # (N, num, 2)
+    diff = anchors[:, np.newaxis, :, :] - candidates[:, :, np.newaxis, :]
+    cost = (weights[:, np.newaxis, :] * np.sqrt(diff[..., 0] ** 2 + diff[..., 1] ** 2)).sum(axis=2)
+    # Vertical or horizontal lines can't be sampled this way, those rows are left as nan
+    cost = np.where(np.isfinite(cost), cost, np.inf)
+    the_index = np.argmin(cost, axis=1)
+    points = candidates[np.arange(len(candidates)), the_index]
+    points[~np.isfinite(cost.min(axis=1))] = np.nan
+    return points
+
+
+# =============================================================================
+#   Fuel savings of N pairs of flights at once, with the formulas of
+#   Flight.compute_potential_fuelsavings (up to rounding, so only use them to
+#   rank or screen pairs, and let the flights do the exact calculation).
+#
+#   pair_fuel_savings: two flights without a formation start one, seen from
+#   the first flight (pos, destination).
+#   joining_fuel_savings: a flight without a formation joins the formation of
+#   n_in_formation flights led by (leader_pos, leader_des), which leaves at
+#   leaving_point. The savings of the formation and the joiner together.
+#
+#   Points are (2,) or (N, 2) arrays, n_in_formation a scalar or (N,).
+# =============================================================================
+def point_distances(a, b):
+    deltas = a - b
+    return (deltas[..., 0] ** 2 + deltas[..., 1] ** 2) ** 0.5
+
+
+def pair_fuel_savings(pos, destination, partner_pos, partner_des, fuel_reduction=0.75):
+    pos, destination = np.asarray(pos, dtype=float), np.asarray(destination, dtype=float)
+    partner_pos, partner_des = np.atleast_2d(partner_pos), np.atleast_2d(partner_des)
+    n = len(partner_pos)
+    own_pos = np.broadcast_to(pos, (n, 2))
+    # Partners within the margin are joined on the spot, and left on the spot if their destinations are
+    margin = 1
+    joining_points = calc_joining_points(pos, destination, partner_pos, partner_des, 1., 1., fuel_reduction)
+    close = np.all(np.abs(own_pos - partner_pos) < margin, axis=1)
+    joining_points[close] = own_pos[close]
+    leaving_points = calc_leaving_points(pos, destination, partner_pos, partner_des, fuel_reduction)
+    close = np.all(np.abs(destination - partner_des) < margin, axis=1)
+    leaving_points[close] = own_pos[close]
+
+    original_distance = point_distances(pos, destination) + point_distances(partner_pos, partner_des)
+    added_distance = point_distances(pos, joining_points) + point_distances(leaving_points, destination) + \
+        point_distances(partner_pos, joining_points) + point_distances(partner_des, leaving_points)
+    formation_distance = point_distances(leaving_points, joining_points) * 2
+    return original_distance - (fuel_reduction * formation_distance + added_distance)
+
+
+def joining_fuel_savings(leader_pos, leader_des, leaving_point, n_in_formation, joiner_pos, joiner_des,
+                         fuel_reduction=0.75):
+    leader_pos, leader_des = np.asarray(leader_pos, dtype=float), np.asarray(leader_des, dtype=float)
+    joiner_pos, joiner_des = np.atleast_2d(joiner_pos), np.atleast_2d(joiner_des)
+    n = len(joiner_pos)
+    own_pos = np.broadcast_to(leader_pos, (n, 2))
+    margin = 1
+    joining_points = calc_joining_points(leader_pos, leader_des, joiner_pos, joiner_des, fuel_reduction, 1.,
+                                         fuel_reduction)
+    close = np.all(np.abs(own_pos - joiner_pos) < margin, axis=1)
+    joining_points[close] = own_pos[close]
+
+    new_distance_formation = point_distances(leader_pos, joining_points) + \
+        point_distances(joining_points, leaving_point)
+    original_distance_formation = point_distances(leader_pos, leaving_point)
+    savings_formation = fuel_reduction * n_in_formation * original_distance_formation - \
+        fuel_reduction * n_in_formation * new_distance_formation
+
+    new_fuel_joiner = point_distances(joiner_pos, joining_points) + \
+        point_distances(joining_points, leaving_point) * fuel_reduction + point_distances(leaving_point, joiner_des)
+    savings_joiner = point_distances(joiner_pos, joiner_des) - new_fuel_joiner
+    return savings_formation + savings_joiner
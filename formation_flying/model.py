@@ -5,15 +5,26 @@
 # =============================================================================
 """
 
+import random
+
 import numpy as np
 from mesa import Model
 from mesa.space import ContinuousSpace
-from mesa.time import SimultaneousActivation
 from mesa.datacollection import DataCollector
+from .datacollection import ArrayDataCollector
 from .parameters import model_reporter_parameters, agent_reporter_parameters
 from .agents.flight import Flight
 from .agents.airports import Airport
-from .miscellaneous import calc_distance
+from .miscellaneous import calc_distance, new_seed, spawn_random
+from .spatial_index import FlightIndex
+from .fleet import Fleet
+from .scheduler import FleetActivation, EventActivation
+from .events import EventLog
+from .fastforward import steps_to_next_event, cruise
+from .profiling import StepProfiler, profile_reporters
+from .negotiations.matching import Matching
+from .negotiations.greedy import FleetGreedy
+from . import checkpoint as checkpoints
 np.seterr(all='raise')
 
 
@@ -29,6 +40,47 @@ class FormationFlying(Model):
     #       communication_range: How far around should each Boid look for its neighbors
     #       separation: What's the minimum distance each Boid will attempt to
     #                   keep from any other the three drives.
+    #       verify_joining_point: check the joining point solver against the
+    #                   original 200-point sampling on every call (slow).
+    #       economics_cache: memoize the formation economics of flight pairs
+    #                   within a step.
+    #       fleet_store: keep the state of all flights in one set of contiguous
+    #                   arrays, instead of a separate store per flight.
+    #       movement_engine: "fleet" moves all flights at once with array
+    #                   operations on the fleet store (requires fleet_store),
+    #                   "agent" calls do_move of every flight. Both give the
+    #                   same results.
+    #       collector: "array" collects the reporters into NumPy columns (see
+    #                   datacollection.py), "mesa" uses mesa's DataCollector.
+    #       collect_interval, collect_mode: what the "array" collector collects,
+    #                   every collect_interval steps, and "all" agents, flights
+    #                   at their "arrival", or only the "final" step.
+    #       seed: seed of all random numbers of the run. The model draws the
+    #                   airports and flight plans from self.random, every
+    #                   agent draws its own decisions from agent.rng, a stream
+    #                   of its own derived from the seed (see agent_random).
+    #                   Without a seed one is drawn, and kept in self.params
+    #                   so the run can be replayed (see replay.py).
+    #       scheduler: "event" only activates the agents for which something can
+    #                   happen (flights in the air, airports that will close),
+    #                   "simultaneous" activates all agents in every step. Both
+    #                   give the same results.
+    #       event_log: where the events of the negotiations go (see events.py):
+    #                   None (off), "memory", or the path of a .jsonl or binary
+    #                   file.
+    #       fast_forward: skip the steps in which the flights only cruise in
+    #                   one go, without activating the agents (see
+    #                   fastforward.py). Greedy algorithm only, requires the
+    #                   fleet store. Gives the same results up to rounding,
+    #                   which can tip a negotiation the other way.
+    #       greedy_engine: "fleet" finds the candidates and fuel savings of all
+    #                   flights that look for a formation at once (see
+    #                   greedy.py), "agent" lets every flight search its own
+    #                   neighbourhood. Greedy algorithm only. Both give the
+    #                   same results.
+    #       profile: time the phases of every step, and count the neighbour
+    #                   queries, fuel saving evaluations and joining point
+    #                   solves (see profiling.py).
     # =========================================================================
     # TODO: Performance indicators:
     #  Fuel saved / alliance
@@ -48,9 +100,32 @@ class FormationFlying(Model):
         destination_airport_x = [0.7, 0.9], # same for destination airports
         destination_airport_y = [0.7, 0.9],
         fuel_reduction = 0.75,
-        negotiation_method = 1
+        negotiation_method = 1,
+        verify_joining_point = False,
+        economics_cache = True,
+        fleet_store = True,
+        movement_engine = "fleet",
+        collector = "array",
+        collect_interval = 1,
+        collect_mode = "all",
+        seed = None,
+        scheduler = "event",
+        event_log = None,
+        fast_forward = False,
+        greedy_engine = "fleet",
+        profile = False
     ):
-        
+        # The arguments of the run, see replay.py
+        self.params = {name: value for name, value in locals().items() if name not in ("self", "__class__")}
+
+        # mesa's Model.__new__ sets the random number generator on the class, so it would be
+        # shared by all models. Every model gets its own.
+        if seed is None:
+            seed = new_seed()
+        self.params["seed"] = seed
+        self._seed = seed
+        self.random = random.Random(seed)
+
         # =====================================================================
         #   Initialize parameters, the exact values will be defined later on.
         # =====================================================================
@@ -64,8 +139,33 @@ class FormationFlying(Model):
         # The agents are activated in random order at each step, in a space that
         # has a certain width and height and that is not toroidal 
         # (which means that edges do not wrap around)
-        self.schedule = SimultaneousActivation(self)
+        if movement_engine not in ("agent", "fleet"):
+            raise Exception("Unknown movement engine {}".format(movement_engine))
+        if movement_engine == "fleet" and not fleet_store:
+            raise Exception("The fleet movement engine requires the fleet store")
+        self.movement_engine = movement_engine
+        if fast_forward and (negotiation_method != 0 or not fleet_store):
+            raise Exception("Fast-forward requires the greedy algorithm and the fleet store")
+        self.fast_forward = fast_forward
+        if greedy_engine not in ("agent", "fleet"):
+            raise Exception("Unknown greedy engine {}".format(greedy_engine))
+        if scheduler == "event":
+            self.schedule = EventActivation(self)
+        elif scheduler == "simultaneous":
+            self.schedule = FleetActivation(self)
+        else:
+            raise Exception("Unknown scheduler {}".format(scheduler))
         self.space = ContinuousSpace(width, height, False) 
+        # Flight-only index for the neighbours within communication range
+        self.flight_index = FlightIndex(self, communication_range)
+        # Contiguous arrays with the state of all flights, see fleet.py
+        self.fleet = Fleet(n_flights) if fleet_store else None
+        # Rows of the flights in the points of the space, see movement.py
+        self.space_rows = None
+        # Events of the negotiations, see events.py
+        self.events = EventLog(event_log, model=self)
+        # Time spent per phase of the steps, see profiling.py
+        self.profiler = StepProfiler(self, enabled=profile)
 
         # These are values between [0,1] that limit the boundaries of the 
         # position of the origin- and destination airports.
@@ -78,8 +178,20 @@ class FormationFlying(Model):
         self.departure_window = departure_window
         self.fuel_reduction = fuel_reduction
         self.negotiation_method = negotiation_method
+        # The centralized matching of negotiation_method 5 (see matching.py)
+        self.matching = Matching(self) if negotiation_method == 5 else None
+        # The greedy algorithm for the whole fleet at once (see greedy.py)
+        self.greedy = FleetGreedy(self) if negotiation_method == 0 and greedy_engine == "fleet" else None
+        # Check every joining point against the original 200-point sampling (slow, for debugging only)
+        self.verify_joining_point = verify_joining_point
+        # Memoize joining/leaving points, fuel savings and delays of flight pairs within a step
+        self.economics_cache = economics_cache
+        self.economics_cache_hits = 0
+        self.economics_cache_misses = 0
 
         self.fuel_savings_closed_deals = 0
+        # Sum of the deal values of all flights, kept up to date by the flights
+        self.deal_value_balance = 0
 
         self.total_planned_fuel = 0
 
@@ -96,10 +208,42 @@ class FormationFlying(Model):
         self.make_agents()
         self.running = True
 
-        self.datacollector = DataCollector(model_reporter_parameters, agent_reporter_parameters)
+        model_reporters = model_reporter_parameters
+        if profile:
+            model_reporters = dict(model_reporter_parameters, **profile_reporters)
+        if collector == "array":
+            self.datacollector = ArrayDataCollector(model_reporters, agent_reporter_parameters,
+                                                    interval=collect_interval, mode=collect_mode)
+        elif collector == "mesa":
+            if collect_interval != 1 or collect_mode != "all":
+                raise Exception("mesa's DataCollector collects all agents at every step")
+            self.datacollector = DataCollector(model_reporters, agent_reporter_parameters)
+        else:
+            raise Exception("Unknown collector {}".format(collector))
 
         # print("Model initiated", self.negotiation_method)
         
+    # =========================================================================
+    #   The random stream of an agent, derived from the seed of the model and
+    #   its unique_id.
+    # =========================================================================
+    def agent_random(self, unique_id):
+        return spawn_random(self._seed, unique_id)
+
+    # =========================================================================
+    #   Checkpoints of the run, to restore it later, or to fork it into
+    #   branches with other parameters (see checkpoint.py).
+    # =========================================================================
+    def checkpoint(self, path=None):
+        return checkpoints.checkpoint(self, path)
+
+    @staticmethod
+    def restore(path_or_data):
+        return checkpoints.restore(path_or_data)
+
+    def fork(self, branches):
+        return checkpoints.fork(self, branches)
+
     # =========================================================================
     #  Create all flights, the flights are not all initialized at the same time,
     #  but within a departure window.
@@ -123,6 +267,7 @@ class FormationFlying(Model):
                 self.vision,
             )
             self.space.place_agent(flight, pos)
+            self.flight_index.add(flight)
             self.schedule.add(flight)
             self.total_planned_fuel += calc_distance(flight.pos, flight.destination)
         # print("Agents created")
@@ -162,26 +307,48 @@ class FormationFlying(Model):
     # Define what happens in the model in each step.
     # =========================================================================
     def step(self):
-        all_arrived = True
-        total_deal_value = 0
-        for agent in self.schedule.agents:
-            if type(agent) is Flight:
-                total_deal_value += agent.deal_value
-                if agent.state != "arrived":
-                    all_arrived = False
+        profiler = self.profiler
+        if profiler:
+            profiler.start_step()
+
+        all_arrived = self.schedule.all_arrived()
+        total_deal_value = self.schedule.total_deal_value()
         if all_arrived:
             self.running = False
-            print("All arrived")
+            self.events.emit("all_arrived")
+            self.close()
 
         # This is a verification that no deal value is created or lost (total deal value 
         # must be 0, and 0.001 is chosen here to avoid any issues with rounded numbers)
         if abs(total_deal_value) > 0.001:
             raise Exception("Deal value is {}".format(total_deal_value))
+        if profiler:
+            profiler.lap("check")
+
+        if self.fast_forward and self.running:
+            n_steps = steps_to_next_event(self)
+            if n_steps > 0:
+                cruise(self, n_steps)
+            if profiler:
+                profiler.lap("fast_forward")
+            if n_steps > 0:
+                if profiler:
+                    profiler.end_step()
+                return
 
         # print("\nStep", self.schedule.steps)
+        if self.matching is not None:
+            self.matching.do_matching()
         self.schedule.step()
         self.datacollector.collect(self)
+        if profiler:
+            profiler.lap("collect")
+            profiler.end_step()
 
-
-
-
+    # =========================================================================
+    #   Close what a run keeps open: the file of the event log. This happens
+    #   when all flights arrived; a run that ends otherwise (at max_steps, on
+    #   a time limit, ...) has to call it, or the buffered events are lost.
+    # =========================================================================
+    def close(self):
+        self.events.close()
@@ -0,0 +1,211 @@
+'''
+# =============================================================================
+# In this file the movement of the whole fleet in the advance of a step is
+# defined (movement_engine="fleet").
+#
+# Most flights just cruise: towards their destination, towards the leaving
+# point when they are in formation, or towards the joining point of the
+# formation they committed to. They are moved with array operations on the
+# fleet store. Only the flights for which something happens that involves other
+# flights (a formation that can close at its joining point in this step,
+# disbanding at the leaving point) are moved one by one with Flight.move,
+# together with their formation mates, in the same order as the schedule.
+#
+# The result is the same as calling Flight.do_move for every flight, up to the
+# last bit: the arrays use the same floating point operations as Flight.move,
+# distances that are too close to a threshold to tell are left to Flight.move,
+# and the fuel is added to the total of the model in the order of the flights.
+# =============================================================================
+'''
+
+import mesa
+import numpy as np
+
+from .fleet import FLYING, IN_FORMATION, COMMITTED, ADDING_TO_FORMATION
+
+
+# Distances within this relative margin of a threshold are checked by Flight.move
+# itself, because ** 0.5 and np.sqrt can differ in the last bit.
+THRESHOLD_MARGIN = 1e-9
+
+# The versions of mesa of which the private arrays of ContinuousSpace are known
+# (see space_arrays)
+MESA_VERSIONS = ((0, 8),)
+MESA_VERSION = tuple(int(part) for part in mesa.__version__.split(".")[:2])
+
+
+def distances(points, pos):
+    deltas = points - pos
+    return np.sqrt(deltas[:, 0] ** 2 + deltas[:, 1] ** 2)
+
+
+# Stacked dot products, the same as np.linalg.norm of a single vector (the distances above can differ in the
+# last bit)
+def lengths(vectors):
+    return np.sqrt(np.matmul(vectors[:, None, :], vectors[:, :, None])[:, 0, 0])
+
+
+def near_threshold(distance, threshold):
+    return np.abs(distance - threshold) <= THRESHOLD_MARGIN * threshold
+
+
+# =============================================================================
+#   rows: the rows of the fleet store to move, in ascending order (all flights
+#   if None). The flights that are left out must be ones that Flight.move would
+#   leave alone: arrived, or not departed yet.
+# =============================================================================
+def move_fleet(model, rows=None):
+    fleet = model.fleet
+    if rows is None:
+        rows = np.arange(fleet.size)
+    n = len(rows)
+    if n == 0:
+        return
+    steps = model.schedule.steps
+    pos = fleet.pos[rows]
+    speed = fleet.speed[rows]
+    state = fleet.state[rows]
+    formation_state = fleet.formation_state[rows]
+    half_speed = speed / 2
+
+    distance = distances(fleet.destination[rows], pos)
+    reached = distance <= half_speed
+    departed = ~reached & (steps >= fleet.departure_time[rows])
+
+    # =========================================================================
+    #   Flights that have to be moved one by one.
+    # =========================================================================
+    single = near_threshold(distance, half_speed) | near_threshold(distance, speed)
+    single |= ~reached & ~departed & (state == FLYING)
+    in_formation = np.flatnonzero(departed & (formation_state == IN_FORMATION))
+    to_leaving = distances(fleet.leaving_point[rows[in_formation]], pos[in_formation])
+    single[in_formation] |= to_leaving <= half_speed[in_formation] * (1 + THRESHOLD_MARGIN)
+
+    # A formation can only close when a flight that reached the joining point sees that all its mates reached
+    # it too (see Flight.move), before or after their move in this step. Those flights go one by one, the
+    # formations that can't close in this step fly on to the joining point with the others.
+    joining = np.flatnonzero(departed & ((formation_state == COMMITTED) | (formation_state == ADDING_TO_FORMATION)))
+    joining_rows = rows[joining]
+    to_joining = distances(fleet.joining_point[joining_rows], pos[joining])
+    speed_to_joining = fleet.speed_to_joining[joining_rows]
+    single[joining] |= np.isnan(to_joining) | np.isnan(speed_to_joining) | \
+        near_threshold(to_joining, speed_to_joining)
+    # Within reach: at most half speed_to_joining (or 0.002) away after a move of speed_to_joining (nan counts)
+    reach = (1.5 * speed_to_joining + 0.002) * (1 + THRESHOLD_MARGIN) + THRESHOLD_MARGIN
+    within_reach = ~(to_joining > reach)
+    # The other mates (arrived, or arriving in this step) could let the formation close as well
+    ready = np.ones(fleet.size, dtype=bool)
+    ready[joining_rows] = within_reach
+    ready = ready.tolist()
+    flights = fleet.flights
+    for i in joining[within_reach & ~single[joining]]:
+        if all(ready[mate.fleet_index] for mate in flights[rows[i]].agents_in_my_formation):
+            single[i] = True
+
+    # Their formation mates can be changed by them, so they are moved one by one as well
+    # (mates that aren't in rows have arrived, Flight.move leaves them alone)
+    pending = [flights[rows[i]] for i in np.flatnonzero(single)]
+    while pending:
+        for mate in pending.pop().agents_in_my_formation:
+            i = np.searchsorted(rows, mate.fleet_index)
+            if i < n and rows[i] == mate.fleet_index and not single[i]:
+                single[i] = True
+                pending.append(mate)
+
+    # =========================================================================
+    #   Arrivals.
+    # =========================================================================
+    for i in np.flatnonzero(reached & ~single & (state == FLYING)):
+        flights[rows[i]].arrive()
+
+    # =========================================================================
+    #   Cruising flights, the same operations as in Flight.move.
+    # =========================================================================
+    cruising = np.flatnonzero(departed & ~single)
+    moving = rows[cruising]
+    fleet.state[moving] = FLYING
+    cruising_state = formation_state[cruising]
+    in_formation = cruising_state == IN_FORMATION
+    committed = (cruising_state == COMMITTED) | (cruising_state == ADDING_TO_FORMATION)
+    targets = fleet.destination[moving]
+    targets[in_formation] = fleet.leaving_point[moving[in_formation]]
+    targets[committed] = fleet.joining_point[moving[committed]]
+    headings = targets - pos[cruising]
+    norms = lengths(headings)
+    # A flight that waits at its joining point stays put, and keeps its heading
+    waiting = committed & (norms == 0.0)
+    norms[waiting] = 1.0
+    headings /= norms[:, None]
+    cruising_speed = speed[cruising]
+    cruising_speed[committed] = fleet.speed_to_joining[moving[committed]]
+    new_pos = pos[cruising] + headings * cruising_speed[:, None]
+    # Flights stop at their destination or joining point instead of overshooting it
+    to_target = distance[cruising]
+    to_target[committed] = to_joining[np.searchsorted(joining, cruising[committed])]
+    stopping = ~in_formation & ~waiting & (to_target <= cruising_speed)
+    new_pos[stopping] = targets[stopping]
+
+    f_c = np.where(in_formation, model.fuel_reduction * cruising_speed, cruising_speed)
+    # A flight that joins a formation that is already flying, flies in it (see Flight.move)
+    adding = np.flatnonzero(cruising_state == ADDING_TO_FORMATION)
+    with_mates = np.array([len(flights[row].agents_in_my_formation) > 0 for row in moving[adding]], dtype=bool)
+    f_c[adding[with_mates]] = cruising_speed[adding[with_mates]] * model.fuel_reduction
+    if np.any(f_c < 0):
+        raise Exception("Fuel cost lower than 0")
+
+    space = model.space
+    if np.any((new_pos[:, 0] < space.x_min) | (new_pos[:, 0] >= space.x_max) |
+              (new_pos[:, 1] < space.y_min) | (new_pos[:, 1] >= space.y_max)):
+        raise Exception("Point out of bounds, and space non-toroidal.")
+
+    fleet.heading[moving[~waiting]] = headings[~waiting]
+    fleet.pos[moving] = new_pos
+    fleet.fuel_consumption[moving] += f_c
+    points, index = space_arrays(space)
+    points[space_rows(model, index)[moving]] = new_pos
+
+    # =========================================================================
+    #   The other flights, and the fuel of all flights in schedule order.
+    # =========================================================================
+    fuel = np.zeros(n)
+    moved = np.zeros(n, dtype=bool)
+    fuel[cruising] = f_c
+    moved[cruising] = True
+    for i in np.flatnonzero(single):
+        consumed = flights[rows[i]].move()
+        if consumed is not None:
+            fuel[i] = consumed
+            moved[i] = True
+
+    model.total_flight_time += len(cruising)
+    if np.any(moved):
+        model.total_fuel_consumption = float(np.add.accumulate(
+            np.concatenate(([model.total_fuel_consumption], fuel[moved])))[-1])
+
+
+# =============================================================================
+#   mesa's ContinuousSpace keeps the positions of its agents in a private array,
+#   with the row of every agent in a dict. The fleet movement writes the new
+#   positions there at once, instead of a move_agent per flight. Returns
+#   (points, agent to row). Only the versions of mesa in MESA_VERSIONS are
+#   known to work this way; with others, use movement_engine="agent".
+# =============================================================================
+def space_arrays(space):
+    if MESA_VERSION not in MESA_VERSIONS:
+        raise Exception("movement_engine=\"fleet\" doesn't support mesa {} (supported: {}), use "
+                        "movement_engine=\"agent\"".format(mesa.__version__,
+                                                          ", ".join("{}.{}".format(*v) for v in MESA_VERSIONS)))
+    return space._agent_points, space._agent_to_index
+
+
+# =============================================================================
+#   The rows of the flights in the points of the ContinuousSpace, which are kept
+#   up to date with the fleet store.
+# =============================================================================
+def space_rows(model, index):
+    fleet = model.fleet
+    rows = model.space_rows
+    if rows is None or len(rows) != fleet.size:
+        rows = np.array([index[flight] for flight in fleet.flights], dtype=int)
+        model.space_rows = rows
+    return rows
@@ -4,8 +4,10 @@
 
 # def do_CNP(flight):
 #     # the do_CNP function takes a flight-agent object
-from ..miscellaneous import calc_distance, utility_function
-from random import choices
+from ..miscellaneous import calc_distance, utility_function, stepped_bid
+from .mailbox import Mailbox
+from .records import Invitation, PendingBid
+import numpy as np
 
 
 class CNP:
@@ -20,7 +22,7 @@ class CNP:
 
         # Received communications from other agents
         self.received_neighbor_counts = []
-        self.managers_calling = []
+        self.managers_calling = Mailbox()  # manager: Invitation
 
         # Properties
         self.negotiation_window = 10 # The time available for negotiation. Call for contract expires after this duration.
@@ -55,72 +57,62 @@ class CNP:
 
         # Select a contractor
         # Find the highest bid
-        current_bids = []
-        for bid in self.flight.received_bids:
-            if bid["validity"] is True:
-                current_bids.append(bid)
-                # Change the validity to false, so every bid is considered only once.
-                bid["validity"] = False
+        # The new bids (every bid is considered only once)
+        current_bids, bid_values = self.flight.received_bids.take_valid()
         if len(current_bids) > 0:
-            # assert self.bidding_end_time is not None and self.bidding_end_time >= self.flight.model.schedule.steps, f"{self.bidding_end_time} < {self.flight.model.schedule.steps}, {[bid['bidding_agent'].unique_id for bid in current_bids]}"
-            highest_bid = None
-            highest_utility = None
+            # assert self.bidding_end_time is not None and self.bidding_end_time >= self.flight.model.schedule.steps, f"{self.bidding_end_time} < {self.flight.model.schedule.steps}, {[bid.bidding_agent.unique_id for bid in current_bids]}"
             # print(f"{self.flight.agent_type}, {self.flight.unique_id} received {len(current_bids)} new bids.")
-            for bid in current_bids:
-                # print(f"Contractor {bid['bidding_agent'].agent_type, bid['bidding_agent'].unique_id}'s bid: {bid['value']}")
-                bid_saving = self.flight.calculate_potential_fuelsavings(bid["bidding_agent"], individual=True)
-                bid_share = bid["value"] / (len(self.flight.agents_in_my_formation) + 1)
-                bid_delay = self.flight.calculate_potential_delay(bid["bidding_agent"])
-                bid_utility = utility_function(bid_saving + bid_share, bid_saving, bid_delay, behavior=self.flight.behavior)
-                # print(f"Manager {self.flight.unique_id} is considering bid of {bid['value']} from {bid['bidding_agent'].unique_id} for utility {bid_utility}")
-                if highest_bid is None:
-                    highest_bid = bid.copy()
-                    highest_utility = bid_utility
-                else:
-                    if bid_utility > highest_utility:
-                        highest_bid = bid.copy()
-                        highest_utility = bid_utility
+            # Score all bids at once, and select the first one with the highest utility
+            bid_savings = np.array([self.flight.calculate_potential_fuelsavings(bid.bidding_agent, individual=True)
+                                    for bid in current_bids])
+            bid_shares = bid_values / (len(self.flight.agents_in_my_formation) + 1)
+            bid_delays = np.array([self.flight.calculate_potential_delay(bid.bidding_agent) for bid in current_bids])
+            bid_utilities = utility_function(bid_savings + bid_shares, bid_savings, bid_delays,
+                                             behavior=self.flight.behavior)
+            # for bid, bid_utility in zip(current_bids, bid_utilities):
+            #     print(f"Manager {self.flight.unique_id} is considering bid of {bid.value} from {bid.bidding_agent.unique_id} for utility {bid_utility}")
+            highest_bid = current_bids[int(np.argmax(bid_utilities))]
 
             # Communicate refusal to the rest of the contractor agents
             for bid in current_bids:
-                if bid["bidding_agent"] is not highest_bid["bidding_agent"]:
+                if bid.bidding_agent is not highest_bid.bidding_agent:
                     try:
-                        bid["bidding_agent"].cnp.pending_bids[self.flight]["accepted"] = False
+                        bid.bidding_agent.cnp.pending_bids[self.flight].accepted = False
                     except KeyError as err:
                         print()
-                        print(bid["bidding_agent"].agent_type, bid["bidding_agent"].unique_id, bid["value"])
-                        print(bid["bidding_agent"].cnp.pending_bids)
-                        print(self.flight, bid["bidding_agent"].cnp.pending_bids.keys())
-                        print(self.flight in bid["bidding_agent"].cnp.pending_bids.keys())
-                        print(bid["bidding_agent"].cnp.pending_bids[self.flight])
+                        print(bid.bidding_agent.agent_type, bid.bidding_agent.unique_id, bid.value)
+                        print(bid.bidding_agent.cnp.pending_bids)
+                        print(self.flight, bid.bidding_agent.cnp.pending_bids.keys())
+                        print(self.flight in bid.bidding_agent.cnp.pending_bids.keys())
+                        print(bid.bidding_agent.cnp.pending_bids[self.flight])
                         raise err
 
             # Check if the highest bid meets the acceptance strategy requirements.
             # If a formation is formed, reset received_bids and pending_bids
-            if self.acceptance_strategy(highest_bid["bidding_agent"], highest_bid["value"]) is True:
+            if self.acceptance_strategy(highest_bid.bidding_agent, highest_bid.value) is True:
                 # self.flight.formation_state not in ("committed", "adding_to_formation")
                 if len(self.flight.agents_in_my_formation) > 0:
-                    self.flight.add_to_formation(list(highest_bid.values())[0],
-                                                 list(highest_bid.values())[1], discard_received_bids=True)
+                    self.flight.add_to_formation(highest_bid.bidding_agent,
+                                                 highest_bid.value, discard_received_bids=True)
                 else:
-                    self.flight.start_formation(list(highest_bid.values())[0],
-                                                list(highest_bid.values())[1], discard_received_bids=True)
+                    self.flight.start_formation(highest_bid.bidding_agent,
+                                                highest_bid.value, discard_received_bids=True)
                 # Communicate acceptance to the contractor agent
-                highest_bid["bidding_agent"].cnp.pending_bids[self.flight]["accepted"] = True
+                highest_bid.bidding_agent.cnp.pending_bids[self.flight].accepted = True
                 self.bidding_end_time = None
                 self.flight.accepting_bids = 0
-                # print(f"{self.flight.agent_type}, {self.flight.unique_id} selected {highest_bid['bidding_agent'].unique_id}'s bid: {highest_bid['value']}")
+                # print(f"{self.flight.agent_type}, {self.flight.unique_id} selected {highest_bid.bidding_agent.unique_id}'s bid: {highest_bid.value}")
             else:
                 # Communicate refusal to the contractor agent
                 try:
-                    highest_bid["bidding_agent"].cnp.pending_bids[self.flight]["accepted"] = False
+                    highest_bid.bidding_agent.cnp.pending_bids[self.flight].accepted = False
                 except KeyError as err:
                     print()
-                    print(highest_bid["bidding_agent"].agent_type, highest_bid["bidding_agent"].unique_id, highest_bid["value"])
-                    print(highest_bid["bidding_agent"].cnp.pending_bids)
-                    print(self.flight.unique_id, [k.unique_id for k in highest_bid["bidding_agent"].cnp.pending_bids.keys()])
-                    print(self.flight in highest_bid["bidding_agent"].cnp.pending_bids.keys())
-                    print(highest_bid["bidding_agent"].cnp.pending_bids[self.flight])
+                    print(highest_bid.bidding_agent.agent_type, highest_bid.bidding_agent.unique_id, highest_bid.value)
+                    print(highest_bid.bidding_agent.cnp.pending_bids)
+                    print(self.flight.unique_id, [k.unique_id for k in highest_bid.bidding_agent.cnp.pending_bids.keys()])
+                    print(self.flight in highest_bid.bidding_agent.cnp.pending_bids.keys())
+                    print(highest_bid.bidding_agent.cnp.pending_bids[self.flight])
                     raise err
 
         # Change manager to contractor if it couldn't form a formation by the end of the negotiation window
@@ -128,7 +120,7 @@ class CNP:
             self.bidding_end_time = None
             self.flight.accepting_bids = 0
             self.flight.manager = 0
-            self.flight.received_bids = []
+            self.flight.received_bids.clear()
             self.flight.update_role()
             # print(f"Flight {self.flight.unique_id} got demoted to contractor.")
         # print(f"Manager {self.flight.unique_id} with end_time {self.bidding_end_time} is {self.flight.formation_state}, and is accepting bids: {self.flight.accepting_bids}")
@@ -142,10 +134,10 @@ class CNP:
         refused_bids = []
         accepted_bids = []
         for manager in self.pending_bids:
-            if self.pending_bids[manager]["accepted"] is True:
+            if self.pending_bids[manager].accepted is True:
                 accepted_bids.append(manager)
                 # print(f"Contractor {self.flight.unique_id}'s bid to Manager {manager.unique_id} was accepted")
-            elif self.pending_bids[manager]["accepted"] is False:
+            elif self.pending_bids[manager].accepted is False:
                 refused_bids.append(manager)
                 # print(f"Contractor {self.flight.unique_id}'s bid to Manager {manager.unique_id} was refused")
         assert len(accepted_bids) <= 1, f"Multiple bids of Flight {self.flight.unique_id} have " \
@@ -159,7 +151,7 @@ class CNP:
         assert len(self.pending_bids) == 0, (list(self.pending_bids.keys())[0].unique_id, self.pending_bids)
 
         # Promote some contractors randomly to managers, in order to allow for formations that otherwise wouldn't form.
-        if choices([True, False], weights=[1, 3*self.negotiation_window], k=1)[0]:
+        if self.flight.rng.choices([True, False], weights=[1, 3*self.negotiation_window], k=1)[0]:
             self.flight.manager = 1
             # print(self.flight.agent_type, self.flight.unique_id, "becomes manager by chance.")
             # Reset the relevant lists, and update the role
@@ -174,8 +166,11 @@ class CNP:
                 utility_score = 0
                 selected_manager = None
                 selected_bid = 0
-                for i, [manager, end_time] in enumerate(self.managers_calling):
-                    if manager.accepting_bids == 1 and end_time > self.flight.model.schedule.steps:
+                # Remove the expired calls
+                self.managers_calling.expire(self.flight.model.schedule.steps + 1)
+                for manager, invitation in list(self.managers_calling.items()):
+                    end_time = invitation.time
+                    if manager.accepting_bids == 1:
                         fuel_saving = self.flight.calculate_potential_fuelsavings(manager, individual=True)
                         delay = self.flight.calculate_potential_delay(manager)
                         bidding_value = self.bidding_strategy(fuel_saving, delay, end_time)
@@ -184,20 +179,18 @@ class CNP:
                             utility_score = utility_function(profit, fuel_saving, delay, behavior=self.flight.behavior)
                             selected_manager = manager
                             selected_bid = bidding_value
-                    # Remove the expired calls
+                    # Remove the calls of managers that stopped accepting bids
                     else:
                         # print(f"Popping call from {manager.unique_id}: {manager.cnp.bidding_end_time}, {manager.accepting_bids}")
-                        self.managers_calling.pop(i)
-                # print(f"Contractor {self.flight.unique_id} has {len(self.managers_calling)} open calls: {[(m.unique_id, t) for m, t in self.managers_calling]}.")
+                        self.managers_calling.pop(manager)
+                # print(f"Contractor {self.flight.unique_id} has {len(self.managers_calling)} open calls: {list(self.managers_calling.values())}.")
 
                 if selected_manager is not None:
                     # TODO: Implement bid expiration date. Currently None.
                     self.flight.make_bid(selected_manager, selected_bid, True, None)
                     # print(self.flight.agent_type, self.flight.unique_id, "makes bid to", selected_manager.unique_id, "with value of", selected_bid, "and potential utility of", utility_score, "deadline", selected_manager.cnp.bidding_end_time, "compared to", self.flight.model.schedule.steps)
                     # Save the bid that was made, so it can be used in the bidding strategy
-                    self.pending_bids[selected_manager] = {"bid": selected_bid,
-                                                           "time": self.flight.model.schedule.steps,
-                                                           "accepted": None}
+                    self.pending_bids[selected_manager] = PendingBid(selected_bid, self.flight.model.schedule.steps)
 
             # If there are no currently pending bids, check if contractor agent can become a manager
             elif self.flight.formation_state is "no_formation" and len(self.pending_bids) == 0:
@@ -211,14 +204,9 @@ class CNP:
         # Find the maximum possible utility (at 0 bid)
         max_utility = utility_function(fuel_saving, fuel_saving, delay, behavior=self.flight.behavior)
         min_utility = max_utility*min_utility_frac
-        # Find the highest possible bid for minimum acceptable utility score
-        highest_bid = 0
-        while utility_function(fuel_saving - highest_bid, fuel_saving, delay, behavior=self.flight.behavior) > min_utility:
-            highest_bid += 10
-        highest_bid -= 10
-        while utility_function(fuel_saving - highest_bid, fuel_saving, delay, behavior=self.flight.behavior) > min_utility:
-            highest_bid += 1
-        highest_bid -= 1
+        # Find the highest possible bid for minimum acceptable utility score: the last whole bid before
+        # the utility drops to the minimum (not lower than -11, where the +10/+1 search used to start)
+        highest_bid = stepped_bid(min_utility, fuel_saving, delay, behavior=self.flight.behavior, start=-10) - 1
         # TODO: check if the -= part is actually correct
         # print(f"Highest bid {highest_bid}, resulting to utility {utility_function(fuel_saving - highest_bid, fuel_saving, delay, behavior=self.flight.behavior)}, compared to min utility {min_utility}")
         # print(f"Flight {self.flight.unique_id} utility score: {utility_function(fuel_saving - highest_bid, fuel_saving, delay, behavior=self.flight.behavior)}, with highest bid {highest_bid}")
@@ -242,9 +230,7 @@ class CNP:
 
     def apply_for_manager(self):
         # Look for neighboring contractor flights that don't have a formation yet.
-        for neighbor in self.flight.model.space.get_neighbors(pos=self.flight.pos,
-                                                              radius=self.flight.communication_range,
-                                                              include_center=True):
+        for neighbor in self.flight.get_neighbors():
             if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation":
                 self.free_flights_in_reach.append(neighbor)
         # Contact the neighboring free agents
@@ -276,17 +262,11 @@ class CNP:
         if self.bidding_end_time is None:
             self.bidding_end_time = self.flight.model.schedule.steps + self.negotiation_window
             self.flight.accepting_bids = 1
-        for neighbor in self.flight.model.space.get_neighbors(pos=self.flight.pos,
-                                                              radius=self.flight.communication_range,
-                                                              include_center=True):
+        for neighbor in self.flight.get_neighbors():
             if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation":
                 # Also invite newly available contractors to the ongoing negotiation
-                new_contractor = True
-                for call in neighbor.cnp.managers_calling:
-                    if call[0] == self.flight:
-                        new_contractor = False
-                if new_contractor:
-                    neighbor.cnp.managers_calling.append([self.flight, self.bidding_end_time])
+                neighbor.cnp.managers_calling.post(self.flight, Invitation(self.flight, self.bidding_end_time),
+                                                   expiry=self.bidding_end_time)
         return
 
 
@@ -3,9 +3,35 @@
 # This file contains the function to do a Greedy Algorithm. In the greedy method
 # agents form a formation with the first agent in the nighborhood that makes 
 # their potential fuel savings positive!
+#
+# FleetGreedy (greedy_engine="fleet") gives the same formations as do_greedy,
+# but does the work for the whole fleet at once: at the first flight that
+# looks for a formation in a step, it finds the candidate managers of all
+# flights that look for one with one neighbour query, and the fuel savings of
+# all these pairs in one array operation (pair_fuel_savings /
+# joining_fuel_savings). The flights then still make their formations in their
+# own turn, in the order of the scheduler: a flight takes the first candidate
+# (in the order of the neighbours) that is still accepting bids and gives
+# positive savings, so when two flights go for the same manager, the first one
+# gets it and the other one moves on to its next candidate.
+#
+# The savings of the array operation are only used to skip the candidates
+# that clearly don't save fuel. Whether a candidate saves fuel, and how much,
+# is still decided by calculate_potential_fuelsavings, so the results are the
+# same, up to the last bit, as with do_greedy.
 # =============================================================================
 '''
 
+import numpy as np
+
+from ..miscellaneous import pair_fuel_savings, joining_fuel_savings
+from ..spatial_index import cKDTree
+
+# Candidates of which the batched savings are below -SKIP_MARGIN are skipped, the
+# others are checked with calculate_potential_fuelsavings. Far above the
+# rounding differences between the two.
+SKIP_MARGIN = 1e-6
+
 # The do_greedy function takes a flight-agent object
 def do_greedy(flight):
     if not flight.departure_time:
@@ -31,3 +57,143 @@ def do_greedy(flight):
                             formation_savings = flight.calculate_potential_fuelsavings(agent)
                             flight.start_formation(agent, formation_savings, discard_received_bids=True)
                             break
+
+
+class FleetGreedy:
+    def __init__(self, model):
+        self.model = model
+        self.planned_step = None
+
+        # The plan of the step: the candidates of flight i (position in the
+        # flight index) are candidates[indptr[i]:indptr[i + 1]], in the order of
+        # the neighbours, with their batched savings and the formation_version
+        # of both flights when the savings were computed.
+        self.planned = None
+        self.indptr = None
+        self.candidates = None
+        self.savings = None
+        self.candidate_versions = None
+        self.versions = None
+
+    def invalidate(self):
+        self.planned_step = None
+        self.planned = self.indptr = self.candidates = self.savings = None
+        self.candidate_versions = self.versions = None
+
+    def do_greedy(self, flight):
+        if not flight.departure_time:
+            raise Exception("The object passed to the greedy protocol has no departure time, therefore it seems that it is not a flight.")
+        if flight.formation_state != "no_formation" or flight.manager != 0:
+            return
+
+        if self.planned_step != self.model.schedule.steps:
+            self.plan()
+        i = flight.index_position
+        if not self.planned[i]:
+            # Started looking after the plan was made
+            return do_greedy(flight)
+
+        flights = self.model.flight_index.flights
+        unchanged = flight.formation_version == self.versions[i]
+        for k in range(self.indptr[i], self.indptr[i + 1]):
+            agent = flights[self.candidates[k]]
+            if agent.manager != 1 or agent.accepting_bids != 1 or \
+                    agent.formation_state not in ("no_formation", "in_formation"):
+                # Taken by a flight before this one
+                continue
+            if unchanged and agent.formation_version == self.candidate_versions[k] and \
+                    self.savings[k] < -SKIP_MARGIN:
+                continue
+            formation_savings = flight.calculate_potential_fuelsavings(agent)
+            if formation_savings <= 0:
+                continue
+            assert flight.unique_id != agent.unique_id
+            if len(agent.agents_in_my_formation) > 0:
+                agent.add_to_formation(flight, formation_savings, discard_received_bids=True)
+            else:
+                flight.start_formation(agent, formation_savings, discard_received_bids=True)
+            break
+
+    # =========================================================================
+    #   The candidates of all flights that look for a formation, and the
+    #   savings of every pair.
+    # =========================================================================
+    def plan(self):
+        model = self.model
+        flights = model.flight_index.flights
+        n = len(flights)
+        seeking = np.zeros(n, dtype=bool)
+        managing = np.zeros(n, dtype=bool)
+        for i, flight in enumerate(flights):
+            if flight.manager == 0:
+                seeking[i] = flight.state == "flying" and flight.formation_state == "no_formation"
+            elif flight.manager == 1 and flight.accepting_bids == 1:
+                managing[i] = flight.formation_state in ("no_formation", "in_formation")
+
+        fleet = model.fleet
+        if fleet is not None and fleet.size == n:
+            positions = fleet.column("pos")
+            destinations = fleet.column("destination")
+        else:
+            positions = np.array([flight.pos for flight in flights], dtype=float).reshape(-1, 2)
+            destinations = np.array([flight.destination for flight in flights], dtype=float).reshape(-1, 2)
+
+        seekers, managers = self.pairs(positions, seeking, managing)
+        savings = np.empty(len(seekers))
+        if model.profiler:
+            model.profiler.count("get_neighbors")
+            model.profiler.count("joining_points", len(seekers))
+
+        # Managers without a formation: the pair, seen from the flight that looks for a formation
+        n_in_formation = np.array([len(flights[j].agents_in_my_formation) + 1 for j in managers], dtype=int)
+        pairs = n_in_formation == 1
+        if np.any(pairs):
+            savings[pairs] = pair_fuel_savings(positions[seekers[pairs]], destinations[seekers[pairs]],
+                                               positions[managers[pairs]], destinations[managers[pairs]],
+                                               model.fuel_reduction)
+        # Managers of a formation: joining it, seen from the manager
+        joining = ~pairs
+        if np.any(joining):
+            leaving_points = np.array([flights[j].leaving_point for j in managers[joining]], dtype=float)
+            savings[joining] = joining_fuel_savings(positions[managers[joining]], destinations[managers[joining]],
+                                                    leaving_points, n_in_formation[joining],
+                                                    positions[seekers[joining]], destinations[seekers[joining]],
+                                                    model.fuel_reduction)
+
+        self.planned = seeking
+        self.indptr = np.zeros(n + 1, dtype=int)
+        np.cumsum(np.bincount(seekers, minlength=n), out=self.indptr[1:])
+        self.candidates = managers
+        self.savings = savings
+        versions = np.array([flight.formation_version for flight in flights], dtype=np.int64)
+        self.versions = versions
+        self.candidate_versions = versions[managers]
+        self.planned_step = model.schedule.steps
+
+    # =========================================================================
+    #   The (flight, manager) pairs within communication range, sorted by
+    #   flight and then by manager (the order of the neighbours). Uses the same
+    #   distance test as the spatial index.
+    # =========================================================================
+    def pairs(self, positions, seeking, managing):
+        radius = self.model.flight_index.radius
+        if cKDTree is not None:
+            seekers = np.flatnonzero(seeking)
+            managers = np.flatnonzero(managing)
+            if len(seekers) == 0 or len(managers) == 0:
+                return np.empty(0, dtype=int), np.empty(0, dtype=int)
+            # Slightly larger radius, the exact test is done afterwards
+            found = cKDTree(positions[seekers]).sparse_distance_matrix(
+                cKDTree(positions[managers]), radius * (1 + 1e-9), output_type="ndarray")
+            first, second = seekers[found["i"]], managers[found["j"]]
+        else:
+            indptr, indices = self.model.flight_index.neighbor_arrays()
+            rows = np.repeat(np.arange(len(seeking)), np.diff(indptr))
+            keep = seeking[rows] & managing[indices]
+            first, second = rows[keep], indices[keep]
+
+        deltas = positions[first] - positions[second]
+        keep = deltas[:, 0] ** 2 + deltas[:, 1] ** 2 <= radius ** 2
+        first, second = first[keep], second[keep]
+        order = np.lexsort((second, first))
+        return first[order], second[order]
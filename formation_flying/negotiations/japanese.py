@@ -3,9 +3,10 @@
 # This file contains the function to do a Japanese auction. 
 # =============================================================================
 '''
-from ..miscellaneous import calc_distance, utility_function, calc_middle_point
-from random import choices
+from ..miscellaneous import calc_distance, utility_function, calc_middle_point, stepped_bid
 import numpy as np
+from .mailbox import Mailbox
+from .records import Bid, Invitation
 
 
 class Japanese:
@@ -17,7 +18,7 @@ class Japanese:
         self.free_flights_in_reach = []
         self.received_neighbor_counts = []
 
-        self.open_auctions = []
+        self.open_auctions = Mailbox()  # manager: Invitation
         self.favored_auction = {"manager": None, "utility": 0, "start_time": None}
         self.current_auction = None
         self.min_bid_utility_frac = 0.5
@@ -25,7 +26,7 @@ class Japanese:
         self.contractors_in_auction = []
         self.contractors_dropped_out = []
         self.display_price = None
-        self.leading_exiting_bidder = {"bidder": None, "bid": 0}
+        self.leading_exiting_bidder = Bid(None, 0)
         self.min_reserve_utility_frac = 0.7
 
         # Properties
@@ -36,7 +37,7 @@ class Japanese:
 
         # TODO: better manager selection
         # Select manager at random
-        if choices([False, True], weights=[5, 1])[0]:
+        if self.flight.rng.choices([False, True], weights=[5, 1])[0]:
             self.promote()
         else:
             self.demote()
@@ -65,12 +66,14 @@ class Japanese:
                     self.create_auction()
                 # If no flights are interested joining a formation with the manager, demote the manager
                 else:
-                    print(f"Flight {self.flight.unique_id} failed to to find auctioneers by the deadline {self.auction_start_time}")
+                    self.flight.model.events.emit("auction_failed", manager=self.flight, start_time=self.auction_start_time)
                     self.demote()
 
             # Wait until the auction start time, and make sure manager did not get demoted in the meanwhile
             if self.flight.manager == 1 and self.auction_start_time <= self.flight.model.schedule.steps:
-                print(f"Flights in {self.flight.unique_id}'s auction:", [c.unique_id for c in self.contractors_in_auction])
+                if self.flight.model.events:
+                    self.flight.model.events.emit("auction_round", manager=self.flight, price=self.display_price,
+                                                  bidders=[c.unique_id for c in self.contractors_in_auction])
                 # If multiple contractors are still in the auction, increase the displayed price
                 if len(self.contractors_in_auction) > 1:
                     self.increase_price()
@@ -83,26 +86,27 @@ class Japanese:
                     else:
                         self.flight.start_formation(self.contractors_in_auction[0], self.display_price,
                                                     discard_received_bids=True)
-                    print(
-                        f"Last man standing: {self.contractors_in_auction[0].unique_id} won the auction, with price {self.display_price}")
+                    self.flight.model.events.emit("auction_won", manager=self.flight,
+                                                  contractor=self.contractors_in_auction[0], price=self.display_price)
                     self.flight.accepting_bids = 0
                     self.contractors_in_auction[0].japanese.reset_attributes()
                     self.reset_attributes()
                 # If multiple contractors exited the auction at the same display price,
                 # select the one that submitted the highest exiting price
-                elif len(self.contractors_in_auction) == 0 and self.leading_exiting_bidder["bid"] is not None:
+                elif len(self.contractors_in_auction) == 0 and self.leading_exiting_bidder.value is not None:
                     if len(self.flight.agents_in_my_formation) > 0:
-                        self.flight.add_to_formation(self.leading_exiting_bidder["bidder"],
-                                                     self.leading_exiting_bidder["bid"],
+                        self.flight.add_to_formation(self.leading_exiting_bidder.bidding_agent,
+                                                     self.leading_exiting_bidder.value,
                                                      discard_received_bids=True)
                     else:
-                        self.flight.start_formation(self.leading_exiting_bidder["bidder"],
-                                                    self.leading_exiting_bidder["bid"],
+                        self.flight.start_formation(self.leading_exiting_bidder.bidding_agent,
+                                                    self.leading_exiting_bidder.value,
                                                     discard_received_bids=True)
-                    print(f"Highest exit: {self.leading_exiting_bidder['bidder'].unique_id} won the auction, "
-                          f"with price {self.leading_exiting_bidder['bid']}")
+                    self.flight.model.events.emit("auction_won", manager=self.flight,
+                                                  contractor=self.leading_exiting_bidder.bidding_agent,
+                                                  price=self.leading_exiting_bidder.value, exit_bid=True)
                     self.flight.accepting_bids = 0
-                    self.leading_exiting_bidder["bidder"].japanese.reset_attributes()
+                    self.leading_exiting_bidder.bidding_agent.japanese.reset_attributes()
                     self.reset_attributes()
         return
 
@@ -111,25 +115,24 @@ class Japanese:
         if self.flight.formation_state is "no_formation" and self.current_auction is None:
             if len(self.open_auctions) >= 1:
                 # print(f"Flight {self.flight.unique_id} considering {len(self.open_auctions)} auctions")
-                for i, [manager, start_time] in enumerate(self.open_auctions):
-                    if start_time > self.flight.model.schedule.steps:
-                        fuel_saving = self.flight.calculate_potential_fuelsavings(manager, individual=True)
-                        delay = self.flight.calculate_potential_delay(manager)
-                        bidding_value = manager.japanese.display_price
-                        profit = fuel_saving - bidding_value
-                        utility = utility_function(profit, fuel_saving, delay, behavior=self.flight.behavior)
-                        print(f"{manager.unique_id}'s auction: {utility, self.favored_auction['utility']}")
-                        if utility > self.favored_auction["utility"]:
-                            self.favored_auction["utility"] = utility
-                            self.favored_auction["manager"] = manager
-                            self.favored_auction["start_time"] = start_time
-                        elif self.favored_auction["manager"] is not None and self.favored_auction["manager"] == manager:
-                            # Update the utility of the currently favored manager
-                            self.favored_auction["utility"] = utility
-                    # Remove the expired calls
-                    elif start_time <= self.flight.model.schedule.steps:
-                        removed = self.open_auctions.pop(i)
-                        # print(f"Removed: {removed[0].unique_id}'s auction due {removed[1]} exceeded current time {self.flight.model.schedule.steps}")
+                # Remove the expired calls
+                self.open_auctions.expire(self.flight.model.schedule.steps + 1)
+                for manager, invitation in self.open_auctions.items():
+                    start_time = invitation.time
+                    fuel_saving = self.flight.calculate_potential_fuelsavings(manager, individual=True)
+                    delay = self.flight.calculate_potential_delay(manager)
+                    bidding_value = manager.japanese.display_price
+                    profit = fuel_saving - bidding_value
+                    utility = utility_function(profit, fuel_saving, delay, behavior=self.flight.behavior)
+                    self.flight.model.events.emit("auction_considered", manager=manager, contractor=self.flight,
+                                                  price=bidding_value, utility=utility)
+                    if utility > self.favored_auction["utility"]:
+                        self.favored_auction["utility"] = utility
+                        self.favored_auction["manager"] = manager
+                        self.favored_auction["start_time"] = start_time
+                    elif self.favored_auction["manager"] is not None and self.favored_auction["manager"] == manager:
+                        # Update the utility of the currently favored manager
+                        self.favored_auction["utility"] = utility
                 # print(f"Contractor {self.flight.unique_id} has {len(self.open_auctions)} open calls.")
 
             if self.favored_auction["manager"] is not None:
@@ -141,7 +144,7 @@ class Japanese:
             else:
                 # No favorable manager, try for promotion
                 # TODO: better manager selection
-                if choices([False, True], weights=[5, 1])[0]:
+                if self.flight.rng.choices([False, True], weights=[5, 1])[0]:
                     self.promote()
 
         # Decide whether to exit or remain in the current auction
@@ -172,15 +175,7 @@ class Japanese:
             # Exit the auction if display bid results in a utility lower than the minimum utility
             if utility_function(profit, fuel_saving, delay, behavior=self.flight.behavior) < min_utility:
                 # Find the bid corresponding to the minimum utility
-                exit_bid = 0
-                while utility_function(fuel_saving - exit_bid, fuel_saving, delay,
-                                       behavior=self.flight.behavior) > min_utility:
-                    exit_bid += 10
-                exit_bid -= 10
-                while utility_function(fuel_saving - exit_bid, fuel_saving, delay,
-                                       behavior=self.flight.behavior) > min_utility:
-                    exit_bid += 1
-                exit_bid -= 1
+                exit_bid = stepped_bid(min_utility, fuel_saving, delay, behavior=self.flight.behavior, start=-10) - 1
                 # TODO: fixed(?) calculation, if works, check if CNP needs it too
                 # Exit the auction with the exit bid
                 self.current_auction.japanese.exit_auction(self.flight, exit_bid)
@@ -197,71 +192,65 @@ class Japanese:
             self.reserve_price = self.set_reserve_price(dynamic_price=True)
             self.display_price = self.reserve_price
             self.flight.accepting_bids = 1
-            print(f"Flight {self.flight.unique_id} scheduled auction to {self.auction_start_time} with display price {self.display_price}")
-        for neighbor in self.flight.model.space.get_neighbors(pos=self.flight.pos,
-                                                              radius=self.flight.communication_range,
-                                                              include_center=True):
+            self.flight.model.events.emit("auction_scheduled", manager=self.flight, price=self.display_price,
+                                          start_time=self.auction_start_time)
+        for neighbor in self.flight.get_neighbors():
             if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation":
                 # Also invite newly available contractors to the ongoing negotiation
-                new_contractor = True
-                for call in neighbor.japanese.open_auctions:
-                    if call[0] == self.flight:
-                        new_contractor = False
-                if new_contractor:
-                    neighbor.japanese.open_auctions.append([self.flight, self.auction_start_time])
-                    # print(f"Flight {self.flight.unique_id} invited {neighbor.unique_id} for the auction at {self.auction_start_time} with display price {self.display_price}")
+                neighbor.japanese.open_auctions.post(self.flight, Invitation(self.flight, self.auction_start_time),
+                                                     expiry=self.auction_start_time)
+                # print(f"Flight {self.flight.unique_id} invited {neighbor.unique_id} for the auction at {self.auction_start_time} with display price {self.display_price}")
         return
 
     def create_auction(self):
         self.flight.accepting_bids = 1
-        self.leading_exiting_bidder = {"bidder": None, "bid": 0}
+        self.leading_exiting_bidder = Bid(None, 0)
         self.contractors_dropped_out = []
         return
 
     def increase_price(self):
         # Increase the show price by 10% of the reserve price
         self.display_price += self.reserve_price*0.3
-        # print(f"Flight {self.flight.unique_id} increases display price to {self.display_price}")
+        self.flight.model.events.emit("price_increased", manager=self.flight, price=self.display_price)
         return
 
     def exit_auction(self, bidder, exit_bid):
-        print(f"Flight {bidder.unique_id} is exiting {self.flight.unique_id}'s auction, with an exit bid of {exit_bid}")
+        self.flight.model.events.emit("auction_exit", manager=self.flight, contractor=bidder, price=exit_bid)
         self.contractors_in_auction.remove(bidder)
         self.contractors_dropped_out.append(bidder)
-        if exit_bid > self.leading_exiting_bidder["bid"]:
-            self.leading_exiting_bidder["bidder"] = bidder
-            self.leading_exiting_bidder["bid"] = exit_bid
+        if exit_bid > self.leading_exiting_bidder.value:
+            self.leading_exiting_bidder.bidding_agent = bidder
+            self.leading_exiting_bidder.value = exit_bid
 
     def enter_auction(self, bidder):
-        print(f"{bidder.unique_id} entering auction: {self.flight.model.schedule.steps, self.auction_start_time, bidder not in self.contractors_dropped_out}")
         if self.flight.model.schedule.steps < self.auction_start_time:
             if bidder not in self.contractors_dropped_out:
                 self.contractors_in_auction.append(bidder)
-                print(f"{bidder.agent_type}, {bidder.unique_id}, enters auction of {self.flight.unique_id}")
+                self.flight.model.events.emit("auction_entered", manager=self.flight, contractor=bidder)
 
     def demote(self):
         self.flight.manager = 0
         self.flight.update_role()
         self.reset_attributes()
-        print(f"Flight {self.flight.unique_id} is demoted to contractor")
+        self.flight.model.events.emit("demoted", manager=self.flight)
 
     def promote(self):
         self.flight.manager = 1
         self.flight.update_role()
         self.reset_attributes()
-        print(f"Flight {self.flight.unique_id} is promoted to manager")
+        self.flight.model.events.emit("promoted", manager=self.flight)
 
     def reset_attributes(self):
         self.free_flights_in_reach = []
         self.received_neighbor_counts = []
-        self.open_auctions = []
+        self.open_auctions.clear()
         self.current_auction = None
         self.favored_auction = {"manager": None, "utility": 0, "start_time": None}
 
         self.contractors_in_auction = []
         self.contractors_dropped_out = []
         self.display_price = None
-        self.leading_exiting_bidder = {"bidder": None, "bid": 0}
+        self.leading_exiting_bidder = Bid(None, 0)
         self.auction_start_time = None
         self.reserve_price = 0
 
@@ -270,34 +259,28 @@ class Japanese:
         if dynamic_price:
 
             # From neighbor contractors, find the one that would provide the highest utility in formation
-            max_utility = 0
             best_neighbor = None
-            for neighbor in self.flight.model.space.get_neighbors(pos=self.flight.pos,
-                                                                  radius=self.flight.communication_range,
-                                                                  include_center=True):
-                if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation":
-                    fuel_saved = self.flight.calculate_potential_fuelsavings(neighbor, individual=True)
-                    delay = self.flight.calculate_potential_delay(neighbor)
-                    if utility_function(fuel_saved, fuel_saved, delay, behavior=self.flight.behavior) > max_utility:
-                        max_utility = utility_function(fuel_saved, fuel_saved, delay, behavior=self.flight.behavior)
-                        best_neighbor = neighbor
+            neighbors = [neighbor for neighbor in self.flight.get_neighbors()
+                         if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation"]
+            if len(neighbors) > 0:
+                fuel_saved = np.array([self.flight.calculate_potential_fuelsavings(neighbor, individual=True)
+                                       for neighbor in neighbors])
+                delay = np.array([self.flight.calculate_potential_delay(neighbor) for neighbor in neighbors])
+                utilities = utility_function(fuel_saved, fuel_saved, delay, behavior=self.flight.behavior)
+                # The first neighbor with the highest (positive) utility
+                best = int(np.argmax(utilities))
+                if utilities[best] > 0:
+                    best_neighbor = neighbors[best]
 
             # Find the bid that contractor would need to pay for positive utility -> this will be the reserve price
             if best_neighbor is not None:
-                reserve_price = 0
                 fuel_saving = self.flight.calculate_potential_fuelsavings(best_neighbor, individual=True)
-                bid_receive = reserve_price / (len(self.flight.agents_in_my_formation) + 1)
                 delay = self.flight.calculate_potential_delay(best_neighbor)
-                while utility_function(fuel_saving + bid_receive, fuel_saving, delay,
-                                       behavior=self.flight.behavior) < 0:
-                    reserve_price += 10
-                    bid_receive = reserve_price / (len(self.flight.agents_in_my_formation) + 1)
-                reserve_price -= 10
-                while utility_function(fuel_saving + bid_receive, fuel_saving, delay,
-                                       behavior=self.flight.behavior) < 0:
-                    reserve_price += 1
-                    bid_receive = reserve_price / (len(self.flight.agents_in_my_formation) + 1)
-                reserve_price -= 1
+                # The first multiple of 10 at which the received share gives a positive utility, minus 11.
+                # (The +1 refinement of the original search never ran, as it checked the share of the
+                # previous bid, so the price ends 11 below that multiple of 10.)
+                reserve_price = stepped_bid(0, fuel_saving, delay, behavior=self.flight.behavior,
+                                            receive_share=len(self.flight.agents_in_my_formation) + 1, step=10) - 11
 
             # If that bid is smaller than 10, set the reserve price to 10
             if best_neighbor is None or reserve_price < 10:
@@ -0,0 +1,56 @@
+'''
+# =============================================================================
+# This file contains the mailbox of the negotiations.
+#
+# A mailbox is a dict of sender -> message (e.g. manager -> end time of its
+# call for contract), so checking whether a sender already posted is a dict
+# lookup instead of a scan of a list. Messages can be posted with an expiry
+# time, which is kept in a heap: expire(time) removes the messages that expired
+# before time, without looking at the ones that didn't.
+# Removing a message (pop, del) leaves its entry in the heap, it is skipped
+# when it comes up.
+# =============================================================================
+'''
+import heapq
+from itertools import count
+
+
+class Mailbox(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expiries = []  # Heap of (expiry, order, sender)
+        self.orders = {}  # sender: order of its latest message with an expiry
+        self.counter = count()
+
+    # =========================================================================
+    #   Post a message, unless the sender already has one in the mailbox.
+    #   Returns whether the message was posted.
+    # =========================================================================
+    def post(self, sender, message, expiry=None):
+        if sender in self:
+            return False
+        self[sender] = message
+        self.orders.pop(sender, None)
+        if expiry is not None:
+            order = next(self.counter)
+            self.orders[sender] = order
+            heapq.heappush(self.expiries, (expiry, order, sender))
+        return True
+
+    # =========================================================================
+    #   Remove the messages with an expiry before time, and return them as a
+    #   list of (sender, message), in order of expiry.
+    # =========================================================================
+    def expire(self, time):
+        expired = []
+        while self.expiries and self.expiries[0][0] < time:
+            expiry, order, sender = heapq.heappop(self.expiries)
+            if sender in self and self.orders.get(sender) == order:
+                del self.orders[sender]
+                expired.append((sender, self.pop(sender)))
+        return expired
+
+    def clear(self):
+        super().clear()
+        self.expiries = []
+        self.orders = {}
@@ -0,0 +1,203 @@
+'''
+# =============================================================================
+# This file contains the centralized matching (negotiation_method 5). It isn't
+# a negotiation between the flights, but a reference to compare them to: a
+# planner that sees all flights decides who flies with whom.
+#
+# At every decision epoch (every interval steps) the planner builds the graph
+# of the possible formations, with the fuel savings as weights:
+#   - two free flights (flying, not in or committed to a formation) can start
+#     a formation (start_formation),
+#   - a free flight can join a formation whose manager accepts new flights
+#     (add_to_formation).
+# Only flights within communication range of each other are connected, and of
+# those only the max_candidates nearest ones, so the graph stays sparse when
+# the fleet is dense. The savings of all partners of a flight are computed in
+# one go (pair_fuel_savings / joining_fuel_savings).
+#
+# The matching with the largest total savings is solved exactly with networkx
+# (when installed, and the graph has at most exact_limit edges), otherwise
+# with the greedy 1/2-approximation: the pairs by decreasing savings, skipping
+# the ones of which a flight was already matched.
+#
+# No money changes hands (bid value 0): the estimated utilities of the flights
+# are their own fuel savings.
+# =============================================================================
+'''
+
+import numpy as np
+
+try:
+    import networkx
+except ImportError:
+    networkx = None
+
+from ..spatial_index import cKDTree
+from ..miscellaneous import pair_fuel_savings, joining_fuel_savings, point_distances
+
+
+FREE = 1
+MANAGER = 2
+
+
+class Matching:
+    def __init__(self, model):
+        self.model = model
+
+        # Properties
+        self.interval = 1  # Steps between two decision epochs
+        self.max_candidates = 32  # Nearest partners of a flight in the graph
+        self.exact_limit = 2000  # Largest graph (in edges) that is matched exactly
+
+        # Per decision epoch: the size of the graph, and how it was matched
+        self.epochs = 0
+        self.last_edges = 0
+        self.last_method = None
+
+    def do_matching(self):
+        model = self.model
+        if model.schedule.steps % self.interval != 0:
+            return
+        flights = model.flight_index.flights
+        roles = np.zeros(len(flights), dtype=np.int8)
+        for i, flight in enumerate(flights):
+            if flight.state != "flying":
+                continue
+            if flight.formation_state == "no_formation" and len(flight.agents_in_my_formation) == 0:
+                roles[i] = FREE
+            elif flight.formation_state == "in_formation" and flight.manager == 1 and flight.accepting_bids == 1 \
+                    and len(flight.agents_in_my_formation) > 0:
+                roles[i] = MANAGER
+        if not np.any(roles == FREE):
+            return
+
+        first, second, savings = self.savings_graph(flights, roles)
+        self.epochs += 1
+        self.last_edges = len(savings)
+        if len(savings) == 0:
+            return
+        pairs = self.match(first, second, savings)
+        if model.events:
+            model.events.emit("matching", edges=len(savings), pairs=len(pairs), method=self.last_method)
+
+        for i, j in sorted(pairs):
+            self.make_formation(flights[i], flights[j])
+
+    # =========================================================================
+    #   Edges (first, second, savings) of the graph: first is the flight that
+    #   starts the formation or the manager of the formation, second the free
+    #   flight that joins it. Only positive savings are kept.
+    # =========================================================================
+    def savings_graph(self, flights, roles):
+        fleet = self.model.fleet
+        if fleet is not None and fleet.size == len(flights):
+            positions = fleet.column("pos")
+            destinations = fleet.column("destination")
+        else:
+            positions = np.array([flight.pos for flight in flights], dtype=float).reshape(-1, 2)
+            destinations = np.array([flight.destination for flight in flights], dtype=float).reshape(-1, 2)
+        candidates = self.candidates(positions, roles)
+
+        first, second, savings = [], [], []
+        for i, partners in candidates:
+            if roles[i] == FREE:
+                # Every pair of free flights once
+                partners = partners[partners > i]
+            if len(partners) == 0:
+                continue
+
+            flight = flights[i]
+            if self.model.profiler:
+                self.model.profiler.count("joining_points", len(partners))
+            if roles[i] == FREE:
+                value = pair_fuel_savings(flight.pos, flight.destination, positions[partners], destinations[partners],
+                                          self.model.fuel_reduction)
+            else:
+                value = joining_fuel_savings(flight.pos, flight.destination, flight.leaving_point,
+                                             len(flight.agents_in_my_formation) + 1, positions[partners],
+                                             destinations[partners], self.model.fuel_reduction)
+            keep = value > 0
+            first.append(np.full(np.count_nonzero(keep), i))
+            second.append(partners[keep])
+            savings.append(value[keep])
+
+        if len(savings) == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+        return np.concatenate(first), np.concatenate(second), np.concatenate(savings)
+
+    # =========================================================================
+    #   The free flights within communication range of every free flight and
+    #   manager (at most the max_candidates nearest), as (i, partners) with the
+    #   partners in index order. With scipy only the nearest are searched,
+    #   otherwise they are taken from the neighbours of the spatial index.
+    # =========================================================================
+    def candidates(self, positions, roles):
+        radius = self.model.flight_index.radius
+        free = np.flatnonzero(roles == FREE)
+        anchors = np.flatnonzero(roles)
+        if cKDTree is not None:
+            k = min(self.max_candidates + 1, len(free))  # + 1: a free flight finds itself
+            tree = cKDTree(positions[free])
+            found, nearest = tree.query(positions[anchors], k=k, distance_upper_bound=radius * (1 + 1e-9))
+            nearest = nearest.reshape(len(anchors), k)
+            for i, row in zip(anchors, nearest):
+                partners = free[row[row < len(free)]]
+                deltas = positions[partners] - positions[i]
+                partners = partners[(partners != i) & (deltas[:, 0] ** 2 + deltas[:, 1] ** 2 <= radius ** 2)]
+                yield i, np.sort(partners[:self.max_candidates])
+            return
+
+        indptr, indices = self.model.flight_index.neighbor_arrays()
+        for i in anchors:
+            partners = indices[indptr[i]:indptr[i + 1]]
+            partners = partners[(roles[partners] == FREE) & (partners != i)]
+            if len(partners) > self.max_candidates:
+                nearest = np.argsort(point_distances(positions[partners], positions[i]), kind="stable")
+                partners = np.sort(partners[nearest[:self.max_candidates]])
+            yield i, partners
+
+    # =========================================================================
+    #   The pairs of the matching, as (first, second) of the edges.
+    # =========================================================================
+    def match(self, first, second, savings):
+        if networkx is not None and len(savings) <= self.exact_limit:
+            self.last_method = "exact"
+            graph = networkx.Graph()
+            graph.add_weighted_edges_from(zip(first.tolist(), second.tolist(), savings.tolist()))
+            matching = networkx.max_weight_matching(graph)
+            edges = set(zip(first.tolist(), second.tolist()))
+            return [(i, j) if (i, j) in edges else (j, i) for i, j in matching]
+
+        self.last_method = "greedy"
+        matched = set()
+        pairs = []
+        for edge in np.lexsort((second, first, -savings)):
+            i, j = int(first[edge]), int(second[edge])
+            if i not in matched and j not in matched:
+                matched.add(i)
+                matched.add(j)
+                pairs.append((i, j))
+        return pairs
+
+    # =========================================================================
+    #   Start the formation of two free flights, or add a free flight to the
+    #   formation of a manager. The savings are checked once more with the
+    #   flights' own calculation.
+    # =========================================================================
+    def make_formation(self, first, second):
+        if len(first.agents_in_my_formation) > 0:
+            if second.calculate_potential_fuelsavings(first) <= 0:
+                return
+            second.manager = 0
+            second.update_role()
+            first.add_to_formation(second, 0, discard_received_bids=True)
+        else:
+            if first.calculate_potential_fuelsavings(second) <= 0:
+                return
+            # Like the greedy algorithm: the flight that starts the formation
+            # isn't its manager, its partner is
+            first.manager = 0
+            second.manager = 1
+            first.start_formation(second, 0, discard_received_bids=True)
+            first.update_role()
+            second.update_role()
@@ -0,0 +1,93 @@
+'''
+# =============================================================================
+# This file contains the records that are passed around in the negotiations.
+#
+# Bid: a bid of a contractor to a manager (made with Flight.make_bid).
+# PendingBid: a bid as the contractor remembers it, until the manager accepted
+#             or refused it.
+# Invitation: a call for contract, or an invitation to an auction, of a manager.
+#
+# The bids a manager received are kept in a BidBook: the bids in the order in
+# which they came in, with their values and validity in parallel arrays, so the
+# new bids and the highest bid are found with array operations.
+# =============================================================================
+'''
+import numpy as np
+
+
+class Bid:
+    __slots__ = ("bidding_agent", "value", "validity", "exp_date")
+
+    def __init__(self, bidding_agent, value, validity=True, exp_date=None):
+        self.bidding_agent = bidding_agent
+        self.value = value
+        self.validity = validity
+        self.exp_date = exp_date
+
+    def __repr__(self):
+        return "Bid({}, {}, {}, {})".format(getattr(self.bidding_agent, "unique_id", None), self.value, self.validity,
+                                           self.exp_date)
+
+
+class PendingBid:
+    __slots__ = ("bid", "time", "accepted")
+
+    def __init__(self, bid, time, accepted=None):
+        self.bid = bid
+        self.time = time
+        self.accepted = accepted  # None until the manager replied
+
+    def __repr__(self):
+        return "PendingBid({}, {}, {})".format(self.bid, self.time, self.accepted)
+
+
+class Invitation:
+    __slots__ = ("manager", "time")
+
+    def __init__(self, manager, time):
+        self.manager = manager
+        self.time = time  # End of the call for contract, or start of the auction
+
+    def __repr__(self):
+        return "Invitation({}, {})".format(self.manager.unique_id, self.time)
+
+
+class BidBook:
+    def __init__(self, capacity=8):
+        self.bids = []
+        self.values = np.empty(capacity)
+        self.validity = np.empty(capacity, dtype=bool)
+
+    def add(self, bid):
+        n = len(self.bids)
+        if n == len(self.values):
+            self.values = np.concatenate((self.values, np.empty(n)))
+            self.validity = np.concatenate((self.validity, np.empty(n, dtype=bool)))
+        self.values[n] = bid.value
+        self.validity[n] = bid.validity
+        self.bids.append(bid)
+
+    # =========================================================================
+    #   The bids that are still valid. They are made invalid, so every bid is
+    #   considered only once.
+    # =========================================================================
+    def take_valid(self):
+        n = len(self.bids)
+        rows = np.flatnonzero(self.validity[:n])
+        self.validity[rows] = False
+        bids = [self.bids[row] for row in rows]
+        for bid in bids:
+            bid.validity = False
+        return bids, self.values[rows]
+
+    def highest_value(self):
+        return self.bids[int(np.argmax(self.values[:len(self.bids)]))].value
+
+    def clear(self):
+        self.bids = []
+
+    def __len__(self):
+        return len(self.bids)
+
+    def __iter__(self):
+        return iter(self.bids)
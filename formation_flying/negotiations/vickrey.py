@@ -5,7 +5,9 @@
 # def do_vickrey(flight):
 #     # the do_vickrey function takes a flight-agent object
 from ..miscellaneous import calc_distance, utility_function
-from random import choices
+from .mailbox import Mailbox
+from .records import Invitation, PendingBid
+import numpy as np
 
 
 class Vickrey:
@@ -20,7 +22,7 @@ class Vickrey:
 
         # Received communications from other agents
         self.received_neighbor_counts = []
-        self.managers_calling = []
+        self.managers_calling = Mailbox()  # manager: Invitation
 
         # Properties
         self.negotiation_window = 10 # The time available for negotiation. Call for contract expires after this duration.
@@ -41,82 +43,74 @@ class Vickrey:
 
     # Negotiation activities for manager agents
     def do_manager(self):
-        print(f"{self.flight.unique_id} does manager")
         # Do not call for contract, while picking up an accepted agent.
         if self.flight.formation_state not in ("committed", "adding_to_formation"):
             # Do not call for contract, when already close to destination
             if  not calc_distance(self.flight.pos, self.flight.destination)/self.flight.speed <= self.negotiation_window:
                 self.call_for_contract()
-                print(f"{self.flight.unique_id} calls for contract with deadline {self.bidding_end_time}")
+                self.flight.model.events.emit("call_for_contract", manager=self.flight, deadline=self.bidding_end_time)
             else:
                 # By setting the bid end time to the past, the manager will be demoted to contractor at the end of its turn
                 self.bidding_end_time = self.flight.model.schedule.steps - 1
 
         # Select a contractor
         # Find the highest bid
-        current_bids = []
-        for bid in self.flight.received_bids:
-            if bid["validity"] is True:
-                current_bids.append(bid)
-                # Change the validity to false, so every bid is considered only once.
-                bid["validity"] = False
+        # The new bids (every bid is considered only once)
+        current_bids, bid_values = self.flight.received_bids.take_valid()
         if len(current_bids) > 0:
-            highest_bid = None
-            highest_utility = None
-            print(f"{self.flight.agent_type}, {self.flight.unique_id} received {len(current_bids)} new bids.")
-            for bid in current_bids:
-                # print(f"Contractor {bid['bidding_agent'].agent_type, bid['bidding_agent'].unique_id}'s bid: {bid['value']}")
-                bid_saving = self.flight.calculate_potential_fuelsavings(bid["bidding_agent"], individual=True)
-                bid_share = bid["value"] / (len(self.flight.agents_in_my_formation) + 1)
-                bid_delay = self.flight.calculate_potential_delay(bid["bidding_agent"])
-                bid_utility = utility_function(bid_saving + bid_share, bid_saving, bid_delay, behavior=self.flight.behavior)
-                print(f"Manager {self.flight.unique_id} is considering bid of {bid['value']} from {bid['bidding_agent'].unique_id} for utility {bid_utility}")
-                if highest_bid is None:
-                    highest_bid = bid.copy()
-                    highest_utility = bid_utility
-                else:
-                    if bid_utility > highest_utility:
-                        highest_bid = bid.copy()
-                        highest_utility = bid_utility
+            self.flight.model.events.emit("bids_received", manager=self.flight, count=len(current_bids))
+            # Score all bids at once, and select the first one with the highest utility
+            bid_savings = np.array([self.flight.calculate_potential_fuelsavings(bid.bidding_agent, individual=True)
+                                    for bid in current_bids])
+            bid_shares = bid_values / (len(self.flight.agents_in_my_formation) + 1)
+            bid_delays = np.array([self.flight.calculate_potential_delay(bid.bidding_agent) for bid in current_bids])
+            bid_utilities = utility_function(bid_savings + bid_shares, bid_savings, bid_delays,
+                                             behavior=self.flight.behavior)
+            if self.flight.model.events:
+                for bid, bid_utility in zip(current_bids, bid_utilities):
+                    self.flight.model.events.emit("bid_considered", manager=self.flight, contractor=bid.bidding_agent,
+                                                  price=bid.value, utility=bid_utility)
+            highest_bid = current_bids[int(np.argmax(bid_utilities))]
             # Communicate refusal to the rest of the contractor agents
             for bid in current_bids:
-                if bid["bidding_agent"] is not highest_bid["bidding_agent"]:
+                if bid.bidding_agent is not highest_bid.bidding_agent:
                     try:
-                        bid["bidding_agent"].vickrey.pending_bids[self.flight]["accepted"] = False
+                        bid.bidding_agent.vickrey.pending_bids[self.flight].accepted = False
                     except KeyError as err:
                         print()
-                        print(bid["bidding_agent"].agent_type, bid["bidding_agent"].unique_id, bid["value"])
-                        print(bid["bidding_agent"].vickrey.pending_bids)
-                        print(self.flight, bid["bidding_agent"].vickrey.pending_bids.keys())
-                        print(self.flight in bid["bidding_agent"].vickrey.pending_bids.keys())
-                        print(bid["bidding_agent"].vickrey.pending_bids[self.flight])
+                        print(bid.bidding_agent.agent_type, bid.bidding_agent.unique_id, bid.value)
+                        print(bid.bidding_agent.vickrey.pending_bids)
+                        print(self.flight, bid.bidding_agent.vickrey.pending_bids.keys())
+                        print(self.flight in bid.bidding_agent.vickrey.pending_bids.keys())
+                        print(bid.bidding_agent.vickrey.pending_bids[self.flight])
                         raise err
 
             # Check if the highest bid meets the acceptance strategy requirements.
             # If a formation is formed, reset received_bids and pending_bids
-            if self.acceptance_strategy(highest_bid["bidding_agent"], highest_bid["value"]) is True:
+            if self.acceptance_strategy(highest_bid.bidding_agent, highest_bid.value) is True:
                 if len(self.flight.agents_in_my_formation) > 0:
-                    self.flight.add_to_formation(list(highest_bid.values())[0],
-                                                 list(highest_bid.values())[1], discard_received_bids=True)
+                    self.flight.add_to_formation(highest_bid.bidding_agent,
+                                                 highest_bid.value, discard_received_bids=True)
                 else:
-                    self.flight.start_formation(list(highest_bid.values())[0],
-                                                list(highest_bid.values())[1], discard_received_bids=True)
+                    self.flight.start_formation(highest_bid.bidding_agent,
+                                                highest_bid.value, discard_received_bids=True)
                 # Communicate acceptance to the contractor agent
-                highest_bid["bidding_agent"].vickrey.pending_bids[self.flight]["accepted"] = True
+                highest_bid.bidding_agent.vickrey.pending_bids[self.flight].accepted = True
                 self.bidding_end_time = None
                 self.flight.accepting_bids = 0
-                print(f"{self.flight.agent_type}, {self.flight.unique_id} selected {highest_bid['bidding_agent'].unique_id}'s bid: {highest_bid['value']}")
+                self.flight.model.events.emit("bid_selected", manager=self.flight, contractor=highest_bid.bidding_agent,
+                                              price=highest_bid.value)
             else:
                 # Communicate refusal to the contractor agent
                 try:
-                    highest_bid["bidding_agent"].vickrey.pending_bids[self.flight]["accepted"] = False
+                    highest_bid.bidding_agent.vickrey.pending_bids[self.flight].accepted = False
                 except KeyError as err:
                     print()
-                    print(highest_bid["bidding_agent"].agent_type, highest_bid["bidding_agent"].unique_id, highest_bid["value"])
-                    print(highest_bid["bidding_agent"].vickrey.pending_bids)
-                    print(self.flight.unique_id, [k.unique_id for k in highest_bid["bidding_agent"].vickrey.pending_bids.keys()])
-                    print(self.flight in highest_bid["bidding_agent"].vickrey.pending_bids.keys())
-                    print(highest_bid["bidding_agent"].vickrey.pending_bids[self.flight])
+                    print(highest_bid.bidding_agent.agent_type, highest_bid.bidding_agent.unique_id, highest_bid.value)
+                    print(highest_bid.bidding_agent.vickrey.pending_bids)
+                    print(self.flight.unique_id, [k.unique_id for k in highest_bid.bidding_agent.vickrey.pending_bids.keys()])
+                    print(self.flight in highest_bid.bidding_agent.vickrey.pending_bids.keys())
+                    print(highest_bid.bidding_agent.vickrey.pending_bids[self.flight])
                     raise err
 
         # Change manager to contractor if it couldn't form a formation by the end of the negotiation window
@@ -124,25 +118,24 @@ class Vickrey:
             self.bidding_end_time = None
             self.flight.accepting_bids = 0
             self.flight.manager = 0
-            self.flight.received_bids = []
+            self.flight.received_bids.clear()
             self.flight.update_role()
-            print(f"Flight {self.flight.unique_id} got demoted to contractor.")
+            self.flight.model.events.emit("demoted", manager=self.flight)
         return
 
     # Negotiation activities for contractor agents
     def do_contractor(self):
-        print(f"{self.flight.unique_id} does contractor")
         # Process any responses to pending bids in pending_bids:
         # A copy of the bids must be created, in order to avoide issuesby removing dict entries while looping.
         refused_bids = []
         accepted_bids = []
         for manager in self.pending_bids:
-            if self.pending_bids[manager]["accepted"] is True:
+            if self.pending_bids[manager].accepted is True:
                 accepted_bids.append(manager)
-                print(f"Contractor {self.flight.unique_id}'s bid to Manager {manager.unique_id} was accepted")
-            elif self.pending_bids[manager]["accepted"] is False:
+                self.flight.model.events.emit("reply", manager=manager, contractor=self.flight, accepted=True)
+            elif self.pending_bids[manager].accepted is False:
                 refused_bids.append(manager)
-                print(f"Contractor {self.flight.unique_id}'s bid to Manager {manager.unique_id} was refused")
+                self.flight.model.events.emit("reply", manager=manager, contractor=self.flight, accepted=False)
         assert len(accepted_bids) <= 1, f"Multiple bids of Flight {self.flight.unique_id} have " \
                                         f"been accepted."
         # Remove refused bids from pending_bids
@@ -158,8 +151,10 @@ class Vickrey:
             utility_score = 0
             selected_manager = None
             selected_bid = 0
-            for i, [manager, end_time] in enumerate(self.managers_calling):
-                if manager.accepting_bids == 1 and end_time >= self.flight.model.schedule.steps:
+            # Remove the expired calls
+            self.managers_calling.expire(self.flight.model.schedule.steps)
+            for manager in list(self.managers_calling):
+                if manager.accepting_bids == 1:
                     fuel_saving = self.flight.calculate_potential_fuelsavings(manager, individual=True)
                     delay = self.flight.calculate_potential_delay(manager)
                     bidding_value = self.bidding_strategy(fuel_saving, manager)
@@ -168,37 +163,27 @@ class Vickrey:
                         utility_score = utility_function(profit, fuel_saving, delay, behavior=self.flight.behavior)
                         selected_manager = manager
                         selected_bid = bidding_value
-                # Remove the expired calls
-                elif end_time < self.flight.model.schedule.steps:
-                    self.managers_calling.pop(i)
-            print(f"Contractor {self.flight.unique_id} has {len(self.managers_calling)} open calls.")
 
             if selected_manager is not None:
                 # TODO: Implement bid expiration date. Currently None.
                 self.flight.make_bid(selected_manager, selected_bid, True, None)
-                print(self.flight.agent_type, self.flight.unique_id, "makes bid to", selected_manager.unique_id, "with value of", selected_bid, "and potential utility of", utility_score)
+                self.flight.model.events.emit("bid", manager=selected_manager, contractor=self.flight, price=selected_bid,
+                                              utility=utility_score)
                 # Save the bid that was made, so it can be used in the bidding strategy
-                self.pending_bids[selected_manager] = {"bid": selected_bid,
-                                                       "time": self.flight.model.schedule.steps,
-                                                       "accepted": None}
+                self.pending_bids[selected_manager] = PendingBid(selected_bid, self.flight.model.schedule.steps)
 
         # If there are no currently pending bids, check if contractor agent can become a manager
         elif self.flight.formation_state is "no_formation" and len(self.pending_bids) == 0:
             # Do not apply for manager, once close to destination, as you wouldn't be able to call for contract anyway
             if not calc_distance(self.flight.pos, self.flight.destination) / self.flight.speed <= self.negotiation_window:
-                print(f"Contractor {self.flight.unique_id} applying for manager")
+                self.flight.model.events.emit("apply_for_manager", contractor=self.flight)
                 self.apply_for_manager()
 
     def bidding_strategy(self, fuel_saving, manager):
         if not manager.received_bids:
             highest_bid = 0.0
         else:
-            all_bids = manager.received_bids
-            received_bids = []
-            for i in range(len(all_bids)):
-                received_bids_dict = all_bids[i]
-                received_bids.append(received_bids_dict['value'])
-                highest_bid = max(received_bids)
+            highest_bid = manager.received_bids.highest_value()
 
         if self.flight.alliance == 1 and manager.flight.alliance == 1:
             selected_bid = fuel_saving
@@ -218,17 +203,17 @@ class Vickrey:
         potential_utility = utility_function(fuel_saving + bid_receive, fuel_saving, delay, behavior=self.flight.behavior)
         current_min_utility = min_utility/(self.flight.model.schedule.steps - self.bidding_end_time + self.negotiation_window + 1)
         if potential_utility >= current_min_utility:
-            print(f"Bid from {bidding_agent.unique_id} of utility {potential_utility} accepted by {self.flight.unique_id} as min utility is {current_min_utility}")
+            self.flight.model.events.emit("bid_accepted", manager=self.flight, contractor=bidding_agent, price=bid_value,
+                                          utility=potential_utility, min_utility=current_min_utility)
             return True
         else:
-            print(f"Bid from {bidding_agent.unique_id} of utility {potential_utility} refused by {self.flight.unique_id} as min utility is {current_min_utility}")
+            self.flight.model.events.emit("bid_refused", manager=self.flight, contractor=bidding_agent, price=bid_value,
+                                          utility=potential_utility, min_utility=current_min_utility)
             return False
 
     def apply_for_manager(self):
         # Look for neighboring contractor flights that don't have a formation yet.
-        for neighbor in self.flight.model.space.get_neighbors(pos=self.flight.pos,
-                                                              radius=self.flight.communication_range,
-                                                              include_center=True):
+        for neighbor in self.flight.get_neighbors():
             if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation":
                 self.free_flights_in_reach.append(neighbor)
         # Contact the neighboring free agents
@@ -244,19 +229,19 @@ class Vickrey:
         for neighbor in self.free_flights_in_reach:
             if neighbor.manager == 1:
                 manager_taken = True
-                print(self.flight.agent_type, self.flight.unique_id, f"stays contractor, {neighbor.unique_id} is already manager.")
+                self.flight.model.events.emit("stays_contractor", manager=neighbor, contractor=self.flight)
                 break
         if len(self.free_flights_in_reach) >= max(self.received_neighbor_counts) and manager_taken is False:
             self.flight.manager = 1
-            print(self.flight.agent_type, self.flight.unique_id, "becomes manager")
+            self.flight.model.events.emit("becomes_manager", manager=self.flight)
         else:
             # Promote some contractors randomly to managers, in order to allow for formations that otherwise wouldn't form.
-            if choices([True, False], weights=[1, 3*self.negotiation_window], k=1)[0]:
+            if self.flight.rng.choices([True, False], weights=[1, 3*self.negotiation_window], k=1)[0]:
                 self.flight.manager = 1
-                print(self.flight.agent_type, self.flight.unique_id, "becomes manager by chance.")
+                self.flight.model.events.emit("becomes_manager", manager=self.flight, by_chance=True)
             else:
                 self.flight.manager = 0
-                print(self.flight.agent_type, self.flight.unique_id, "stays contractor")
+                self.flight.model.events.emit("stays_contractor", contractor=self.flight)
         # After evaluation, reset the relevant lists, and update the role
         self.free_flights_in_reach = []
         self.received_neighbor_counts = []
@@ -267,17 +252,11 @@ class Vickrey:
         if self.bidding_end_time is None:
             self.bidding_end_time = self.flight.model.schedule.steps + self.negotiation_window
             self.flight.accepting_bids = 1
-        for neighbor in self.flight.model.space.get_neighbors(pos=self.flight.pos,
-                                                              radius=self.flight.communication_range,
-                                                              include_center=True):
+        for neighbor in self.flight.get_neighbors():
             if neighbor.agent_type == "Flight" and neighbor.unique_id != self.flight.unique_id and neighbor.manager == 0 and neighbor.formation_state is "no_formation":
                 # Also invite newly available contractors to the ongoing negotiation
-                new_contractor = True
-                for call in neighbor.vickrey.managers_calling:
-                    if call[0] == self.flight:
-                        new_contractor = False
-                if new_contractor:
-                    neighbor.vickrey.managers_calling.append([self.flight, self.bidding_end_time])
+                neighbor.vickrey.managers_calling.post(self.flight, Invitation(self.flight, self.bidding_end_time),
+                                                       expiry=self.bidding_end_time)
         return
 
 
@@ -21,7 +21,8 @@
 # 	communication_range = 200 [km]. Range 
 # 	fuel_reduction = 0.75 [-]. When flying in formation, you use 75% of your original fuel consumption.
 # 	negotiation_method = 0 [-]. Set which negotiation method to use 
-#           (0: greedy algorithm, 1: CNP, 2: English, 3: Vickrey, 4: Japanese).
+#           (0: greedy algorithm, 1: CNP, 2: English, 3: Vickrey, 4: Japanese,
+#           5: centralized matching, a reference for the others).
 #
 # Simulation parameters:
 # 	n_iterations = 1 [-]. Number of simulation runs, used in the batch runner.
@@ -86,7 +87,9 @@ model_reporter_parameters = {"Total Fuel Used": compute_total_fuel_used,
                              "Total planned Fuel": compute_planned_fuel,
                              # "Total saved potential saved fuel": fuel_savings_closed_deals,
                              "Real saved fuel": real_fuel_saved,
-                             "Deal values": total_deal_value}
+                             "Deal values": total_deal_value,
+                             "Economics cache hits": economics_cache_hits,
+                             "Economics cache misses": economics_cache_misses}
 
 # In order to collect values like "deal-value", they should be specified on all agents.
 agent_reporter_parameters = {"Behavior": "behavior",
@@ -0,0 +1,110 @@
+'''
+# =============================================================================
+# In this file the step profiler of the model is defined (profile=True).
+#
+# Every model.step is split into phases, and the time spent in each of them is
+# recorded:
+#   check: the check whether all flights arrived and no deal value was lost,
+#   negotiation: the step of the agents (Flight.step, the negotiation method),
+#   movement: the advance of the agents (Flight.advance, or move_fleet),
+#   collect: datacollector.collect,
+#   fast_forward: the steps that were run at once (see fastforward.py).
+# Next to the times, the profiler counts per step the calls of get_neighbors,
+# the fuel saving evaluations (calculate_potential_fuelsavings) and the
+# joining points that were solved.
+#
+# The profile of every step is available as a DataFrame (dataframe), and as
+# model reporters (profile_reporters, added to the data collector of the model
+# when profiling). The reporters give the profile of the step that is being
+# collected, except for the collect time, which is that of the previous step.
+#
+# When the profiler is disabled it is falsy, and the model and the flights only
+# check it, like the event log:
+#
+#   if self.model.profiler:
+#       self.model.profiler.count("get_neighbors")
+# =============================================================================
+'''
+
+import time
+from functools import partial
+
+import pandas as pd
+
+
+PHASES = ("check", "negotiation", "movement", "collect", "fast_forward")
+COUNTERS = ("get_neighbors", "fuel_savings", "joining_points")
+NEGOTIATION_METHODS = {0: "greedy", 1: "CNP", 2: "English", 3: "Vickrey", 4: "Japanese", 5: "matching"}
+
+
+class StepProfiler:
+    def __init__(self, model=None, enabled=True):
+        self.model = model
+        self.enabled = enabled
+        self.rows = []
+        self.current = None
+        self.last_time = None
+
+    def __bool__(self):
+        return self.enabled
+
+    # =========================================================================
+    #   Start a new row at the start of model.step, and record the time since
+    #   the previous lap (or the start of the step) as the time of a phase.
+    # =========================================================================
+    def start_step(self):
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.current.update(dict.fromkeys(COUNTERS, 0))
+        self.current["step"] = self.model.schedule.steps if self.model is not None else len(self.rows)
+        self.last_time = time.perf_counter()
+        self.current["start"] = self.last_time
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.last_time
+        self.last_time = now
+
+    def end_step(self):
+        row = self.current
+        row["total"] = time.perf_counter() - row.pop("start")
+        if self.model is not None:
+            row["steps"] = self.model.schedule.steps - row["step"]
+        self.rows.append(row)
+
+    def count(self, counter, n=1):
+        if self.current is not None:
+            self.current[counter] += n
+
+    def value(self, name):
+        if name == "collect":
+            return self.rows[-1]["collect"] if self.rows else None
+        return self.current[name] if self.current is not None else None
+
+    # =========================================================================
+    #   One row per model.step, indexed by the step at which it started.
+    #   steps is the number of steps it ran (more than 1 when fast-forwarding).
+    # =========================================================================
+    def dataframe(self):
+        columns = ["step", "steps"] + list(PHASES) + ["total"] + list(COUNTERS)
+        data = pd.DataFrame(self.rows, columns=columns).set_index("step")
+        if self.model is not None:
+            data["negotiation_method"] = NEGOTIATION_METHODS.get(self.model.negotiation_method,
+                                                                 self.model.negotiation_method)
+        return data
+
+    # =========================================================================
+    #   Total time per phase, the counts, and their share of the total time.
+    # =========================================================================
+    def summary(self):
+        data = self.dataframe()
+        totals = data[list(PHASES) + ["total"]].sum()
+        return pd.DataFrame({"seconds": totals, "share": totals / totals["total"]})
+
+
+# A partial instead of a closure, so the reporters can be pickled with the model (see checkpoint.py)
+def profile_value(model, name):
+    return model.profiler.value(name) if model.profiler else None
+
+
+profile_reporters = {"Profile {}".format(name.replace("_", " ")): partial(profile_value, name=name)
+                     for name in PHASES + COUNTERS}
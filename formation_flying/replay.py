@@ -0,0 +1,116 @@
+'''
+# =============================================================================
+# In this file the replay files are defined.
+#
+# A replay file records what is needed to run a model again, exactly: the
+# seed, the parameters of the model, the engine it ran with (the scheduler,
+# the movement engine, ...: the parameters that don't change the results) and
+# a fingerprint of the result. The fingerprint is made up of the number of
+# steps, the fuel, the formation counters and a hash of the final state of all
+# flights.
+#
+# replay runs the model again and checks that the fingerprint is the same. The
+# engine can be swapped, to check that a faster engine gives the same result
+# as the one the run was recorded with:
+#
+#   save_replay(model, "run.json")
+#   replay("run.json")
+#   replay("run.json", engine={"scheduler": "simultaneous", "movement_engine": "agent"})
+#
+# The event log file of the recorded run is left alone: a replay only writes
+# an event log when engine asks for one, at another path.
+# =============================================================================
+'''
+
+import hashlib
+import json
+import platform
+
+import mesa
+import numpy as np
+
+
+# The parameters of the model that don't change the results
+# (fast_forward is not one of them, it is the same up to rounding, see fastforward.py)
+ENGINE_PARAMETERS = ("scheduler", "movement_engine", "fleet_store", "economics_cache", "greedy_engine",
+                     "verify_joining_point", "collector", "collect_interval", "collect_mode", "event_log", "profile")
+
+
+def fleet_digest(model):
+    flights = sorted((agent for agent in model.schedule.agents if getattr(agent, "agent_type", None) == "Flight"),
+                     key=lambda flight: flight.unique_id)
+    state = hashlib.sha256()
+    for flight in flights:
+        state.update(repr((flight.unique_id, tuple(flight.pos), flight.state, flight.formation_state,
+                           flight.fuel_consumption, flight.deal_value, flight.real_flight_time,
+                           flight.distance_in_formation, flight.behavior, flight.manager)).encode())
+    return state.hexdigest()
+
+
+def fingerprint(model):
+    return {"steps": model.schedule.steps,
+            "running": model.running,
+            "total_fuel_consumption": float(model.total_fuel_consumption),
+            "total_flight_time": int(model.total_flight_time),
+            "new_formation_counter": model.new_formation_counter,
+            "add_to_formation_counter": model.add_to_formation_counter,
+            "fleet": fleet_digest(model)}
+
+
+def make_record(model):
+    params = dict(model.params)
+    if "branch" in params:
+        raise Exception("A branch of a fork (see checkpoint.py) can't be replayed from its parameters")
+    seed = params.pop("seed")
+    engine = {name: params.pop(name) for name in ENGINE_PARAMETERS if name in params}
+    return {"seed": seed,
+            "params": params,
+            "engine": engine,
+            "fingerprint": fingerprint(model),
+            "versions": {"python": platform.python_version(), "numpy": np.__version__, "mesa": mesa.__version__}}
+
+
+def save_replay(model, path):
+    with open(path, "w") as file:
+        json.dump(make_record(model), file, indent=1)
+
+
+def load_replay(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+# =============================================================================
+#   Run the model of a replay file (or record) again, for as many steps as
+#   the recorded run. engine: parameters of the engine to change.
+#   With check, an exception is raised when the result differs.
+# =============================================================================
+def replay(path_or_record, engine=None, check=True, model_cls=None):
+    if model_cls is None:
+        from .model import FormationFlying
+        model_cls = FormationFlying
+    record = path_or_record if isinstance(path_or_record, dict) else load_replay(path_or_record)
+
+    params = dict(record["params"], **record["engine"])
+    recorded_log = params.get("event_log")
+    if recorded_log not in (None, "memory"):
+        # The model would open the file with "w", and overwrite the log of the recorded run
+        params["event_log"] = None
+    params.update(engine or {})
+    if recorded_log not in (None, "memory") and params.get("event_log") == recorded_log:
+        raise Exception("The replay would overwrite the event log of the recorded run ({}), "
+                        "give it another event_log".format(recorded_log))
+    model = model_cls(seed=record["seed"], **params)
+    steps = record["fingerprint"]["steps"]
+    while model.running and model.schedule.steps < steps:
+        model.step()
+    model.close()
+
+    if check:
+        expected = record["fingerprint"]
+        result = fingerprint(model)
+        differences = {name: (expected[name], result.get(name)) for name in expected
+                       if expected[name] != result.get(name)}
+        if differences:
+            raise Exception("The replay differs from the recorded run (recorded, replayed): {}".format(differences))
+    return model
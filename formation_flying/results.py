@@ -0,0 +1,155 @@
+'''
+# =============================================================================
+# In this file the storage of the results of a batch is defined.
+#
+# ResultSink writes the model and agent reporters of every run to its own pair
+# of files as soon as the run is finished, in a folder per negotiation method,
+# per value of the variable parameters and per iteration:
+#
+#   <folder>/negotiation_method=1/communication_range=200/iteration=0/agent.parquet
+#   <folder>/negotiation_method=1/communication_range=200/iteration=0/model.parquet
+#
+# load_results reads them back into one table, with the same columns as the
+# tables of the batch runner (parameters, Run, AgentId and the reporters).
+#
+# The file format is a backend: "parquet" and "feather" need pyarrow (parquet
+# also works with fastparquet), "pickle" only needs pandas. Other formats can be
+# added with register_backend. Excel is only available as an export, see
+# export_excel, as it is far too slow for the agent tables.
+# =============================================================================
+'''
+
+import glob
+import os
+
+import pandas as pd
+
+
+# =============================================================================
+#   name: (file extension, write(dataframe, path), read(path))
+# =============================================================================
+backends = {}
+
+
+def register_backend(name, extension, write, read):
+    backends[name] = (extension, write, read)
+
+
+register_backend("parquet", ".parquet", lambda data, path: data.to_parquet(path, index=False), pd.read_parquet)
+register_backend("feather", ".feather", lambda data, path: data.reset_index(drop=True).to_feather(path),
+                 pd.read_feather)
+register_backend("pickle", ".pkl", lambda data, path: data.to_pickle(path), pd.read_pickle)
+
+
+def default_backend():
+    for module in ("pyarrow", "fastparquet"):
+        try:
+            __import__(module)
+            return "parquet"
+        except ImportError:
+            pass
+    return "pickle"
+
+
+def partition_name(name, value):
+    # Characters that can't be used in folder names on all platforms
+    value = str(value)
+    for character in '<>:"/\\|?*':
+        value = value.replace(character, "_")
+    return f"{name}={value}"
+
+
+class ResultSink:
+    def __init__(self, folder, backend=None):
+        self.folder = folder
+        self.backend = backend or default_backend()
+        if self.backend not in backends:
+            raise Exception("Unknown result backend {}".format(self.backend))
+
+    def partition(self, parameters, variable_parameters, iteration):
+        folders = [partition_name("negotiation_method", parameters.get("negotiation_method"))]
+        folders += [partition_name(name, parameters[name]) for name in variable_parameters
+                    if name != "negotiation_method"]
+        folders.append(partition_name("iteration", iteration))
+        return os.path.join(self.folder, *folders)
+
+    # =========================================================================
+    #   Write one run of a ParallelBatchRunner (see batch.py), for example:
+    #       for model_key, model_vars, agent_vars in batch_run.iter_results():
+    #           sink.write_run(batch_run, model_key, model_vars, agent_vars)
+    # =========================================================================
+    def write_run(self, runner, model_key, model_vars, agent_vars):
+        variable_parameters = list(runner.parameters_list[0]) if runner.parameters_list else []
+        parameters = runner.run_parameters[model_key]
+        keys = dict(zip(variable_parameters + ["Run"], model_key))
+        path = self.partition(parameters, variable_parameters, runner.run_iterations[model_key])
+
+        model_data = agent_data = None
+        if model_vars is not None:
+            model_data = report_table([dict(keys, **model_vars)], runner.fixed_parameters)
+        if agent_vars is not None:
+            agent_data = report_table([dict(keys, AgentId=agent_id, **reports)
+                                       for agent_id, reports in agent_vars.items()], runner.fixed_parameters)
+        self.write(path, model_data, agent_data)
+
+    def write(self, path, model_data=None, agent_data=None):
+        extension, write, read = backends[self.backend]
+        os.makedirs(path, exist_ok=True)
+        for table, data in (("model", model_data), ("agent", agent_data)):
+            if data is not None:
+                write(data, os.path.join(path, table + extension))
+
+
+# =============================================================================
+#   Parameters, Run and AgentId first, then the reporters in alphabetical order
+#   and then the fixed parameters, like the tables of mesa's BatchRunner.
+# =============================================================================
+def report_table(records, fixed_parameters):
+    data = pd.DataFrame(records)
+    columns = list(data.columns)
+    first = columns[:columns.index("AgentId" if "AgentId" in columns else "Run") + 1]
+    data = data[first + sorted(column for column in columns if column not in first)]
+    for name, value in fixed_parameters.items():
+        data[name] = [value] * len(data)
+    return data
+
+
+def partition_values(path):
+    values = {}
+    for folder in os.path.normpath(path).split(os.sep):
+        if "=" in folder:
+            name, value = folder.split("=", 1)
+            values[name] = value
+    return values
+
+
+# =============================================================================
+#   Load a table ("model" or "agent") of the results in a folder written by
+#   ResultSink, sorted by Run. Only the partitions that match the filters are
+#   read, e.g. load_results("results", "agent", negotiation_method=1).
+#   A single file is read as well (e.g. the Excel files of older batches).
+# =============================================================================
+def load_results(path, table="agent", **filters):
+    if os.path.isfile(path):
+        if path.endswith((".xlsx", ".xls")):
+            # Written with DataFrame.to_excel, the first column is the index
+            return pd.read_excel(path, index_col=0)
+        for extension, write, read in backends.values():
+            if path.endswith(extension):
+                return read(path)
+        raise Exception("Unknown result file {}".format(path))
+
+    tables = []
+    for extension, write, read in backends.values():
+        for file in sorted(glob.glob(os.path.join(path, "**", table + extension), recursive=True)):
+            values = partition_values(os.path.relpath(os.path.dirname(file), path))
+            if all(values.get(name) == partition_name(name, value).split("=", 1)[1]
+                   for name, value in filters.items()):
+                tables.append(read(file))
+    if len(tables) == 0:
+        raise Exception("No {} results found in {}".format(table, path))
+    return pd.concat(tables, ignore_index=True).sort_values(by="Run", kind="stable", ignore_index=True)
+
+
+def export_excel(path, excel_path, table="agent", **filters):
+    load_results(path, table, **filters).to_excel(excel_path)
@@ -0,0 +1,191 @@
+'''
+# =============================================================================
+# In this file the schedulers of the model are defined.
+#
+# FleetActivation activates the agents like SimultaneousActivation: first the
+# step of all agents (the negotiations), then their advance (the movement).
+# With movement_engine="fleet" the flights are not advanced one by one, but all
+# at once by move_fleet (see movement.py).
+#
+# EventActivation (scheduler="event") does the same, but only for the agents
+# for which something can happen: the flights that departed and didn't arrive
+# yet (or are still in a formation), and the airports that still have to close. The step and advance of the
+# other agents do nothing, so the results are the same. The scheduled flights
+# wait in a priority queue on their departure time, and the number of arrived
+# flights is kept up to date, so the cost of a step scales with the number of
+# flights in the air instead of the size of the fleet.
+# =============================================================================
+'''
+
+import heapq
+from bisect import bisect_left, insort
+
+import numpy as np
+from mesa.time import SimultaneousActivation
+
+from .agents.flight import Flight
+from .movement import move_fleet
+
+
+class FleetActivation(SimultaneousActivation):
+    def step(self):
+        profiler = self.model.profiler
+        agent_keys = list(self._agents.keys())
+        for agent_key in agent_keys:
+            self._agents[agent_key].step()
+        if profiler:
+            profiler.lap("negotiation")
+
+        if self.model.movement_engine != "fleet":
+            for agent_key in agent_keys:
+                self._agents[agent_key].advance()
+        else:
+            for agent_key in agent_keys:
+                agent = self._agents[agent_key]
+                if type(agent) is not Flight:
+                    agent.advance()
+            move_fleet(self.model)
+        self.steps += 1
+        self.time += 1
+        if profiler:
+            profiler.lap("movement")
+
+    # =========================================================================
+    #   An agent that got something to do after it was added (an airport that
+    #   got a closure time, see checkpoint.py, or an arrived flight that was
+    #   taken into a formation, see Flight.start_formation). All agents are
+    #   activated anyway.
+    # =========================================================================
+    def activate(self, agent):
+        pass
+
+    # =========================================================================
+    #   Used by the model to check whether the run is finished, and that no
+    #   deal value was created or lost.
+    # =========================================================================
+    def all_arrived(self):
+        for agent in self._agents.values():
+            if type(agent) is Flight and agent.state != "arrived":
+                return False
+        return True
+
+    def total_deal_value(self):
+        total_deal_value = 0
+        for agent in self._agents.values():
+            if type(agent) is Flight:
+                total_deal_value += agent.deal_value
+        return total_deal_value
+
+
+class EventActivation(FleetActivation):
+    def __init__(self, model):
+        super().__init__(model)
+        self.order = {}  # unique_id: position in the schedule
+        self.departures = []  # Heap of (departure_time, order, unique_id) of the scheduled flights
+        self.scheduled = set()
+        self.active = []  # Sorted (order, unique_id) of the departed flights and the airports that will close
+        self.arrived = set()
+        self.n_flights = 0
+
+    def add(self, agent):
+        super().add(agent)
+        order = len(self.order)
+        self.order[agent.unique_id] = order
+        if type(agent) is Flight:
+            self.n_flights += 1
+            if agent.state == "arrived":
+                self.arrived.add(agent.unique_id)
+            elif agent.state == "scheduled":
+                self.scheduled.add(agent.unique_id)
+                heapq.heappush(self.departures, (agent.departure_time, order, agent.unique_id))
+            else:
+                insort(self.active, (order, agent.unique_id))
+        elif getattr(agent, "closure_time", 0) != 0:
+            insort(self.active, (order, agent.unique_id))
+
+    def remove(self, agent):
+        super().remove(agent)
+        if type(agent) is Flight:
+            self.n_flights -= 1
+        self.scheduled.discard(agent.unique_id)
+        self.arrived.discard(agent.unique_id)
+        self.active = [entry for entry in self.active if entry[1] != agent.unique_id]
+        self.departures = [entry for entry in self.departures if entry[2] != agent.unique_id]
+        heapq.heapify(self.departures)
+
+    # =========================================================================
+    #   Put an agent back in the active list. A flight that arrived without a
+    #   formation was taken out, but it can still be taken into a formation
+    #   as a manager (e.g. by the greedy method). When that formation is
+    #   disbanded, it is set to flying again and has to arrive once more.
+    #   Scheduled flights are added when they depart.
+    # =========================================================================
+    def activate(self, agent):
+        if agent.unique_id in self.scheduled:
+            return
+        entry = (self.order[agent.unique_id], agent.unique_id)
+        index = bisect_left(self.active, entry)
+        if index == len(self.active) or self.active[index] != entry:
+            self.active.insert(index, entry)
+
+    def step(self):
+        profiler = self.model.profiler
+        # The negotiations of the flights in the air, and the airports that will close. A copy, as a
+        # negotiation can activate a flight that arrived (its step does nothing in this step).
+        for order, key in list(self.active):
+            self._agents[key].step()
+        if profiler:
+            profiler.lap("negotiation")
+
+        # The flights that depart in this step are moved as well
+        while self.departures and self.departures[0][0] <= self.steps:
+            departure_time, order, key = heapq.heappop(self.departures)
+            self.scheduled.discard(key)
+            insort(self.active, (order, key))
+
+        if self.model.movement_engine != "fleet":
+            for order, key in self.active:
+                self._agents[key].advance()
+        else:
+            rows = []
+            for order, key in self.active:
+                agent = self._agents[key]
+                if type(agent) is Flight:
+                    rows.append(agent.fleet_index)
+                else:
+                    agent.advance()
+            move_fleet(self.model, np.array(rows, dtype=int))
+
+        self.update_arrivals()
+        self.steps += 1
+        self.time += 1
+        if profiler:
+            profiler.lap("movement")
+
+    # =========================================================================
+    #   Move the flights that arrived out of the active list, and the airports
+    #   that closed. An arrived flight that is still in a formation stays
+    #   active: when a formation mate disbands the formation (see Flight.move),
+    #   it is set to flying again and arrives once more in its own move.
+    # =========================================================================
+    def update_arrivals(self):
+        done = set()
+        for order, key in self.active:
+            agent = self._agents[key]
+            if type(agent) is Flight:
+                if agent.state == "arrived":
+                    self.arrived.add(key)
+                    if len(agent.agents_in_my_formation) == 0:
+                        done.add(key)
+                else:
+                    self.arrived.discard(key)
+            elif agent.airport_type == "Closed":
+                done.add(key)
+        if done:
+            self.active = [entry for entry in self.active if entry[1] not in done]
+
+    def all_arrived(self):
+        return len(self.arrived) == self.n_flights
+
+    def total_deal_value(self):
+        return self.model.deal_value_balance
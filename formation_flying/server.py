@@ -13,6 +13,7 @@ from mesa.visualization.modules import ChartModule
 
 from formation_flying.model import FormationFlying
 from formation_flying.SimpleContinuousModule import SimpleCanvas
+from formation_flying.background_server import BackgroundServer, SimulationControl
 from formation_flying.agents.flight import Flight
 from formation_flying.agents.airports import Airport
 from formation_flying.parameters import model_params
@@ -65,5 +66,19 @@ formation_canvas = SimpleCanvas(boid_draw, 500, 500)
 
 chart = ChartModule([{"Label": "Total Fuel Used", "Color": "Black"}],
                     data_collector_name='datacollector')
-server = ModularServer(FormationFlying, [formation_canvas, chart], "Formations", model_params)
+
+# With background=True the model runs at full speed in a background thread,
+# and the browser gets a snapshot every snapshot_interval seconds (and/or every
+# snapshot_steps steps), with buttons to skip ahead to the next formation or a
+# given step (see background_server.py). Otherwise the browser steps the model
+# once per frame.
+background = False
+snapshot_steps = None
+snapshot_interval = 0.25
+
+if background:
+    server = BackgroundServer(FormationFlying, [SimulationControl(), formation_canvas, chart], "Formations",
+                              model_params, snapshot_steps=snapshot_steps, snapshot_interval=snapshot_interval)
+else:
+    server = ModularServer(FormationFlying, [formation_canvas, chart], "Formations", model_params)
 server.launch()
\ No newline at end of file
@@ -14,6 +14,18 @@ var ContinuousVisualization = function(height, width, context) {
 
 	};
 
+	// Agents as [id, x, y, style], with x and y in pixels
+	this.drawPixels = function(agents, styles) {
+		for (var id in agents) {
+			var agent = agents[id];
+			var p = styles[agent[3]];
+			if (p.Shape == "rect")
+				this.drawRectangle(agent[1] / width, agent[2] / height, p.w, p.h, p.Color, p.Filled);
+			if (p.Shape == "circle")
+				this.drawCircle(agent[1] / width, agent[2] / height, p.r, p.Color, p.Filled);
+		};
+	};
+
 	this.drawCircle = function(x, y, radius, color, fill) {
 		var cx = x * width;
 		var cy = y * height;
@@ -71,12 +83,40 @@ var Simple_Continuous_Module = function(canvas_width, canvas_height) {
 	var context = canvas.getContext("2d");
 	var canvasDraw = new ContinuousVisualization(canvas_width, canvas_height, context);
 
+	// Delta frames (see SimpleContinuousModule.py): the agents as they were
+	// last sent, id -> [id, x, y, style] with x and y in pixels, and the styles.
+	var agents = {};
+	var styles = {};
+
 	this.render = function(data) {
+		if (Array.isArray(data)) {
+			// Full portrayals of all agents
+			canvasDraw.resetCanvas();
+			canvasDraw.draw(data);
+			return;
+		}
+		if (data.skip)
+			return;
+		if (data.full) {
+			agents = {};
+			styles = {};
+		}
+		for (var style in data.styles)
+			styles[style] = data.styles[style];
+		for (var i = 0; i < data.changed.length; i++) {
+			var change = data.changed[i];
+			agents[change[0]] = change;
+		}
+		for (var i = 0; i < data.removed.length; i++)
+			delete agents[data.removed[i]];
+
 		canvasDraw.resetCanvas();
-		canvasDraw.draw(data);
+		canvasDraw.drawPixels(agents, styles);
 	};
 
 	this.reset = function() {
+		agents = {};
+		styles = {};
 		canvasDraw.resetCanvas();
 	};
 
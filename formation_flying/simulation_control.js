@@ -0,0 +1,39 @@
+var SimulationControl = function() {
+	// The state of the model in the last frame, and the buttons to skip ahead
+	// (see background_server.py).
+	var tag = "<div>";
+	tag += "<p class='lead'></p>";
+	tag += "<button type='button' class='btn btn-default skip-formation'>Skip to next formation</button> ";
+	tag += "<input type='number' min='0' step='1' class='skip-step' style='width: 6em' placeholder='step'/> ";
+	tag += "<button type='button' class='btn btn-default skip-to-step'>Skip to step</button>";
+	tag += "</div>";
+	var div = $(tag)[0];
+	$("#elements").append(div);
+	var text = $(div).find(".lead");
+
+	// The frame at the target is sent on the next request, so ask for it
+	// when the model isn't running in the browser.
+	var skip = function(message) {
+		send(message);
+		if (!controller.running && !controller.finished)
+			controller.step();
+	};
+
+	$(div).find(".skip-formation").on("click", function() {
+		skip({"type": "skip"});
+	});
+	$(div).find(".skip-to-step").on("click", function() {
+		var step = parseInt($(div).find(".skip-step").val());
+		if (!isNaN(step))
+			skip({"type": "skip", "step": step});
+	});
+
+	this.render = function(data) {
+		text.html("Model step: " + data.step + ", new formations: " + data.new_formations +
+			", added to formations: " + data.added_to_formations);
+	};
+
+	this.reset = function() {
+		text.html("");
+	};
+};
@@ -0,0 +1,135 @@
+'''
+# =============================================================================
+# In this file the spatial index of the flights is defined.
+#
+# Flights only move in the advance of a step, so during the negotiations the
+# neighbours within the communication range can be found for the whole fleet at
+# once. The index is rebuilt the first time it is queried in a step, and then
+# answers every get_neighbors of that step from the stored neighbour lists.
+# Airports are not part of the index.
+#
+# A scipy cKDTree is used when scipy is installed, otherwise a uniform grid with
+# cells the size of the communication range.
+# =============================================================================
+'''
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class FlightIndex:
+    def __init__(self, model, radius, method=None):
+        self.model = model
+        self.radius = radius
+        if method is None:
+            method = "kdtree" if cKDTree is not None else "grid"
+        if method == "kdtree" and cKDTree is None:
+            raise ImportError("The kdtree spatial index requires scipy")
+        self.method = method
+
+        self.flights = []  # In the order in which they were placed in the space
+        self.positions = None
+        self.built_step = None
+
+        # Neighbour lists in compressed form: the neighbours of flight i are
+        # self.flights[j] for j in indices[indptr[i]:indptr[i + 1]]
+        self.indptr = None
+        self.indices = None
+        self.neighbor_lists = {}
+
+    def invalidate(self):
+        self.built_step = None
+
+    def add(self, flight):
+        flight.index_position = len(self.flights)
+        self.flights.append(flight)
+        self.built_step = None
+
+    # =========================================================================
+    #   Find all pairs of flights within the radius, for all flights at once.
+    # =========================================================================
+    def rebuild(self):
+        fleet = self.model.fleet
+        if fleet is not None and fleet.size == len(self.flights):
+            # Flights are added to the index in the same order as to the fleet store
+            self.positions = fleet.column("pos").copy()
+        else:
+            self.positions = np.array([flight.pos for flight in self.flights], dtype=float).reshape(-1, 2)
+        if self.method == "kdtree":
+            pairs = self.kdtree_pairs()
+        else:
+            pairs = self.grid_pairs()
+
+        # Use the same distance test as ContinuousSpace.get_neighbors, so both give the same neighbours
+        deltas = self.positions[pairs[:, 0]] - self.positions[pairs[:, 1]]
+        pairs = pairs[deltas[:, 0] ** 2 + deltas[:, 1] ** 2 <= self.radius ** 2]
+
+        # Every flight is its own neighbour (include_center), pairs count in both directions
+        n = len(self.flights)
+        own = np.arange(n)
+        rows = np.concatenate((pairs[:, 0], pairs[:, 1], own))
+        columns = np.concatenate((pairs[:, 1], pairs[:, 0], own))
+        order = np.lexsort((columns, rows))
+        self.indices = columns[order]
+        self.indptr = np.zeros(n + 1, dtype=int)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+        self.neighbor_lists = {}
+        self.built_step = self.model.schedule.steps
+
+    def kdtree_pairs(self):
+        tree = cKDTree(self.positions)
+        # Slightly larger radius, the exact test is done afterwards
+        return tree.query_pairs(self.radius * (1 + 1e-9), output_type="ndarray").reshape(-1, 2)
+
+    def grid_pairs(self):
+        cells = np.floor(self.positions / self.radius).astype(int)
+        grid = {}
+        for i, cell in enumerate(map(tuple, cells)):
+            grid.setdefault(cell, []).append(i)
+
+        pairs = []
+        for (cx, cy), members in grid.items():
+            members = np.array(members)
+            for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+                others = grid.get((cx + dx, cy + dy))
+                if others is None:
+                    continue
+                first, second = np.meshgrid(members, np.array(others), indexing="ij")
+                first, second = first.ravel(), second.ravel()
+                if dx == 0 and dy == 0:
+                    keep = first < second
+                    first, second = first[keep], second[keep]
+                pairs.append(np.column_stack((first, second)))
+        if len(pairs) == 0:
+            return np.empty((0, 2), dtype=int)
+        return np.concatenate(pairs)
+
+    # =========================================================================
+    #   The flights within the radius of a flight (itself included), in the
+    #   order in which they were placed in the space.
+    # =========================================================================
+    def get_neighbors(self, flight, radius=None):
+        if radius is not None and radius != self.radius:
+            return self.model.space.get_neighbors(pos=flight.pos, radius=radius, include_center=True)
+        if self.built_step != self.model.schedule.steps:
+            self.rebuild()
+        i = flight.index_position
+        try:
+            return self.neighbor_lists[i]
+        except KeyError:
+            flights = self.flights
+            neighbors = [flights[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+            self.neighbor_lists[i] = neighbors
+            return neighbors
+
+    # =========================================================================
+    #   Neighbour index arrays of all flights, for batched computations.
+    # =========================================================================
+    def neighbor_arrays(self):
+        if self.built_step != self.model.schedule.steps:
+            self.rebuild()
+        return self.indptr, self.indices